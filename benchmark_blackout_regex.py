@@ -0,0 +1,300 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark the blackout matching hot path, on synthetic Blackouts and alerts.
+
+Runs offline, using the same mocked ``alerta`` modules as the tests::
+
+    python benchmark_blackout_regex.py --blackouts 2000 --alerts 20000 \
+        --match-ratio 0.1 --output results.json
+
+The alternative matching strategies can be compared on the same corpus, by
+registering them with :func:`register_strategy`, or from the command line,
+with ``--strategy module:factory``, where *factory* is called with the list of
+Blackouts and returns a callable evaluating an alert.
+"""
+import sys
+import json
+import time
+import random
+import argparse
+import datetime
+import platform
+import importlib
+import tracemalloc
+
+import test_blackout_regex as mocks  # installs the mocked alerta modules
+
+import blackout_regex
+
+SITES = ["ams", "fra", "lon", "par", "nyc", "sjc", "sin", "syd"]
+
+STRATEGIES = {}
+
+
+def register_strategy(name, factory):
+    """
+    Register a matching strategy: ``factory`` is called with the list of
+    Blackouts, and returns a callable evaluating an alert.
+    """
+    STRATEGIES[name] = factory
+
+
+def _plugin(config=None):
+    def factory(blackouts):
+        # The Blackouts are retrieved from the mocked DB.
+        with mocks.patch.dict(mocks.CONFIG, config or {}):
+            plugin = blackout_regex.BlackoutRegex()
+        plugin._fetch_rules()
+        return plugin.pre_receive
+
+    return factory
+
+
+def _engine(engine):
+    def factory(blackouts):
+        rules = blackout_regex.RuleSet(
+            [mocks.Blackout(**blackout) for blackout in blackouts], engine=engine
+        )
+        return lambda alert: blackout_regex.evaluate(rules, alert)
+
+    return factory
+
+
+register_strategy("plugin", _plugin())
+register_strategy(
+    "plugin-no-match-cache", _plugin({"BLACKOUT_REGEX_MATCH_CACHE_SIZE": 0})
+)
+for _name in blackout_regex.MATCHERS:
+    register_strategy(_name, _engine(_name))
+
+
+def make_corpus(blackouts=1000, alerts=10000, match_ratio=0.1, seed=0):
+    """
+    Generate ``blackouts`` Blackouts, with literal, prefix, alternation, tag
+    and service patterns, and ``alerts`` alerts, of which about
+    ``match_ratio`` match one of the Blackouts. Returns the Blackouts and the
+    alerts, as dictionaries.
+    """
+    rnd = random.Random(seed)
+    corpus = []
+    samples = []
+    for index in range(blackouts):
+        site = rnd.choice(SITES)
+        kind = rnd.choice(["literal", "prefix", "alternation", "tags", "service"])
+        blackout = mocks.make_blackout(str(index), environment="Production")
+        sample = {}
+        if kind == "literal":
+            blackout["resource"] = "^host-{}$".format(index)
+            sample["resource"] = "host-{}".format(index)
+        elif kind == "prefix":
+            blackout["resource"] = r"^edge-{}{}-\d+".format(site, index)
+            sample["resource"] = "edge-{}{}-{}".format(site, index, rnd.randint(0, 99))
+        elif kind == "alternation":
+            blackout["resource"] = r"(core|agg)-{}\.{}".format(index, site)
+            sample["resource"] = "{}-{}.{}".format(
+                rnd.choice(["core", "agg"]), index, site
+            )
+        elif kind == "tags":
+            blackout["tags"] = ["site={}{}.*".format(site, index), "role=router"]
+            sample["tags"] = ["site={}{}a".format(site, index), "role=router"]
+        else:
+            blackout["service"] = ["^svc-{}-.*".format(index)]
+            sample["service"] = ["svc-{}-api".format(index)]
+        corpus.append(blackout)
+        samples.append(sample)
+    generated = []
+    for index in range(alerts):
+        alert = {
+            "id": "alert-{}".format(index),
+            "environment": "Production",
+            "customer": None,
+            "resource": "nomatch-{}".format(rnd.randint(0, alerts)),
+            "event": "NodeDown",
+            "group": "Network",
+            "service": ["other"],
+            "tags": ["site=xyz{}".format(rnd.randint(0, 100)), "role=switch"],
+            "status": "open",
+        }
+        if samples and rnd.random() < match_ratio:
+            alert.update(rnd.choice(samples))
+        generated.append(alert)
+    return corpus, generated
+
+
+def _percentile(values, percent):
+    if not values:
+        return None
+    return values[min(len(values) - 1, int(len(values) * percent / 100.0))]
+
+
+def run_strategy(name, blackouts, alerts, memory=True):
+    """
+    Benchmark a strategy, returning the results as a dictionary.
+    """
+    with mocks.with_blackouts(*blackouts):
+        return _run_strategy(STRATEGIES[name], blackouts, alerts, memory, name=name)
+
+
+def _alerts(alerts):
+    for alert in alerts:
+        # Fresh objects, as the plugin changes the alerts matching.
+        yield mocks.Alert(**dict(alert, tags=list(alert["tags"])))
+
+
+def _run_strategy(factory, blackouts, alerts, memory, name):
+    started = time.perf_counter()
+    evaluate = factory(blackouts)
+    build = time.perf_counter() - started
+    latencies = []
+    matched = 0
+    started = time.perf_counter()
+    for alert in _alerts(alerts):
+        begin = time.perf_counter_ns()
+        result = evaluate(alert)
+        latencies.append(time.perf_counter_ns() - begin)
+        if _matched(result):
+            matched += 1
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    results = {
+        "strategy": name,
+        "build_seconds": build,
+        "alerts": len(alerts),
+        "matched": matched,
+        "alerts_per_second": len(alerts) / elapsed if elapsed else None,
+        "p50_us": _percentile(latencies, 50) / 1000.0 if latencies else None,
+        "p99_us": _percentile(latencies, 99) / 1000.0 if latencies else None,
+        "peak_memory_bytes": None,
+    }
+    if memory:
+        # Separate run, as tracing the allocations slows everything down.
+        tracemalloc.start()
+        try:
+            evaluate = factory(blackouts)
+            for alert in _alerts(alerts):
+                evaluate(alert)
+            results["peak_memory_bytes"] = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+    return results
+
+
+def _matched(result):
+    if isinstance(result, blackout_regex.Decision):
+        return result.action in (blackout_regex.MATCHED, blackout_regex.ACTIVE)
+    if isinstance(result, mocks.Alert):
+        return result.status == "blackout"
+    return bool(result)
+
+
+def _models(blackouts):
+    # Same fields as the Alerta Blackout model, decoded from JSON, as when
+    # retrieved from the DB.
+    created = datetime.datetime(2023, 1, 1)
+    return [
+        mocks.Blackout(
+            priority=1,
+            start_time=created,
+            end_time=created + datetime.timedelta(seconds=blackout["duration"]),
+            remaining=blackout["duration"],
+            user="operator@example.com",
+            create_time=created,
+            text="Maintenance window, change CHG{:07d}".format(index),
+            origin="alerta/web",
+            **json.loads(json.dumps(blackout))
+        )
+        for index, blackout in enumerate(blackouts)
+    ]
+
+
+def _traced():
+    return tracemalloc.get_traced_memory()[0]
+
+
+def measure_representations(blackouts):
+    """
+    Measure the memory held by the Blackout models, as retrieved from the DB,
+    by the rules compiled from the same Blackouts once the models are
+    released, and by the rules together with the models, when kept. Returns
+    the results as a dictionary.
+    """
+    tracemalloc.start()
+    try:
+        started = _traced()
+        models = _models(blackouts)
+        models_bytes = _traced() - started
+        rules = blackout_regex.RuleSet(models)
+        both_bytes = _traced() - started
+        del models, rules
+        started = _traced()
+        rules = blackout_regex.RuleSet(_models(blackouts))
+        rules_bytes = _traced() - started
+    finally:
+        tracemalloc.stop()
+    count = len(rules)
+    return {
+        "blackouts": count,
+        "models_bytes": models_bytes,
+        "rules_bytes": rules_bytes,
+        "rules_and_models_bytes": both_bytes,
+        "rules_bytes_per_blackout": rules_bytes / count if count else None,
+        "rules_and_models_bytes_per_blackout": both_bytes / count if count else None,
+    }
+
+
+def run(strategies=None, memory=True, **corpus):
+    """
+    Generate the corpus and benchmark the strategies (all of them by default).
+    """
+    blackouts, alerts = make_corpus(**corpus)
+    return {
+        "corpus": dict(corpus, blackouts=len(blackouts), alerts=len(alerts)),
+        "python": platform.python_version(),
+        "representations": measure_representations(blackouts) if memory else None,
+        "results": [
+            run_strategy(name, blackouts, alerts, memory=memory)
+            for name in strategies or sorted(STRATEGIES)
+        ],
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--blackouts", type=int, default=1000)
+    parser.add_argument("--alerts", type=int, default=10000)
+    parser.add_argument("--match-ratio", type=float, default=0.1)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--strategy",
+        action="append",
+        help="Strategy to benchmark, registered name or module:factory. "
+        "Can be repeated. Default: all the registered strategies.",
+    )
+    parser.add_argument("--no-memory", action="store_true")
+    parser.add_argument("--output", help="Write the results to this JSON file.")
+    args = parser.parse_args(argv)
+    strategies = []
+    for strategy in args.strategy or []:
+        if ":" in strategy:
+            module, factory = strategy.split(":", 1)
+            register_strategy(
+                strategy, getattr(importlib.import_module(module), factory)
+            )
+        strategies.append(strategy)
+    results = run(
+        strategies=strategies,
+        memory=not args.no_memory,
+        blackouts=args.blackouts,
+        alerts=args.alerts,
+        match_ratio=args.match_ratio,
+        seed=args.seed,
+    )
+    if args.output:
+        with open(args.output, "w") as fd:
+            json.dump(results, fd, indent=2)
+    json.dump(results, sys.stdout, indent=2)
+    sys.stdout.write("\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -5,36 +5,3462 @@ Alerta Blackout Regex
 
 Alerta plugin to enhance the blackout system.
 """
+import os
 import re
+import sys
+import json
+import mmap
+import time
+import heapq
+import bisect
+import select
+import socket
 import logging
+import weakref
+import argparse
+import datetime
+import importlib
+import tempfile
+import subprocess
+import itertools
+import threading
+import contextlib
+import collections
+import multiprocessing
 
+try:
+    from re import _parser as sre_parse  # Python 3.11+
+except ImportError:
+    import sre_parse
+try:
+    import re2  # google-re2, optional: linear time matching
+except ImportError:
+    re2 = None
+try:
+    import hyperscan  # optional: multi-pattern matching, for the set engine
+except ImportError:
+    hyperscan = None
 from alerta.models.blackout import Blackout
 from alerta.plugins import PluginBase
 from alerta.exceptions import BlackoutPeriod
 
 log = logging.getLogger("alerta.plugins.blackout_regex")
+explain_log = logging.getLogger("alerta.plugins.blackout_regex.explain")
+audit_log = logging.getLogger("alerta.plugins.blackout_regex.audit")
+
+
+ATTRIBUTES = ("environment", "customer", "group", "event", "resource")
+
+
+# The Blackouts retrieved from the DB: the expired ones can't match anymore.
+LOADED_STATUSES = ["active", "pending"]
+
+# The oldest first, so the Blackouts created while paging end up on the last
+# page. Alerta can't sort by ID: the Blackouts created at the same time may be
+# returned twice, the duplicates are dropped.
+LOADED_ORDER = "-createTime"
+
+_METACHARS = frozenset(".^$*+?{}[]\\|()")
 
 
 def parse_tags(tag_list):
     return {k: v for k, v in (i.split("=", 1) for i in tag_list if "=" in i)}
 
 
-class BlackoutRegex(PluginBase):
-    def _fetch_blackouts(self):
+def _has_regex(blackout):
+    """
+    Tell whether any of the Blackout patterns has regular expression
+    metacharacters. The other Blackouts are still searched for as substrings,
+    unlike the native blackout plugin, which matches them exactly.
+    """
+    patterns = [getattr(blackout, attr, None) for attr in ATTRIBUTES]
+    patterns.extend(blackout.service or ())
+    patterns.extend(parse_tags(blackout.tags or []).values())
+    return any(_METACHARS.intersection(pattern) for pattern in patterns if pattern)
+
+
+def _any_suffix(op, av):
+    return (
+        op in (sre_parse.MAX_REPEAT, sre_parse.MIN_REPEAT)
+        and av[0] == 0
+        and av[1] == sre_parse.MAXREPEAT
+        and list(av[2]) == [(sre_parse.ANY, None)]
+    )
+
+
+def _classify(pattern):
+    """
+    Classify a compiled pattern by the literal part a value must contain in
+    order to match, returning a tuple ``(kind, literal)``, where *kind* is:
+
+    - ``exact``: the value must be equal to the literal (``^literal$``).
+    - ``prefix``: the value must start with the literal (e.g.,
+      ``^edge-ams\\d+``).
+    - ``literal``: the value must contain the literal (e.g., ``Production``,
+      or ``router.*``).
+    - ``regex``: anything else.
+    """
+    if not isinstance(pattern, re.Pattern) or pattern.flags & ~re.UNICODE:
+        return ("regex", None)
+    try:
+        parsed = list(sre_parse.parse(pattern.pattern))
+    except Exception:
+        return ("regex", None)
+    anchored = bool(parsed) and parsed[0] in (
+        (sre_parse.AT, sre_parse.AT_BEGINNING),
+        (sre_parse.AT, sre_parse.AT_BEGINNING_STRING),
+    )
+    if anchored:
+        parsed = parsed[1:]
+    chars = []
+    for op, av in parsed:
+        if op != sre_parse.LITERAL:
+            break
+        chars.append(chr(av))
+    literal = "".join(chars)
+    rest = parsed[len(chars) :]
+    if rest and _any_suffix(*rest[-1]):
+        # A trailing ``.*`` doesn't change what is searched for.
+        rest = rest[:-1]
+    if not literal:
+        return ("regex", None)
+    if anchored:
+        if rest in (
+            [(sre_parse.AT, sre_parse.AT_END)],
+            [(sre_parse.AT, sre_parse.AT_END_STRING)],
+        ):
+            return ("exact", literal)
+        return ("prefix", literal)
+    if not rest:
+        return ("literal", literal)
+    return ("regex", None)
+
+
+_REPEATS = (sre_parse.MAX_REPEAT, sre_parse.MIN_REPEAT)
+
+# The anchors of the Hyperscan expressions: ``\Z`` is ``\z`` in PCRE.
+_HS_ANCHORS = {
+    sre_parse.AT_BEGINNING: "^",
+    sre_parse.AT_BEGINNING_STRING: r"\A",
+    sre_parse.AT_END: "$",
+    sre_parse.AT_END_STRING: r"\z",
+}
+
+
+# The character classes, as evaluated by ``re``: ``(predicate, negated)``.
+_HS_CATEGORIES = {
+    sre_parse.CATEGORY_DIGIT: (str.isdecimal, False),
+    sre_parse.CATEGORY_NOT_DIGIT: (str.isdecimal, True),
+    sre_parse.CATEGORY_SPACE: (str.isspace, False),
+    sre_parse.CATEGORY_NOT_SPACE: (str.isspace, True),
+    sre_parse.CATEGORY_WORD: (lambda char: char.isalnum() or char == "_", False),
+    sre_parse.CATEGORY_NOT_WORD: (lambda char: char.isalnum() or char == "_", True),
+}
+_HS_RANGES = {}
+# The Hyperscan expressions of the compiled patterns, or ``None``.
+_HS_EXPRESSIONS = weakref.WeakKeyDictionary()
+
+
+def _hs_char(code):
+    char = chr(code)
+    return char if char.isascii() and char.isalnum() else r"\x{%x}" % code
+
+
+def _hs_category(category):
+    """
+    Return the character ranges of the character class, e.g., ``\\d``, as
+    ``re`` evaluates it: Hyperscan follows other Unicode tables.
+    """
+    ranges = _HS_RANGES.get(category)
+    if ranges is None:
+        predicate, negated = _HS_CATEGORIES[category]
+        parts = []
+        start = None
+        # The surrogates are not valid UTF-8, hence never scanned.
+        codes = itertools.chain(range(0xD800), range(0xE000, sys.maxunicode + 2))
+        for code in codes:
+            member = code <= sys.maxunicode and predicate(chr(code)) != negated
+            if member and start is None:
+                start = code
+            elif not member and start is not None:
+                parts.append(
+                    _hs_char(start)
+                    if start == code - 1
+                    else "{}-{}".format(_hs_char(start), _hs_char(code - 1))
+                )
+                start = None
+        ranges = _HS_RANGES[category] = "".join(parts)
+    return ranges
+
+
+def _hs_translate(items):
+    """
+    Translate the parsed pattern to PCRE, as understood by Hyperscan, raising
+    ``ValueError`` on the constructs Hyperscan doesn't evaluate as ``re``.
+    """
+    parts = []
+    for op, av in items:
+        if op == sre_parse.LITERAL:
+            parts.append(_hs_char(av))
+        elif op == sre_parse.NOT_LITERAL:
+            parts.append("[^{}]".format(_hs_char(av)))
+        elif op == sre_parse.ANY:
+            parts.append(".")
+        elif op == sre_parse.IN:
+            chars = []
+            for item, value in av:
+                if item == sre_parse.NEGATE:
+                    chars.append("^")
+                elif item == sre_parse.LITERAL:
+                    chars.append(_hs_char(value))
+                elif item == sre_parse.RANGE:
+                    chars.append("{}-{}".format(*map(_hs_char, value)))
+                elif item == sre_parse.CATEGORY and value in _HS_CATEGORIES:
+                    chars.append(_hs_category(value))
+                else:
+                    raise ValueError(item)
+            parts.append("[{}]".format("".join(chars)))
+        elif op == sre_parse.BRANCH:
+            parts.append("(?:{})".format("|".join(map(_hs_translate, av[1]))))
+        elif op == sre_parse.SUBPATTERN:
+            _, add_flags, del_flags, body = av
+            if add_flags or del_flags:
+                raise ValueError(op)
+            parts.append("(?:{})".format(_hs_translate(body)))
+        elif op in _REPEATS:
+            low, high, body = av
+            high = "" if high == sre_parse.MAXREPEAT else high
+            parts.append("(?:{}){{{},{}}}".format(_hs_translate(body), low, high))
+        elif op == sre_parse.AT and av in _HS_ANCHORS:
+            parts.append(_HS_ANCHORS[av])
+        else:
+            # E.g., the word boundaries, lookarounds, backreferences.
+            raise ValueError(op)
+    return "".join(parts)
+
+
+def _hs_expression(pattern):
+    """
+    Return the Hyperscan expression matching the same values as the compiled
+    pattern, or ``None`` when Hyperscan may not evaluate it exactly as ``re``,
+    e.g., case insensitive, as the case folding is not the same.
+    """
+    if not isinstance(pattern, re.Pattern) or pattern.flags & ~re.UNICODE:
+        return None
+    expression = _HS_EXPRESSIONS.get(pattern, False)
+    if expression is False:
+        try:
+            expression = _hs_translate(sre_parse.parse(pattern.pattern))
+            expression = expression.encode("utf-8")
+        except Exception:
+            expression = None
+        _HS_EXPRESSIONS[pattern] = expression
+    return expression
+
+
+# Repeating a subpattern more than this is considered unbounded.
+_MAX_BOUNDED = 10
+
+_CATEGORIES = {
+    sre_parse.CATEGORY_DIGIT: re.compile(r"\d"),
+    sre_parse.CATEGORY_NOT_DIGIT: re.compile(r"\D"),
+    sre_parse.CATEGORY_SPACE: re.compile(r"\s"),
+    sre_parse.CATEGORY_NOT_SPACE: re.compile(r"\S"),
+    sre_parse.CATEGORY_WORD: re.compile(r"\w"),
+    sre_parse.CATEGORY_NOT_WORD: re.compile(r"\W"),
+}
+
+
+def _unbounded(op, av):
+    return op in _REPEATS and (av[1] == sre_parse.MAXREPEAT or av[1] > _MAX_BOUNDED)
+
+
+def _subpatterns(op, av):
+    """
+    Return the subpatterns nested into a parsed item.
+    """
+    if op in _REPEATS or op == getattr(sre_parse, "POSSESSIVE_REPEAT", None):
+        return [av[2]]
+    if op == sre_parse.SUBPATTERN:
+        return [av[-1]]
+    if op == sre_parse.BRANCH:
+        return av[1]
+    if op in (sre_parse.ASSERT, sre_parse.ASSERT_NOT):
+        return [av[1]]
+    if op == sre_parse.GROUPREF_EXISTS:
+        return [sub for sub in av[1:] if sub is not None]
+    if op == getattr(sre_parse, "ATOMIC_GROUP", None):
+        return [av]
+    return []
+
+
+def _walk(items):
+    for op, av in items:
+        yield op, av
+        for sub in _subpatterns(op, av):
+            for item in _walk(sub):
+                yield item
+
+
+def _flatten(items):
+    # The groups don't change what is matched.
+    for op, av in items:
+        if op == sre_parse.SUBPATTERN:
+            for item in _flatten(av[-1]):
+                yield item
+        else:
+            yield op, av
+
+
+def _may_match(items, char):
+    """
+    Tell whether the subpattern may match the character, answering ``True``
+    when in doubt.
+    """
+    items = list(_flatten(items))
+    if len(items) != 1:
+        return True
+    op, av = items[0]
+    if op == sre_parse.LITERAL:
+        return av == ord(char)
+    if op == sre_parse.NOT_LITERAL:
+        return av != ord(char)
+    if op != sre_parse.IN:
+        return True
+    negate = found = False
+    for op, av in av:
+        if op == sre_parse.NEGATE:
+            negate = True
+        elif op == sre_parse.LITERAL:
+            found = found or av == ord(char)
+        elif op == sre_parse.RANGE:
+            found = found or av[0] <= ord(char) <= av[1]
+        elif op == sre_parse.CATEGORY and av in _CATEGORIES:
+            found = found or bool(_CATEGORIES[av].match(char))
+        else:
+            return True
+    return found != negate
+
+
+def _ambiguous(body):
+    """
+    Tell whether a value can be split between the iterations of a repeated
+    subpattern in many ways, i.e., whether it repeats another unbounded
+    repeat, not separated from the next iteration by a literal it can't
+    match, like ``(a+)+`` or ``(.*,)*``. ``(\\w+\\.)+`` is fine.
+    """
+    items = list(_flatten(body))
+    inner = []
+    for op, av in items:
+        if _unbounded(op, av):
+            inner.append(av[2])
+        elif any(
+            _unbounded(*item) for sub in _subpatterns(op, av) for item in _walk(sub)
+        ):
+            # Alternatives or optional parts, too complex to tell.
+            return True
+    if not inner:
+        return False
+    separators = [chr(av) for op, av in items if op == sre_parse.LITERAL]
+    if not separators:
+        return True
+    return any(_may_match(sub, char) for sub in inner for char in separators)
+
+
+# The characters the first characters of the alternatives are compared on.
+_SAMPLE = [chr(code) for code in range(128)] + ["\u00e9"]
+
+_CHARS = (sre_parse.LITERAL, sre_parse.NOT_LITERAL, sre_parse.IN, sre_parse.ANY)
+
+
+def _first(items):
+    """
+    Return the items which may match the first character of the subpattern,
+    or ``None`` when unknown, and whether the subpattern may match nothing.
+    """
+    first = []
+    for op, av in _flatten(items):
+        if op == sre_parse.AT:
+            continue
+        if op in _CHARS:
+            first.append((op, av))
+            return first, False
+        if op in _REPEATS:
+            sub, nullable = _first(av[2])
+            if sub is None:
+                return None, False
+            first.extend(sub)
+            if av[0] > 0 and not nullable:
+                return first, False
+        elif op == sre_parse.BRANCH:
+            nullable = False
+            for alternative in av[1]:
+                sub, empty = _first(alternative)
+                if sub is None:
+                    return None, False
+                first.extend(sub)
+                nullable = nullable or empty
+            if not nullable:
+                return first, False
+        else:
+            return None, False
+    return first, True
+
+
+def _overlap(first, other):
+    if first is None or other is None:
+        return True
+    return any(
+        any(_may_match([item], char) for item in first)
+        and any(_may_match([item], char) for item in other)
+        for char in _SAMPLE
+    )
+
+
+def _overlapping(body):
+    """
+    Tell whether a repeated subpattern has alternatives which can match the
+    same character, like ``(a|a)*`` or ``(a|aa)+``: a value can then be split
+    between the alternatives, and the iterations, in many ways. The
+    alternatives matching nothing are followed by the rest of the subpattern,
+    or by the next iteration. Note the common prefix of the alternatives is
+    factored out when parsed, e.g., ``(a|aa)`` is parsed as ``a(?:|a)``.
+    """
+    items = list(_flatten(body))
+    for index, (op, av) in enumerate(items):
+        if op != sre_parse.BRANCH:
+            continue
+        follow, nullable = _first(items[index + 1 :])
+        if nullable and follow is not None:
+            following, _ = _first(items)
+            follow = None if following is None else follow + following
+        firsts = []
+        empty = 0
+        for alternative in av[1]:
+            first, nullable = _first(alternative)
+            if nullable:
+                empty += 1
+                first = None if first is None or follow is None else first + follow
+            firsts.append(first)
+        if empty > 1:
+            return True
+        for position, first in enumerate(firsts):
+            if any(_overlap(first, other) for other in firsts[position + 1 :]):
+                return True
+    return False
+
+
+def _backtracking(pattern):
+    """
+    Return why the compiled pattern may take an exponential time to fail
+    matching (catastrophic backtracking), e.g., nested quantifiers as in
+    ``(a+)+$``, or overlapping alternatives as in ``(a|aa)+$``, or ``None``.
+    The analysis is static, and conservative.
+    """
+    try:
+        parsed = list(sre_parse.parse(pattern.pattern))
+    except Exception:
+        return None
+    for op, av in _walk(parsed):
+        if _unbounded(op, av):
+            if _ambiguous(av[2]):
+                return "nested quantifiers"
+            if _overlapping(av[2]):
+                return "overlapping alternation"
+    return None
+
+
+# The time, in seconds, the patterns prone to catastrophic backtracking, when
+# allowed, can take to evaluate each probe value, unless a budget is set.
+_PROBE_BUDGET = 0.1
+
+# The time, in seconds, allowed to start the probe process.
+_PROBE_STARTUP = 1.0
+
+_PROBE = """
+import re, sys, json, time
+pattern = re.compile(sys.argv[1])
+slowest = 0.0
+for value in json.load(sys.stdin):
+    started = time.perf_counter()
+    pattern.search(value)
+    slowest = max(slowest, time.perf_counter() - started)
+print(slowest)
+"""
+
+# ``{compiled pattern: {budget: too slow}}``, as long as the pattern is used.
+_PROBED = weakref.WeakKeyDictionary()
+# The patterns are probed one at a time, so the loads following each other
+# don't probe the same patterns concurrently.
+_PROBE_LOCK = threading.Lock()
+
+
+def _python():
+    """
+    Return the Python interpreter to run the probes with, or ``None``:
+    ``sys.executable`` is not Python when embedded, e.g., under uWSGI.
+    """
+    if os.path.basename(sys.executable or "").startswith("python"):
+        return sys.executable
+    for name in ("python{}.{}".format(*sys.version_info[:2]), "python3"):
+        for directory in (os.path.join(sys.exec_prefix, "bin"), sys.exec_prefix):
+            path = os.path.join(directory, name)
+            if os.access(path, os.X_OK):
+                return path
+    return None
+
+
+def _probed(pattern, budget):
+    """
+    Return the result of the probe of the pattern, see :func:`_too_slow`, or
+    ``None`` when not probed yet.
+    """
+    return _PROBED.get(pattern, {}).get(budget)
+
+
+def _probe_values(pattern):
+    """
+    Return values crafted to trigger the catastrophic backtracking: the
+    characters of the pattern, and a few common ones, repeated, followed by a
+    character failing the match.
+    """
+    chars = []
+    for op, av in _walk(sre_parse.parse(pattern.pattern)):
+        if op == sre_parse.LITERAL:
+            chars.append(chr(av))
+        elif op == sre_parse.RANGE:
+            chars.append(chr(av[0]))
+    chars.extend("a0 -_.")
+    chars = list(collections.OrderedDict.fromkeys(chars))[:16]
+    return [char * 32 + end for char in chars for end in ("!", "\n")]
+
+
+def _too_slow(pattern, budget, python=None):
+    """
+    Tell whether the pattern takes longer than ``budget`` seconds to evaluate
+    values crafted to trigger the catastrophic backtracking. The values are
+    evaluated by the ``python`` interpreter (see :func:`_python`), in a
+    separate process, killed once out of time, which takes up to a few
+    seconds: this is not meant to run on the alerts path. The results are
+    cached, see :func:`_probed`.
+    """
+    with _PROBE_LOCK:
+        slow = _probed(pattern, budget)
+        if slow is not None:
+            return slow
+        values = _probe_values(pattern)
+        python = python or _python()
+        try:
+            if python is None:
+                raise OSError("No Python interpreter found")
+            result = subprocess.run(
+                [python, "-c", _PROBE, pattern.pattern],
+                input=json.dumps(values),
+                capture_output=True,
+                text=True,
+                timeout=_PROBE_STARTUP + budget * len(values),
+                check=True,
+            )
+            slow = float(result.stdout) > budget
+        except subprocess.TimeoutExpired:
+            slow = True
+        except (subprocess.SubprocessError, OSError, ValueError):
+            log.warning(
+                "Unable to probe the pattern %s", pattern.pattern, exc_info=True
+            )
+            slow = True
+        _PROBED.setdefault(pattern, {})[budget] = slow
+        return slow
+
+
+# The compiled patterns in use, shared between the rules having the same
+# pattern, e.g., the same environment, and the reason they are unsafe, if so.
+_PATTERNS = weakref.WeakValueDictionary()
+_UNSAFE = weakref.WeakKeyDictionary()
+
+
+def _intern(value):
+    return sys.intern(value) if isinstance(value, str) else value
+
+
+def _compile(pattern):
+    """
+    Compile the pattern, returning a tuple ``(compiled, reason)``, where
+    *reason* tells why it's prone to catastrophic backtracking, if so. Such
+    patterns are compiled with re2 when installed, when supported.
+    """
+    compiled = _PATTERNS.get(pattern)
+    if compiled is not None:
+        return compiled, _UNSAFE.get(compiled)
+    compiled = re.compile(pattern)
+    reason = _backtracking(compiled)
+    if reason and re2 is not None:
+        try:
+            compiled, reason = re2.compile(pattern), None
+        except Exception:  # e.g., lookarounds are not supported by re2
+            pass
+    try:
+        _PATTERNS[pattern] = compiled
+        if reason:
+            _UNSAFE[compiled] = reason
+    except TypeError:  # not weak referenceable
+        pass
+    return compiled, reason
+
+
+def _blackout_key(blackout):
+    """
+    Return the content of the Blackout its rule depends on, as a hashable
+    tuple, telling whether the rule must be compiled again.
+    """
+    return (
+        blackout.id,
+        blackout.status,
+        getattr(blackout, "start_time", None),
+        getattr(blackout, "end_time", None),
+        tuple(_intern(getattr(blackout, attr, None)) for attr in ATTRIBUTES),
+        tuple(_intern(srv) for srv in blackout.service or ()),
+        tuple(_intern(tag) for tag in blackout.tags or ()),
+    )
+
+
+def _utcnow():
+    # The Alerta models use naive datetimes, in UTC.
+    return datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+
+
+def _naive_utc(value):
+    if isinstance(value, str):
+        value = datetime.datetime.fromisoformat(value.replace("Z", "+00:00"))
+    if value is not None and value.tzinfo is not None:
+        value = value.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    return value
+
+
+def _window_status(status, start_time, end_time, now):
+    """
+    Return the status of a Blackout at ``now``, given its time window, and
+    when it changes next, or ``None``. The ``status`` retrieved from the DB is
+    used when the time window is unknown.
+    """
+    if start_time is None or end_time is None:
+        return status, None
+    if now < start_time:
+        return "pending", start_time
+    if now < end_time:
+        return "active", end_time
+    return "expired", None
+
+
+def _blackout_query(**params):
+    """
+    Build a backend specific Blackout query, using the Alerta query builder.
+    Returns ``None`` (i.e., no filtering) when the query builder is not
+    available, e.g., when running outside of the Alerta server.
+    """
+    try:
+        from alerta.app import qb
+        from werkzeug.datastructures import MultiDict
+    except ImportError:
+        log.debug("Unable to build the Blackout query %s", params, exc_info=True)
+        return None
+    try:
+        # The query builder expects the request arguments, where the list
+        # values are repeated arguments, e.g., ``?status=active&status=...``.
+        return qb.blackouts.from_params(MultiDict(params))
+    except Exception:
+        # Every Blackout is then retrieved, and filtered here.
+        log.warning("Unable to build the Blackout query %s", params, exc_info=True)
+        return None
+
+
+def _current_app():
+    """
+    Return the current Alerta (Flask) application, if any, so its context can
+    be pushed into a background thread (the DB connection is bound to it).
+    """
+    try:
+        from flask import current_app
+
+        return current_app._get_current_object()
+    except Exception:
+        return None
+
+
+def _app_context(app):
+    """
+    Return a new application context for ``app``, or a no-op context when
+    there's no application available.
+    """
+    if app is None:
+        return contextlib.nullcontext()
+    return app.app_context()
+
+
+class Rule(object):
+    """
+    Compiled representation of a Blackout: the regular expressions of all the
+    attributes are compiled once, when the Blackouts are loaded, instead of
+    evaluating the raw patterns for every alert. The object is not meant to be
+    changed after being built: ``status`` is the status of the Blackout when
+    retrieved from the DB, see :meth:`RuleSet.status` for the current one.
+
+    When any of the patterns is not a valid regular expression, ``error`` is
+    set and the rule never matches. When any of the patterns is prone to
+    catastrophic backtracking, ``unsafe`` tells why.
+
+    The attributes are evaluated in the order of ``attributes``, which
+    doesn't change the result, and can be changed by :meth:`RuleSet.replan`.
+
+    The rule holds only what the matching needs, and no reference to the
+    Blackout model, so the model can be released once the rule is built. The
+    pattern strings are interned, and the compiled patterns are shared between
+    the rules.
+    """
+
+    __slots__ = (
+        "id",
+        "key",
+        "status",
+        "start_time",
+        "end_time",
+        "error",
+        "unsafe",
+        "attributes",
+        "service",
+        "has_tags",
+        "tags",
+        "index",
+    )
+
+    def __init__(self, blackout):
+        self.id = blackout.id
+        self.key = key = _blackout_key(blackout)
+        self.status = blackout.status
+        self.start_time = _naive_utc(getattr(blackout, "start_time", None))
+        self.end_time = _naive_utc(getattr(blackout, "end_time", None))
+        self.error = None
+        self.unsafe = None
+        self.attributes = ()
+        self.service = ()
+        self.has_tags = bool(blackout.tags)
+        self.tags = ()
+        # How the rule is indexed, see :meth:`IndexedMatcher.classify`.
+        self.index = None
+        # The patterns, interned, as found in the key.
+        _, _, _, _, patterns, services, tags = key
+        try:
+            self.attributes = tuple(
+                (attr, self._compile(attr, pattern))
+                for attr, pattern in zip(ATTRIBUTES, patterns)
+                if pattern
+            )
+            self.service = tuple(self._compile("service", srv) for srv in services)
+            self.tags = tuple(
+                (sys.intern(name), self._compile("tags", _intern(val)))
+                for name, val in parse_tags(tags).items()
+            )
+        except re.error as err:
+            self.error = err
+
+    def _compile(self, attr, pattern):
+        compiled, reason = _compile(pattern)
+        if reason and self.unsafe is None:
+            self.unsafe = "{} {} has {}".format(attr, pattern, reason)
+        return compiled
+
+    def __repr__(self):
+        return "Rule(id={!r}, status={!r})".format(self.id, self.status)
+
+    def signature(self):
+        """
+        Return the patterns of the rule, as a tuple of strings.
+        """
+        attributes = dict(self.attributes)
+        return (
+            tuple(attributes[attr].pattern for attr in ATTRIBUTES if attr in attributes)
+            + tuple(pattern.pattern for pattern in self.service)
+            + tuple(pattern.pattern for _, pattern in self.tags)
+        )
+
+    def steps(self, alert, alert_tags):
+        """
+        Evaluate the alert against this rule pattern by pattern, in the same
+        order as :meth:`matches`, yielding ``(attribute, pattern, value,
+        matched)`` for each pattern evaluated, up to the first one that
+        doesn't match. When the alert has a different number of services,
+        ``pattern`` is ``None``. Slower than :meth:`matches`, this is meant for
+        diagnostics only.
+        """
+        if self.error:
+            return
+        for attr, pattern in self.attributes:
+            value = getattr(alert, attr)
+            matched = value is not None and bool(pattern.search(value))
+            yield attr, pattern, value, matched
+            if not matched:
+                return
+        if self.service and alert.service:
+            if len(self.service) != len(alert.service):
+                yield "service", None, alert.service, False
+                return
+            for pattern, value in zip(self.service, alert.service):
+                matched = bool(pattern.search(value))
+                yield "service", pattern, value, matched
+                if not matched:
+                    return
+        if self.has_tags and alert.tags:
+            for key, pattern in self.tags:
+                value = alert_tags.get(key)
+                matched = value is not None and bool(pattern.search(value))
+                yield "tags", pattern, value, matched
+                if not matched:
+                    return
+
+    def matches(self, alert, alert_tags, program=None, memo=None):
+        """
+        Evaluate the alert against this rule. ``alert_tags`` are the alert
+        tags, as parsed by :func:`parse_tags`.
+
+        The general assumption is that a blackout has at least one of the
+        attributes set, therefore the matching is attempted only for the
+        attributes configured, and the alert must match all of them.
+
+        With the ``program`` of the rule, see :meth:`PatternTable.program`,
+        the results of the patterns are looked up in, and recorded into, the
+        ``memo`` of the alert, so the patterns shared with the rules already
+        evaluated are not evaluated again.
+
+        Nothing is logged here, as this is evaluated for every rule, for every
+        alert: see :meth:`steps`, or :func:`explain`, for the details.
+        """
+        if self.error:
+            return False
+        if program is not None:
+            return self._matches(alert, alert_tags, program, memo)
+        match = False
+        for attr, pattern in self.attributes:
+            value = getattr(alert, attr)
+            if value is None or not pattern.search(value):
+                return False
+            match = True
+        if self.service and alert.service:
+            if len(self.service) != len(alert.service):
+                return False
+            for pattern, value in zip(self.service, alert.service):
+                if not pattern.search(value):
+                    return False
+            match = True
+        if self.has_tags and alert.tags:
+            for key, pattern in self.tags:
+                # The alert must have at least all the tags the blackout has
+                # in order to match.
+                if key not in alert_tags or not pattern.search(alert_tags[key]):
+                    return False
+            match = True
+        return match
+
+    def _matches(self, alert, alert_tags, program, memo):
+        attributes, service, tags = program
+        match = False
+        for attr, slot, pattern in attributes:
+            matched = memo.get(slot)
+            if matched is None:
+                value = getattr(alert, attr)
+                matched = memo[slot] = (
+                    value is not None and pattern.search(value) is not None
+                )
+            if not matched:
+                return False
+            match = True
+        if service and alert.service:
+            if len(service) != len(alert.service):
+                return False
+            for (slot, pattern), value in zip(service, alert.service):
+                matched = memo.get(slot)
+                if matched is None:
+                    matched = memo[slot] = pattern.search(value) is not None
+                if not matched:
+                    return False
+            match = True
+        if self.has_tags and alert.tags:
+            for key, slot, pattern in tags:
+                matched = memo.get(slot)
+                if matched is None:
+                    value = alert_tags.get(key)
+                    matched = memo[slot] = (
+                        value is not None and pattern.search(value) is not None
+                    )
+                if not matched:
+                    return False
+            match = True
+        return match
+
+
+class PatternTable(object):
+    """
+    The distinct patterns of a set of rules.
+
+    The rules share many patterns, e.g., the environment, or a site tag. Each
+    distinct ``(field, pattern)`` gets a slot, where *field* is either the
+    attribute, ``("service", position)``, or ``("tags", key)``, and each rule
+    a program, referencing the slots of its patterns (see :meth:`program`).
+    The patterns are then evaluated at most once per alert, their results
+    being memoized by slot (see :meth:`Rule.matches`).
+
+    ``references`` is the number of patterns of all the rules, and the
+    ``ratio`` the average number of rules sharing each distinct pattern.
+    """
+
+    def __init__(self, rules):
+        # ``{(field, pattern string): slot}``.
+        self.slots = {}
+        self.fields = []
+        self.patterns = []
+        self.references = 0
+        self.programs = [self.program(rule) for rule in rules]
+
+    def __len__(self):
+        return len(self.patterns)
+
+    @property
+    def ratio(self):
+        return self.references / len(self.patterns) if self.patterns else 1.0
+
+    def slot(self, field, pattern):
+        self.references += 1
+        key = (field, pattern.pattern)
+        slot = self.slots.get(key)
+        if slot is None:
+            slot = self.slots[key] = len(self.patterns)
+            self.fields.append(field)
+            self.patterns.append(pattern)
+        return slot
+
+    def program(self, rule):
+        """
+        Return the patterns of the rule, in the order they are evaluated, with
+        their slots, as a tuple of: the ``(attribute, slot, pattern)``, the
+        ``(slot, pattern)`` of the services, by position, and the ``(tag key,
+        slot, pattern)``.
+        """
+        return (
+            tuple(
+                (attr, self.slot(attr, pattern), pattern)
+                for attr, pattern in rule.attributes
+            ),
+            tuple(
+                (self.slot(("service", position), pattern), pattern)
+                for position, pattern in enumerate(rule.service)
+            ),
+            tuple(
+                (key, self.slot(("tags", key), pattern), pattern)
+                for key, pattern in rule.tags
+            ),
+        )
+
+
+class LinearMatcher(object):
+    """
+    Evaluate the rules one by one, in order, until the first match.
+    """
+
+    def __init__(self, rules):
+        self.rules = rules
+        self.table = PatternTable(rules)
+
+    def match(self, alert, alert_tags):
+        memo = {}
+        for rule, program in zip(self.rules, self.table.programs):
+            if rule.matches(alert, alert_tags, program, memo):
+                return rule
+        return None
+
+
+class IndexedMatcher(object):
+    """
+    Evaluate only the rules that could possibly match the alert.
+
+    Each rule is indexed by the most selective of its attributes, or tags, by
+    the literal part of the pattern (see :func:`_classify`): in a hash table
+    for the exact values, in a prefix tree for the anchored prefixes, or by
+    the literal substring. The most selective is the literal shared by the
+    fewest rules, e.g., not the environment all the rules have in common. The
+    rules having only true regular expressions are always evaluated. For each
+    alert, the candidate rules are looked up by the alert attributes and tags,
+    then evaluated in order, same as the :class:`LinearMatcher`.
+
+    Besides, the rules requiring tag keys the alert doesn't have are not
+    evaluated: for each tag key, the rules requiring it are flagged in a
+    bitset.
+    """
+
+    _RANK = {"exact": 3, "prefix": 2, "literal": 1}
+
+    def __init__(self, rules):
+        self.rules = rules
+        # ``{field: {literal: [rule index]}}``, where *field* is either the
+        # attribute, or ``("tags", key)``.
+        self.exact = {}
+        self.prefix = {}
+        self.literal = {}
+        self.always = []
+        # The rules indexed by a tag, to be evaluated anyway when the alert
+        # has no tags, as the tags are then ignored.
+        self.tagged = []
+        # ``{tag key: bitset of the rules requiring it}``.
+        self.requires = {}
+        usage = collections.Counter()
+        for rule in rules:
+            if rule.index is None:
+                # Classified once, the rules are reused between loads.
+                rule.index = self.classify(rule)
+            usage.update(rule.index)
+        for index, rule in enumerate(rules):
+            if rule.has_tags:
+                for key, _ in rule.tags:
+                    self.requires[key] = self.requires.get(key, 0) | 1 << index
+            if not rule.index:
+                self.always.append(index)
+                continue
+            field, kind, literal = min(
+                rule.index,
+                key=lambda item: (usage[item], -self._RANK[item[1]], -len(item[2])),
+            )
+            if isinstance(field, tuple):
+                self.tagged.append(index)
+            if kind == "exact":
+                self.exact.setdefault(field, {}).setdefault(literal, []).append(index)
+            elif kind == "prefix":
+                node = self.prefix.setdefault(field, {})
+                for char in literal:
+                    node = node.setdefault(char, {})
+                node.setdefault(None, []).append(index)
+            else:
+                self.literal.setdefault(field, {}).setdefault(literal, []).append(index)
+        self.fields = list(set(self.exact) | set(self.prefix) | set(self.literal))
+        self.indexed = len(rules) - len(self.always)
+        self.table = PatternTable(rules)
+
+    @staticmethod
+    def classify(rule):
+        """
+        Return the attributes, and tags, of the rule the alerts can be looked
+        up by, as a tuple of ``(field, kind, literal)``, where *field* is
+        either the attribute, or ``("tags", key)``. An empty tuple means the
+        rule must always be evaluated.
+        """
+        fields = [(attr, pattern) for attr, pattern in rule.attributes]
+        fields.extend((("tags", key), pattern) for key, pattern in rule.tags)
+        index = []
+        for field, pattern in fields:
+            kind, literal = _classify(pattern)
+            if kind != "regex":
+                index.append((field, kind, literal))
+        return tuple(index)
+
+    def candidates(self, alert, alert_tags=None):
+        """
+        Return the indexes of the rules that could match the alert, sorted.
+        """
+        if alert_tags is None:
+            alert_tags = parse_tags(alert.tags)
+        found = set()
+        for field in self.fields:
+            if isinstance(field, tuple):
+                value = alert_tags.get(field[1])
+            else:
+                value = getattr(alert, field)
+            if value is None:
+                continue
+            exact = self.exact.get(field)
+            if exact:
+                found.update(exact.get(value, ()))
+                if value.endswith("\n"):
+                    # ``$`` also matches before the trailing newline.
+                    found.update(exact.get(value[:-1], ()))
+            node = self.prefix.get(field)
+            if node:
+                for char in value:
+                    node = node.get(char)
+                    if node is None:
+                        break
+                    found.update(node.get(None, ()))
+            for literal, indexes in self.literal.get(field, {}).items():
+                if literal in value:
+                    found.update(indexes)
+        if not alert.tags:
+            found.update(self.tagged)
+        candidates = sorted(found)
+        if self.always:
+            candidates = heapq.merge(candidates, self.always)
+        if not alert.tags:
+            return candidates
+        excluded = 0
+        for key, bitset in self.requires.items():
+            if key not in alert_tags:
+                excluded |= bitset
+        if not excluded:
+            return candidates
+        return [index for index in candidates if not excluded >> index & 1]
+
+    def match(self, alert, alert_tags):
+        programs = self.table.programs
+        memo = {}
+        for index in self.candidates(alert, alert_tags):
+            rule = self.rules[index]
+            if rule.matches(alert, alert_tags, programs[index], memo):
+                return rule
+        return None
+
+
+def _hs_collect(index, start, end, flags, found):
+    found.append(index)
+
+
+class SetMatcher(object):
+    """
+    Scan each attribute, service and tag of the alert once for all the
+    patterns of the rules, then evaluate only the rules whose most selective
+    attribute, or tag, pattern matched, in order, same as the
+    :class:`LinearMatcher`.
+
+    The patterns are scanned with Hyperscan, when installed, one database per
+    field, and their results recorded in the memo of the alert (see
+    :class:`PatternTable`). The patterns Hyperscan may not evaluate as ``re``
+    does (see :func:`_hs_expression`), and all the patterns when Hyperscan is
+    not installed, are left to ``re``, when their rules are evaluated: the
+    rules having no pattern scanned are always evaluated.
+
+    The databases hold the patterns of the ``universe`` rules, e.g., including
+    the Blackouts not active yet, and are looked up in, and recorded into, the
+    ``databases`` cache, as compiling them takes a while: the matcher can then
+    be rebuilt as the Blackouts are activated, or expire, without compiling
+    them again.
+    """
+
+    def __init__(self, rules, universe=None, databases=None):
+        self.rules = rules
+        self.table = PatternTable(rules)
+        # ``(field, database, slots)``, for each field having patterns scanned,
+        # where *slots* are the slots of the expressions, by ID, if any.
+        self.scanners = []
+        # ``{(field, patterns): (database, IDs compiled)}``.
+        self.databases = {}
+        # The results of the patterns scanned, when not matching.
+        self.template = {}
+        if hyperscan is not None:
+            self._build(universe if universe is not None else rules, databases or {})
+        # ``{slot: [rule index]}``, the rules indexed by each pattern scanned.
+        self.by_slot = {}
+        self.always = []
+        # The rules indexed by a tag, to be evaluated anyway when the alert
+        # has no tags, as the tags are then ignored.
+        self.tagged = []
+        usage = collections.Counter()
+        for program in self.table.programs:
+            usage.update(self._slots(program))
+        for index, program in enumerate(self.table.programs):
+            slots = list(self._slots(program))
+            if not slots:
+                self.always.append(index)
+                continue
+            slot = min(slots, key=lambda slot: usage[slot])
+            if isinstance(self.table.fields[slot], tuple):
+                self.tagged.append(index)
+            self.by_slot.setdefault(slot, []).append(index)
+        self.scanned = len(self.template)
+        self._local = threading.local()
+
+    def _build(self, universe, databases):
+        fields = collections.defaultdict(dict)
+        table = PatternTable(universe)
+        for field, pattern in zip(table.fields, table.patterns):
+            expression = _hs_expression(pattern)
+            if expression is not None:
+                fields[field][pattern.pattern] = expression
+        for field, expressions in fields.items():
+            patterns = tuple(sorted(expressions))
+            key = (field, patterns)
+            entry = databases.get(key)
+            if entry is None:
+                entry = self._compile([expressions[pattern] for pattern in patterns])
+                log.debug(
+                    "Compiled %d of %d patterns of %s with Hyperscan",
+                    len(entry[1]),
+                    len(patterns),
+                    field,
+                )
+            self.databases[key] = entry
+            database, compiled = entry
+            slots = [
+                self.table.slots.get((field, pattern)) if index in compiled else None
+                for index, pattern in enumerate(patterns)
+            ]
+            if database is not None and any(slot is not None for slot in slots):
+                self.scanners.append((field, database, slots))
+                self.template.update(
+                    (slot, False) for slot in slots if slot is not None
+                )
+
+    def _slots(self, program):
+        """
+        Yield the slots of the attribute and tag patterns of the program that
+        are scanned.
+        """
+        attributes, _, tags = program
+        for _, slot, _ in itertools.chain(attributes, tags):
+            if slot in self.template:
+                yield slot
+
+    @staticmethod
+    def _compile(expressions):
+        """
+        Compile the expressions into a Hyperscan database, their IDs being
+        their positions, leaving out the expressions it rejects. Returns the
+        database, or ``None``, and the IDs compiled.
+        """
+        flags = (
+            hyperscan.HS_FLAG_SINGLEMATCH
+            | hyperscan.HS_FLAG_ALLOWEMPTY
+            | hyperscan.HS_FLAG_UTF8
+            | hyperscan.HS_FLAG_UCP
+        )
+        ids = list(range(len(expressions)))
+        for attempt in range(2):
+            if not ids:
+                return None, frozenset()
+            database = hyperscan.Database()
+            try:
+                database.compile(
+                    expressions=[expressions[index] for index in ids],
+                    ids=ids,
+                    elements=len(ids),
+                    flags=flags,
+                )
+                return database, frozenset(ids)
+            except hyperscan.error:
+                if attempt:
+                    raise
+            # Find out the expressions rejected, e.g., too large.
+            accepted = []
+            for index in ids:
+                try:
+                    hyperscan.Database().compile(
+                        expressions=[expressions[index]],
+                        ids=[index],
+                        elements=1,
+                        flags=flags,
+                    )
+                    accepted.append(index)
+                except hyperscan.error:
+                    log.debug("Hyperscan can't compile %r", expressions[index])
+            ids = accepted
+
+    def _scratch(self, field, database):
+        # The scratch space can't be shared between threads.
+        scratches = getattr(self._local, "scratches", None)
+        if scratches is None:
+            scratches = self._local.scratches = {}
+        scratch = scratches.get(field)
+        if scratch is None:
+            scratch = scratches[field] = hyperscan.Scratch(database)
+        return scratch
+
+    def scan(self, alert, alert_tags):
+        """
+        Scan the alert, returning its memo, with the results of the patterns
+        scanned, and the slots of the patterns that may have matched.
+        """
+        memo = self.template.copy()
+        found = []
+        for field, database, slots in self.scanners:
+            if isinstance(field, tuple):
+                kind, key = field
+                if kind == "tags":
+                    value = alert_tags.get(key)
+                else:
+                    value = alert.service[key] if key < len(alert.service) else None
+            else:
+                value = getattr(alert, field)
+            if value is None:
+                continue
+            try:
+                data = value.encode("utf-8")
+            except UnicodeEncodeError:
+                # Not valid UTF-8, e.g., lone surrogates: left to ``re``.
+                for slot in slots:
+                    if slot is not None:
+                        del memo[slot]
+                        found.append(slot)
+                continue
+            matched = []
+            database.scan(
+                data,
+                match_event_handler=_hs_collect,
+                context=matched,
+                scratch=self._scratch(field, database),
+            )
+            for index in matched:
+                slot = slots[index]
+                if slot is not None:
+                    memo[slot] = True
+                    found.append(slot)
+        return memo, found
+
+    def candidates(self, alert, alert_tags=None, found=None):
+        """
+        Return the indexes of the rules that could match the alert, sorted.
+        """
+        if alert_tags is None:
+            alert_tags = parse_tags(alert.tags)
+        if found is None:
+            _, found = self.scan(alert, alert_tags)
+        indexes = set()
+        for slot in found:
+            indexes.update(self.by_slot.get(slot, ()))
+        if not alert.tags:
+            indexes.update(self.tagged)
+        candidates = sorted(indexes)
+        if self.always:
+            candidates = heapq.merge(candidates, self.always)
+        return candidates
+
+    def match(self, alert, alert_tags):
+        programs = self.table.programs
+        memo, found = self.scan(alert, alert_tags)
+        for index in self.candidates(alert, alert_tags, found):
+            rule = self.rules[index]
+            if rule.matches(alert, alert_tags, programs[index], memo):
+                return rule
+        return None
+
+
+class GuardedRule(object):
+    """
+    Proxy of a rule, timing its evaluation: ``exceeded`` is called with the
+    rule and the time taken, in seconds, when longer than ``budget``. The
+    evaluation itself can't be interrupted.
+    """
+
+    __slots__ = ("rule", "budget", "exceeded")
+
+    def __init__(self, rule, budget, exceeded):
+        self.rule = rule
+        self.budget = budget
+        self.exceeded = exceeded
+
+    def __getattr__(self, name):
+        return getattr(self.rule, name)
+
+    def __repr__(self):
+        return "GuardedRule({!r})".format(self.rule)
+
+    @property
+    def index(self):
+        return self.rule.index
+
+    @index.setter
+    def index(self, value):
+        self.rule.index = value
+
+    def matches(self, alert, alert_tags, program=None, memo=None):
+        started = time.perf_counter()
+        matched = self.rule.matches(alert, alert_tags, program, memo)
+        elapsed = time.perf_counter() - started
+        if elapsed > self.budget:
+            self.exceeded(self.rule, elapsed)
+        return matched
+
+
+MATCHERS = {
+    "linear": LinearMatcher,
+    "indexed": IndexedMatcher,
+    "set": SetMatcher,
+}
+
+
+class RuleSet(object):
+    """
+    The compiled Blackouts, in the order they have been retrieved from the DB.
+
+    The Blackouts having invalid regular expressions are logged once (the IDs
+    already reported are tracked in the ``reported`` set, which can be shared
+    between successive loads), and excluded from the matching, as well as the
+    Blackouts not active. The alerts are evaluated using the ``engine``
+    selected, one of the :data:`MATCHERS`.
+
+    The Blackouts having patterns prone to catastrophic backtracking are
+    disabled as well, unless ``unsafe`` is ``"allow"``: they are then probed
+    at load time, in a separate process, and disabled when taking longer than
+    the ``budget`` (or 100ms) to evaluate values crafted to trigger the
+    backtracking. With a ``budget``, in seconds, the Blackouts taking longer
+    to evaluate against an alert are disabled once evaluated (the evaluation
+    itself can't be interrupted): the ``slow`` dictionary, which can be shared
+    between successive loads, keeps them disabled until their patterns change.
+
+    The rules of the ``previous`` RuleSet are reused for the Blackouts whose
+    content didn't change, so only the Blackouts added, or changed, since are
+    compiled.
+
+    The ``hot`` rules, see :meth:`replan`, are moved ahead of the others: an
+    alert matching several Blackouts then matches the first hot one, if any,
+    rather than the first one.
+    """
+
+    _generations = itertools.count(1)
+
+    def __init__(
+        self,
+        blackouts,
+        reported=None,
+        engine="indexed",
+        clock=_utcnow,
+        unsafe="disable",
+        budget=0,
+        slow=None,
+        previous=None,
+    ):
+        reported = reported if reported is not None else set()
+        self.generation = next(self._generations)
+        self.engine = engine
+        self.clock = clock
+        self.budget = budget
+        self.slow = slow if slow is not None else {}
+        self.rules = []
+        self.by_id = {}
+        self.statuses = {}
+        self.invalid = []
+        # Rules excluded from the matching: ``{rule ID: reason}``.
+        self.disabled = {}
+        # The rules disabled until their patterns are probed.
+        self.unprobed = []
+        self.reported = reported
+        self.compiled = 0
+        # IDs of the rules evaluated first, and the active ones, in order.
+        self.hot_ids = ()
+        # The Hyperscan databases of the set engine, see :class:`SetMatcher`.
+        self.databases = previous.databases if previous is not None else {}
+        known = previous.by_id if previous is not None else {}
+        # Upcoming status changes: ``(time, sequence, rule ID, new status)``.
+        self.schedule = []
+        self._lock = threading.Lock()
+        now = clock()
+        for blackout in blackouts:
+            rule = known.get(blackout.id)
+            if rule is None or rule.key != _blackout_key(blackout):
+                rule = Rule(blackout)
+                self.compiled += 1
+            self.by_id[rule.id] = rule
+            self.statuses[rule.id] = self._schedule(rule, now)
+            if rule.error:
+                self.invalid.append(rule.id)
+                if rule.id not in reported:
+                    reported.add(rule.id)
+                    log.error(
+                        "Blackout %s has an invalid regular expression: %s. "
+                        "Ignoring it.",
+                        rule.id,
+                        rule.error,
+                    )
+                continue
+            if rule.unsafe and unsafe != "allow":
+                self.disabled[rule.id] = rule.unsafe
+                if rule.id not in reported:
+                    reported.add(rule.id)
+                    log.error(
+                        "Blackout %s %s, prone to catastrophic backtracking. "
+                        "Ignoring it.",
+                        rule.id,
+                        rule.unsafe,
+                    )
+            elif rule.unsafe and self._too_slow(rule) is None:
+                # Disabled until probed, in the background: see :meth:`probe`.
+                self.disabled[rule.id] = "not probed yet"
+                self.unprobed.append(rule)
+            elif rule.unsafe and self._too_slow(rule):
+                self.disabled[rule.id] = "too slow"
+                self._report_slow(rule)
+            elif self.slow.get(rule.id) == rule.signature():
+                self.disabled[rule.id] = "too slow"
+            self.rules.append(rule)
+        heapq.heapify(self.schedule)
+        self.matcher = self._matcher()
+
+    def _unsafe_patterns(self, rule):
+        patterns = [pattern for _, pattern in rule.attributes]
+        patterns.extend(rule.service)
+        patterns.extend(pattern for _, pattern in rule.tags)
+        return [
+            pattern
+            for pattern in patterns
+            if isinstance(pattern, re.Pattern) and pattern in _UNSAFE
+        ]
+
+    def _too_slow(self, rule):
+        """
+        Tell whether any pattern of the rule prone to catastrophic
+        backtracking is too slow, according to the probes (see
+        :func:`_too_slow`), or ``None`` when not all probed yet.
+        """
+        budget = self.budget or _PROBE_BUDGET
+        results = [_probed(pattern, budget) for pattern in self._unsafe_patterns(rule)]
+        if any(results):
+            return True
+        if None in results:
+            return None
+        return False
+
+    def _report_slow(self, rule):
+        if rule.id not in self.reported:
+            self.reported.add(rule.id)
+            log.error(
+                "Blackout %s %s, and takes longer than %.1fms to evaluate "
+                "crafted values. Ignoring it.",
+                rule.id,
+                rule.unsafe,
+                (self.budget or _PROBE_BUDGET) * 1000,
+            )
+
+    def probe(self, python=None):
+        """
+        Probe the patterns of the rules not probed yet, see :func:`_too_slow`,
+        and enable the rules fast enough. Meant to run in the background, as
+        each pattern takes up to a few seconds to probe.
+        """
+        budget = self.budget or _PROBE_BUDGET
+        unprobed, self.unprobed = self.unprobed, []
+        enabled = []
+        for rule in unprobed:
+            if any(
+                _too_slow(pattern, budget, python)
+                for pattern in self._unsafe_patterns(rule)
+            ):
+                self._report_slow(rule)
+                self.disabled[rule.id] = "too slow"
+            elif self.slow.get(rule.id) == rule.signature():
+                self.disabled[rule.id] = "too slow"
+            else:
+                enabled.append(rule)
+        if not enabled:
+            return
+        with self._lock:
+            for rule in enabled:
+                del self.disabled[rule.id]
+            self.matcher = self._matcher()
+            self.generation = next(self._generations)
+
+    def _schedule(self, rule, now):
+        """
+        Return the current status of the rule, and schedule its upcoming
+        changes. The status retrieved from the DB is used when the time window
+        is unknown.
+        """
+        if rule.start_time is None or rule.end_time is None:
+            return rule.status
+        sequence = len(self.schedule)
+        if now < rule.start_time:
+            self.schedule.append((rule.start_time, sequence, rule.id, "active"))
+            self.schedule.append((rule.end_time, sequence + 1, rule.id, "expired"))
+            return "pending"
+        if now < rule.end_time:
+            self.schedule.append((rule.end_time, sequence, rule.id, "expired"))
+            return "active"
+        return "expired"
+
+    def _matcher(self):
+        # Only the active Blackouts can match new alerts.
+        rules = [
+            rule
+            for rule in self.rules
+            if self.statuses[rule.id] == "active" and rule.id not in self.disabled
+        ]
+        if self.budget:
+            rules = [GuardedRule(rule, self.budget, self.disable) for rule in rules]
+        if self.hot_ids:
+            # The hot rules first, the others in order (the sort is stable).
+            ranks = {rule_id: index for index, rule_id in enumerate(self.hot_ids)}
+            rules.sort(key=lambda rule: ranks.get(rule.id, len(ranks)))
+        if self.engine != "set":
+            return MATCHERS[self.engine](rules)
+        # The patterns of all the rules are compiled, whatever their status.
+        matcher = SetMatcher(rules, universe=self.rules, databases=self.databases)
+        self.databases = matcher.databases
+        return matcher
+
+    def replan(self, order=None, hot=None):
+        """
+        Change the order the attributes are evaluated in, to the ``order`` of
+        the attributes, and the rules evaluated first, to the ``hot`` rule
+        IDs. The generation is incremented when the hot rules change, as the
+        matching results may be different.
+        """
+        reordered = False
+        if order is not None:
+            rank = {attr: index for index, attr in enumerate(order)}
+            for rule in self.rules:
+                attributes = tuple(
+                    sorted(rule.attributes, key=lambda item: rank.get(item[0], 0))
+                )
+                if attributes != rule.attributes:
+                    rule.attributes = attributes
+                    reordered = True
+        rehot = hot is not None and tuple(hot) != self.hot_ids
+        if not reordered and not rehot:
+            return
+        # The programs of the rules follow the order of the attributes, and
+        # the rules the order of the hot ones.
+        with self._lock:
+            if rehot:
+                self.hot_ids = tuple(hot)
+                self.generation = next(self._generations)
+            self.matcher = self._matcher()
+
+    def disable(self, rule, elapsed):
+        """
+        Disable a rule whose evaluation took ``elapsed`` seconds, longer than
+        the budget.
+        """
+        with self._lock:
+            if rule.id in self.disabled:
+                return
+            log.error(
+                "Blackout %s took %.1fms to evaluate, more than %.1fms. "
+                "Ignoring it.",
+                rule.id,
+                elapsed * 1000,
+                self.budget * 1000,
+            )
+            self.disabled[rule.id] = "too slow"
+            self.slow[rule.id] = rule.signature()
+            self.matcher = self._matcher()
+            self.generation = next(self._generations)
+
+    def advance(self):
+        """
+        Apply the status changes due, i.e., activate or expire the Blackouts
+        reaching the start or the end of their time window, and rebuild the
+        matcher when anything changed. The generation is then incremented, as
+        the matching results may be different.
+        """
+        schedule = self.schedule
+        if not schedule or schedule[0][0] > self.clock():
+            return False
+        with self._lock:
+            now = self.clock()
+            changed = False
+            while schedule and schedule[0][0] <= now:
+                _, _, rule_id, status = heapq.heappop(schedule)
+                log.debug("Blackout %s is now %s", rule_id, status)
+                self.statuses[rule_id] = status
+                changed = True
+            if changed:
+                self.matcher = self._matcher()
+                self.generation = next(self._generations)
+            return changed
+
+    def __len__(self):
+        return len(self.by_id)
+
+    @property
+    def patterns(self):
+        """
+        The :class:`PatternTable` of the rules currently matching.
+        """
+        return self.matcher.table
+
+    def get(self, blackout_id):
+        return self.by_id.get(blackout_id)
+
+    def status(self, blackout_id):
+        """
+        Return the current status of the Blackout, or ``None`` when it doesn't
+        exist.
+        """
+        self.advance()
+        return self.statuses.get(blackout_id)
+
+    def match(self, alert, alert_tags):
+        """
+        Return the first rule matching the alert, or ``None``.
+        """
+        self.advance()
+        rule = self.matcher.match(alert, alert_tags)
+        if self.budget and rule is not None:
+            return rule.rule
+        return rule
+
+
+def fingerprint(alert, alert_tags):
+    """
+    Return a hashable key identifying the alert attributes the matching
+    depends on.
+    """
+    return (
+        alert.environment,
+        alert.customer,
+        alert.group,
+        alert.event,
+        alert.resource,
+        tuple(alert.service or ()),
+        bool(alert.tags),
+        frozenset(alert_tags.items()),
+    )
+
+
+class MatchCache(object):
+    """
+    Bounded LRU cache of the matching results, keyed by the alert
+    :func:`fingerprint`, storing the ID of the rule matched, or ``None`` when
+    the alert doesn't match any rule. The cache is emptied whenever a
+    different :class:`RuleSet` generation is used. A ``size`` of ``0``
+    disables the caching.
+    """
+
+    _MISSING = object()
+
+    def __init__(self, size=10000):
+        self.size = size
+        self.generation = None
+        self.hits = 0
+        self.misses = 0
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def match(self, rules, alert, alert_tags):
+        """
+        Return the first rule matching the alert, or ``None``, looking up the
+        cache before evaluating the rules.
+        """
+        if self.size <= 0:
+            return rules.match(alert, alert_tags)
+        key = fingerprint(alert, alert_tags)
+        with self._lock:
+            if self.generation != rules.generation:
+                self._entries.clear()
+                self.generation = rules.generation
+            rule_id = self._entries.get(key, self._MISSING)
+            if rule_id is not self._MISSING:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return rules.get(rule_id) if rule_id is not None else None
+            self.misses += 1
+        rule = rules.match(alert, alert_tags)
+        with self._lock:
+            if self.generation == rules.generation:
+                self._entries[key] = rule.id if rule else None
+                if len(self._entries) > self.size:
+                    self._entries.popitem(last=False)
+        return rule
+
+
+class StatusCache(object):
+    """
+    Bounded LRU cache of the current status of the Blackouts, looked up one
+    by one, by ID, through ``lookup``, which returns the Blackout, or ``None``
+    when it doesn't exist. A status is cached for ``ttl`` seconds at most, and
+    never past the start, or the end, of the Blackout time window.
+    """
+
+    def __init__(self, lookup, ttl=10, size=10000, clock=_utcnow):
+        self.lookup = lookup
+        self.ttl = datetime.timedelta(seconds=ttl)
+        self.size = size
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def status(self, blackout_id):
+        """
+        Return the current status of the Blackout, or ``None`` when it doesn't
+        exist.
+        """
+        now = self.clock()
+        with self._lock:
+            entry = self._entries.get(blackout_id)
+            if entry is not None and now < entry[1]:
+                self._entries.move_to_end(blackout_id)
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+        blackout = self.lookup(blackout_id)
+        expires = now + self.ttl
+        if blackout is None:
+            status = None
+        else:
+            status, change = _window_status(
+                blackout.status,
+                _naive_utc(getattr(blackout, "start_time", None)),
+                _naive_utc(getattr(blackout, "end_time", None)),
+                now,
+            )
+            if change is not None:
+                expires = min(expires, change)
+        with self._lock:
+            self._entries[blackout_id] = (status, expires)
+            self._entries.move_to_end(blackout_id)
+            if len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+        return status
+
+
+def _tagged_blackout(alert):
+    """
+    Return the ID of the Blackout the alert has been tagged with, if any, same
+    as ``parse_tags(alert.tags).get("regex_blackout")``.
+    """
+    for tag in reversed(alert.tags or ()):
+        if tag.startswith("regex_blackout="):
+            return tag[len("regex_blackout=") :]
+    return None
+
+
+# The possible outcomes of the evaluation of an alert.
+IGNORED = "ignored"  # The alert is not evaluated, e.g., it's closed.
+ACTIVE = "active"  # The blackout previously matched is still active.
+RELEASED = "released"  # The blackout previously matched is no longer active.
+MATCHED = "matched"  # The alert matches a blackout.
+UNMATCHED = "unmatched"  # The alert doesn't match any blackout.
+
+Decision = collections.namedtuple("Decision", ["action", "blackout_id"])
+
+
+def evaluate(rules, alert, cache=None):
+    """
+    Evaluate an alert against a :class:`RuleSet`, and return the
+    :class:`Decision`, without changing the alert. The matching results are
+    looked up in, and stored into, the ``cache``, when provided.
+    """
+    if not alert or alert.status == "closed":
+        return Decision(IGNORED, None)
+    alert_tags = parse_tags(alert.tags)
+    if "regex_blackout" in alert_tags:
+        blackout_id = alert_tags["regex_blackout"]
+        if rules.status(blackout_id) == "active":
+            return Decision(ACTIVE, blackout_id)
+        return Decision(RELEASED, blackout_id)
+    rules.advance()
+    if cache is not None:
+        rule = cache.match(rules, alert, alert_tags)
+    else:
+        rule = rules.match(alert, alert_tags)
+    if rule:
+        return Decision(MATCHED, rule.id)
+    return Decision(UNMATCHED, None)
+
+
+def explain(rules, alert, decision):
+    """
+    Return a structured trace of the evaluation of the alert: for each active
+    rule evaluated, in order, up to the first one matching, the attribute, the
+    pattern, and the value that didn't match. Slow, this is meant for
+    diagnostics only.
+    """
+    alert_tags = parse_tags(alert.tags)
+    blackouts = []
+    for rule in rules.matcher.rules:
+        entry = {"blackout": rule.id, "matched": rule.matches(alert, alert_tags)}
+        blackouts.append(entry)
+        if entry["matched"]:
+            break
+        step = None
+        for step in rule.steps(alert, alert_tags):
+            pass
+        if step is not None and not step[3]:
+            attr, pattern, value, _ = step
+            entry["attribute"] = attr
+            entry["pattern"] = pattern.pattern if pattern is not None else None
+            entry["value"] = value
+    return {
+        "alert": alert.id,
+        "action": decision.action,
+        "blackout": decision.blackout_id,
+        "generation": rules.generation,
+        "blackouts": blackouts,
+    }
+
+
+def match_alerts(blackouts, alerts, engine="indexed"):
+    """
+    Evaluate the alerts against the Blackouts, and return the list of
+    :class:`Decision`, one for each alert, in the same order. The Blackouts
+    are compiled once, and the alerts having the same attributes are
+    evaluated only once.
+    """
+    if not isinstance(blackouts, RuleSet):
+        blackouts = RuleSet(blackouts, engine=engine)
+    cache = MatchCache()
+    return [evaluate(blackouts, alert, cache) for alert in alerts]
+
+
+def _candidates(matcher, alert, alert_tags):
+    """
+    Return the rules the matcher would evaluate the alert against, in order.
+    """
+    if isinstance(matcher, (IndexedMatcher, SetMatcher)):
+        return [matcher.rules[index] for index in matcher.candidates(alert, alert_tags)]
+    return matcher.rules
+
+
+class Metrics(object):
+    """
+    In-memory counters, gauges and latency histograms of the plugin,
+    periodically handed over to a ``sink``, a callable receiving the
+    :meth:`snapshot`.
+
+    Besides the timings of every alert, one alert every ``sample`` is
+    evaluated once more, pattern by pattern, to measure the time spent per
+    attribute, and the cumulative evaluation time of every pattern, in order
+    to identify the most expensive ones.
+    """
+
+    # Upper bounds of the latency histogram buckets, in seconds.
+    BUCKETS = (1e-5, 5e-5, 1e-4, 5e-4, 1e-3, 5e-3, 1e-2, 5e-2, 0.1, 0.5, 1.0)
+
+    def __init__(self, sink=None, interval=60, sample=100, clock=time.monotonic):
+        self.sink = sink
+        self.interval = interval
+        self.sample = sample
+        self.clock = clock
+        self.counters = collections.Counter()
+        self.gauges = {}
+        self.timers = {}
+        self.patterns = collections.Counter()
+        self.flushed = clock()
+        self._calls = 0
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def inc(self, name, count=1):
+        with self._lock:
+            self.counters[name] += count
+
+    def gauge(self, name, value):
+        """
+        Record the current ``value`` of the ``name`` gauge.
+        """
+        with self._lock:
+            self.gauges[name] = value
+
+    def observe(self, name, seconds):
+        """
+        Record a duration, in seconds, into the ``name`` timer.
+        """
+        with self._lock:
+            timer = self.timers.get(name)
+            if timer is None:
+                timer = self.timers[name] = {
+                    "count": 0,
+                    "total": 0.0,
+                    "buckets": [0] * (len(self.BUCKETS) + 1),
+                }
+            timer["count"] += 1
+            timer["total"] += seconds
+            timer["buckets"][bisect.bisect_left(self.BUCKETS, seconds)] += 1
+
+    def sampled(self):
+        """
+        Tell whether the current alert should be profiled.
+        """
+        self._calls += 1
+        return self.sample > 0 and self._calls % self.sample == 0
+
+    def profile(self, rules, alert, alert_tags):
+        """
+        Evaluate the alert against the rules, pattern by pattern, recording
+        the time spent per attribute and per pattern.
+        """
+        candidates = _candidates(rules.matcher, alert, alert_tags)
+        timings = collections.defaultdict(float)
+        patterns = collections.Counter()
+        for rule in candidates:
+            steps = rule.steps(alert, alert_tags)
+            matched = False
+            while True:
+                started = time.perf_counter()
+                step = next(steps, None)
+                elapsed = time.perf_counter() - started
+                if step is None:
+                    break
+                attr, pattern, _, matched = step
+                timings[attr] += elapsed
+                if pattern is not None:
+                    patterns[(rule.id, attr, pattern.pattern)] += elapsed
+            if matched and rule.matches(alert, alert_tags):
+                break
+        for attr, elapsed in timings.items():
+            self.observe("match.{}".format(attr), elapsed)
+        with self._lock:
+            self.patterns.update(patterns)
+
+    def slowest(self, count=10):
+        """
+        Return the ``count`` patterns having the highest cumulative evaluation
+        time, as ``((blackout ID, attribute, pattern), seconds)``.
+        """
+        with self._lock:
+            return self.patterns.most_common(count)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "counters": dict(self.counters),
+                "gauges": dict(self.gauges),
+                "timers": {
+                    name: dict(timer, buckets=list(timer["buckets"]))
+                    for name, timer in self.timers.items()
+                },
+                "buckets": list(self.BUCKETS),
+                "slowest": [
+                    {
+                        "blackout": blackout_id,
+                        "attribute": attr,
+                        "pattern": pattern,
+                        "seconds": seconds,
+                    }
+                    for (blackout_id, attr, pattern), seconds in (
+                        self.patterns.most_common(10)
+                    )
+                ],
+            }
+
+    def flush(self):
+        """
+        Hand over the metrics to the sink.
+        """
+        self.flushed = self.clock()
+        if self.sink is not None:
+            try:
+                self.sink(self.snapshot())
+            except Exception:
+                log.warning("Unable to flush the metrics", exc_info=True)
+
+    def maybe_flush(self):
+        """
+        Flush the metrics in a background thread, when the interval elapsed.
+        """
+        if self.clock() - self.flushed < self.interval:
+            return None
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return None
+            self.flushed = self.clock()
+            app = _current_app()
+
+            def _run():
+                with _app_context(app):
+                    self.flush()
+
+            self._thread = threading.Thread(
+                target=_run, name="blackout-regex-metrics", daemon=True
+            )
+            self._thread.start()
+            return self._thread
+
+
+def log_sink(snapshot):
+    """
+    Metrics sink writing the metrics to the plugin logs.
+    """
+    log.info("Blackout regex metrics: %s", json.dumps(snapshot, sort_keys=True))
+
+
+class AlertaSink(object):
+    """
+    Metrics sink publishing the counters, gauges and timers as Alerta metrics,
+    under the ``blackout_regex`` group, in the management API. The Alerta
+    timers only have a count and a total time, so the histograms are not
+    published.
+    """
+
+    GROUP = "blackout_regex"
+
+    def __init__(self):
+        self._sent = {}
+
+    def _delta(self, key, value):
+        delta = value - self._sent.get(key, 0)
+        self._sent[key] = value
+        return delta
+
+    def __call__(self, snapshot):
+        from alerta.app import db
+        from alerta.models.metrics import Counter, Gauge, Timer
+
+        for name, count in snapshot["counters"].items():
+            delta = self._delta(("counter", name), count)
+            if delta:
+                db.inc_counter(
+                    Counter(
+                        self.GROUP,
+                        name,
+                        title="Regex blackouts: {}".format(name),
+                        description="Number of {} events".format(name),
+                        count=delta,
+                    )
+                )
+        for name, value in snapshot.get("gauges", {}).items():
+            db.set_gauge(
+                Gauge(
+                    self.GROUP,
+                    name,
+                    title="Regex blackouts: {}".format(name),
+                    description="Current number of {}".format(name),
+                    value=value,
+                )
+            )
+        for name, timer in snapshot["timers"].items():
+            count = self._delta(("count", name), timer["count"])
+            total = self._delta(("total", name), timer["total"])
+            if count:
+                db.update_timer(
+                    Timer(
+                        self.GROUP,
+                        name,
+                        title="Regex blackouts: {}".format(name),
+                        description="Total time and number of {}".format(name),
+                        count=count,
+                        total_time=int(round(total * 1000)),
+                    )
+                )
+
+
+def _load_sink(name):
+    """
+    Return the metrics sink configured: ``alerta``, ``log``, or the path to a
+    callable, as ``module:callable``.
+    """
+    if name == "alerta":
+        return AlertaSink()
+    if name == "log":
+        return log_sink
+    module, _, path = name.partition(":")
+    sink = importlib.import_module(module)
+    for attr in path.split("."):
+        sink = getattr(sink, attr)
+    return sink
+
+
+def log_writer(records):
+    """
+    Audit writer logging the records, one per line.
+    """
+    for record in records:
+        audit_log.info("%s", json.dumps(record, sort_keys=True))
+
+
+class NDJSONWriter(object):
+    """
+    Audit writer appending the records to the NDJSON file at ``path``. Each
+    batch is appended with a single write, so the records of several worker
+    processes sharing the file don't interleave.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def __call__(self, records):
+        data = "".join(
+            json.dumps(record, sort_keys=True) + "\n" for record in records
+        ).encode("utf-8")
+        fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, data)
+        finally:
+            os.close(fd)
+
+
+def _load_writer(name):
+    """
+    Return the audit writer configured: ``log``, the path to a callable, as
+    ``module:callable``, or else the path to an NDJSON file.
+    """
+    if name == "log":
+        return log_writer
+    if ":" in name and os.sep not in name:
+        return _load_sink(name)
+    return NDJSONWriter(name)
+
+
+class AuditLog(object):
+    """
+    Audit trail of the alerts suppressed, or tagged, by the Blackouts.
+
+    The decisions are queued, without any lock nor I/O, and handed over, in
+    batches of up to ``batch`` records, to the ``writer``, a callable
+    receiving a list of records, by a background thread, every ``interval``
+    seconds, or as soon as a batch is full. When the queue holds ``size``
+    records already, i.e., the writer can't keep up, the decisions are
+    dropped, and counted, rather than blocking the alerts.
+
+    The number of alerts per Blackout and action are aggregated in memory,
+    including the records dropped, see :meth:`report`.
+    """
+
+    def __init__(self, writer, size=10000, batch=100, interval=1.0):
+        self.writer = writer
+        self.size = size
+        self.batch = batch
+        self.interval = interval
+        # ``deque.append`` and ``popleft`` are thread-safe.
+        self.queue = collections.deque()
+        self.counts = collections.Counter()
+        self.written = 0
+        self.dropped = 0
+        self.failures = 0
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def record(self, alert, blackout_id, action):
+        """
+        Queue the ``action`` (``suppressed``, ``tagged`` or ``active``) taken
+        on the alert, because of the Blackout.
+        """
+        if self._thread is None:
+            self.start()
+        queue = self.queue
+        if len(queue) >= self.size:
+            with self._lock:
+                self.dropped += 1
+                self.counts[(blackout_id, action)] += 1
+            return
+        queue.append(
+            (
+                time.time(),
+                alert.id,
+                alert.environment,
+                alert.resource,
+                alert.event,
+                blackout_id,
+                action,
+            )
+        )
+        if len(queue) >= self.batch:
+            self._wake.set()
+
+    def start(self):
+        """
+        Start the background writer, unless already started. Started lazily,
+        from the worker process, and the application context, recording the
+        decisions.
+        """
+        with self._lock:
+            if self._thread is not None:
+                return self._thread
+            app = _current_app()
+
+            def _run():
+                with _app_context(app):
+                    self._run()
+
+            self._thread = threading.Thread(
+                target=_run, name="blackout-regex-audit", daemon=True
+            )
+            self._thread.start()
+            return self._thread
+
+    def _run(self):
+        while not self._stopped.is_set():
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            while self.flush() == self.batch:
+                pass
+        while self.flush():
+            pass
+
+    def flush(self):
+        """
+        Hand over the next batch of records to the writer. Returns the number
+        of records.
+        """
+        queue = self.queue
+        entries = []
+        for _ in range(self.batch):
+            try:
+                entries.append(queue.popleft())
+            except IndexError:
+                break
+        if not entries:
+            return 0
+        records = [
+            {
+                "time": datetime.datetime.fromtimestamp(
+                    created, datetime.timezone.utc
+                ).isoformat(),
+                "alert": alert_id,
+                "environment": environment,
+                "resource": resource,
+                "event": event,
+                "blackout": blackout_id,
+                "action": action,
+            }
+            for created, alert_id, environment, resource, event, blackout_id, action in (
+                entries
+            )
+        ]
+        with self._lock:
+            self.counts.update((entry[5], entry[6]) for entry in entries)
+        try:
+            self.writer(records)
+        except Exception:
+            with self._lock:
+                self.failures += 1
+            log.warning("Unable to write %d audit records", len(records), exc_info=True)
+        else:
+            with self._lock:
+                self.written += len(records)
+        return len(entries)
+
+    def stop(self, timeout=None):
+        """
+        Stop the background writer, once the records queued are written.
+        """
+        self._stopped.set()
+        self._wake.set()
+        thread = self._thread
+        if thread is not None and thread is not threading.current_thread():
+            thread.join(timeout)
+
+    def report(self):
+        """
+        Return the number of alerts suppressed, tagged, or still under an
+        active Blackout, per Blackout, and the number of records queued,
+        written, and dropped.
+        """
+        with self._lock:
+            blackouts = {}
+            for (blackout_id, action), count in self.counts.items():
+                blackouts.setdefault(blackout_id, {})[action] = count
+            return {
+                "blackouts": blackouts,
+                "queued": len(self.queue),
+                "written": self.written,
+                "dropped": self.dropped,
+                "failures": self.failures,
+            }
+
+
+class Planner(object):
+    """
+    Adapt the evaluation order to the alerts: the attributes rejecting the
+    most alerts are evaluated first, and, optionally, the ``hot`` Blackouts
+    matching the most alerts are moved ahead of the others, which may change
+    the Blackout an alert matching several ones is tagged with.
+
+    The Blackouts matched are counted for every alert, while one alert every
+    ``sample`` is evaluated once more, pattern by pattern, to measure the
+    rejection rate of each attribute. Every ``interval`` seconds, a new plan
+    is computed, and applied to the rules, and the counts are halved, so the
+    plan follows the changes of the traffic. The hot Blackouts are ordered by
+    decreasing number of alerts matched, then by ID, so the plan is
+    deterministic.
+    """
+
+    def __init__(self, hot=0, interval=60, sample=100, clock=time.monotonic):
+        self.hot = hot
+        self.interval = interval
+        self.sample = sample
+        self.clock = clock
+        self.evaluated = collections.Counter()
+        self.rejected = collections.Counter()
+        self.hits = collections.Counter()
+        self.plan = {
+            "attributes": list(ATTRIBUTES),
+            "rejection_rates": {},
+            "hot": [],
+            "hits": {},
+            "planned": None,
+        }
+        self.planned = clock()
+        self._calls = 0
+        self._lock = threading.Lock()
+
+    def record(self, rules, alert, decision):
+        """
+        Record the evaluation of the alert against the rules, and apply a new
+        plan when due.
+        """
+        with self._lock:
+            self._calls += 1
+            sampled = self.sample > 0 and self._calls % self.sample == 0
+            if decision.action == MATCHED:
+                self.hits[decision.blackout_id] += 1
+        if sampled:
+            alert_tags = parse_tags(alert.tags)
+            evaluated = collections.Counter()
+            rejected = collections.Counter()
+            for rule in _candidates(rules.matcher, alert, alert_tags):
+                for attr, _, _, matched in rule.steps(alert, alert_tags):
+                    evaluated[attr] += 1
+                    if not matched:
+                        rejected[attr] += 1
+            with self._lock:
+                self.evaluated.update(evaluated)
+                self.rejected.update(rejected)
+        if self.clock() - self.planned >= self.interval:
+            self.replan(rules)
+
+    def replan(self, rules):
+        """
+        Compute a new plan, and apply it to the rules.
+        """
+        with self._lock:
+            self.planned = self.clock()
+            rates = {
+                attr: self.rejected[attr] / float(self.evaluated[attr])
+                for attr in ATTRIBUTES
+                if self.evaluated[attr]
+            }
+            order = sorted(
+                ATTRIBUTES,
+                key=lambda attr: (-rates.get(attr, 0.0), ATTRIBUTES.index(attr)),
+            )
+            hot = sorted(
+                (rule_id for rule_id in self.hits if rule_id in rules.by_id),
+                key=lambda rule_id: (-self.hits[rule_id], rule_id),
+            )[: self.hot]
+            self.plan = {
+                "attributes": order,
+                "rejection_rates": rates,
+                "hot": hot,
+                "hits": {rule_id: self.hits[rule_id] for rule_id in hot},
+                "planned": _utcnow().isoformat(),
+            }
+            for counter in (self.evaluated, self.rejected, self.hits):
+                for key in list(counter):
+                    counter[key] //= 2
+                    if not counter[key]:
+                        del counter[key]
+        self.apply(rules)
+
+    def apply(self, rules):
+        """
+        Apply the current plan to the rules, e.g., once reloaded.
+        """
+        rules.replan(order=self.plan["attributes"], hot=self.plan["hot"])
+
+
+class Profiler(object):
+    """
+    Sampling profiler of the ``pre_receive`` path: one call every ``sample``
+    is timed, and broken down into loading the rules, parsing the tags, and
+    evaluating each Blackout, measured on a second evaluation of the alert,
+    before the actual one. The time not accounted for by the breakdown is
+    attributed to ``pre_receive`` itself.
+
+    The samples are aggregated in memory, as collapsed stacks (e.g.,
+    ``pre_receive;evaluate;blackout:42``), in microseconds, and written every
+    ``interval`` seconds to ``path``, where ``{pid}`` is replaced by the
+    worker process ID, ready for flame graph tools. With ``cprofile``, the
+    sampled calls are profiled by :mod:`cProfile` as well, and the statistics
+    written next to it, with the ``.pstats`` extension.
+    """
+
+    def __init__(
+        self, path, sample=100, interval=60, cprofile=False, clock=time.monotonic
+    ):
+        self.path = path
+        self.sample = sample
+        self.interval = interval
+        self.clock = clock
+        self.stacks = collections.Counter()
+        self.samples = 0
+        self.dumped = clock()
+        self.profile = None
+        if cprofile:
+            import cProfile
+
+            self.profile = cProfile.Profile()
+        self._calls = 0
+        self._lock = threading.Lock()
+
+    def run(self, plugin, alert):
+        """
+        Apply the Blackouts to the alert, through the plugin, profiling one call
+        every ``sample``.
+        """
+        self._calls += 1
+        if self.sample <= 0 or self._calls % self.sample:
+            return plugin._apply_blackout(alert)
+        stacks = collections.Counter()
+        breakdown = 0.0
+        if alert and alert.status != "closed" and _tagged_blackout(alert) is None:
+            breakdown = self._breakdown(plugin, alert, stacks)
+        started = time.perf_counter()
+        try:
+            if self.profile is None:
+                return plugin._apply_blackout(alert)
+            with self._lock:
+                self.profile.enable()
+                try:
+                    return plugin._apply_blackout(alert)
+                finally:
+                    self.profile.disable()
+        finally:
+            elapsed = time.perf_counter() - started
+            stacks[("pre_receive",)] += max(elapsed - breakdown, 0.0)
+            self._record(stacks)
+
+    def _breakdown(self, plugin, alert, stacks):
+        started = time.perf_counter()
+        rules = plugin._fetch_rules()
+        fetched = time.perf_counter()
+        alert_tags = parse_tags(alert.tags)
+        parsed = time.perf_counter()
+        stacks[("pre_receive", "_fetch_rules")] += fetched - started
+        stacks[("pre_receive", "parse_tags")] += parsed - fetched
+        for rule in _candidates(rules.matcher, alert, alert_tags):
+            begin = time.perf_counter()
+            matched = rule.matches(alert, alert_tags)
+            stacks[("pre_receive", "evaluate", "blackout:{}".format(rule.id))] += (
+                time.perf_counter() - begin
+            )
+            if matched:
+                break
+        return time.perf_counter() - started
+
+    def _record(self, stacks):
+        with self._lock:
+            self.samples += 1
+            self.stacks.update(stacks)
+        if self.clock() - self.dumped >= self.interval:
+            self.dump()
+
+    def collapsed(self):
+        """
+        Return the samples as collapsed stacks, one per line, with the time
+        spent in microseconds.
+        """
+        with self._lock:
+            return "".join(
+                "{} {}\n".format(";".join(stack), int(round(seconds * 1e6)))
+                for stack, seconds in sorted(self.stacks.items())
+            )
+
+    def dump(self):
+        """
+        Write the samples aggregated so far to the file of this worker.
+        """
+        self.dumped = self.clock()
+        path = self.path.format(pid=os.getpid())
+        try:
+            directory = os.path.dirname(os.path.abspath(path))
+            fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".blackout-regex")
+            try:
+                with os.fdopen(fd, "w") as tmp:
+                    tmp.write(self.collapsed())
+                os.replace(tmp_path, path)
+            except Exception:
+                os.unlink(tmp_path)
+                raise
+            if self.profile is not None:
+                with self._lock:
+                    self.profile.dump_stats(os.path.splitext(path)[0] + ".pstats")
+        except Exception:
+            log.warning("Unable to write the profile %s", path, exc_info=True)
+        return path
+
+
+class BlackoutCache(object):
+    """
+    Process-local cache of the Blackouts.
+
+    The cached value is whatever the ``loader`` callable returns, i.e., the
+    list of Blackouts or their compiled representation. The Blackouts are
+    considered fresh for ``ttl`` seconds. Once expired, the
+    ``probe`` callable (when provided) is executed to retrieve a cheap
+    signature of the Blackouts set, and the full list is reloaded through
+    ``loader`` only when the signature changed, or when the data is older than
+    ``max_age`` seconds. Revalidation happens in a background thread while the
+    stale data continues to be served, so a slow or failing DB doesn't stall
+    the alert ingestion. A ``ttl`` of ``0`` disables the caching, and the
+    Blackouts are reloaded synchronously on every call. ``value`` is served
+    until the Blackouts are successfully loaded.
+
+    The time of the last successful check (``refreshed``), its duration in
+    seconds (``duration``) and the number of ``failures`` are recorded.
+    """
+
+    def __init__(
+        self, loader, probe=None, ttl=10, max_age=300, value=(), clock=time.monotonic
+    ):
+        self.loader = loader
+        self.probe = probe
+        self.ttl = ttl
+        self.max_age = max_age
+        self.clock = clock
+        self.value = value
+        self.generation = 0
+        self.signature = None
+        self.loaded = None
+        self.checked = None
+        self.failures = 0
+        self.refreshed = None
+        self.duration = None
+        self.refresher = None
+        self.listener = None
+        self._lock = threading.Lock()
+        self._thread_lock = threading.Lock()
+        self._thread = None
+
+    def get(self):
+        """
+        Return the cached Blackouts, reloading or revalidating them when
+        needed.
+        """
+        if self.refresher is not None and self.loaded is not None:
+            # Kept up to date in the background.
+            return self.value
+        listener = self.listener
+        if (
+            listener is not None
+            and listener.connected
+            and self.loaded is not None
+            and self.clock() - self.checked < self.max_age
+        ):
+            # Reloaded as soon as notified of any change.
+            return self.value
+        if self.ttl <= 0:
+            self.refresh(force=True)
+        elif self.checked is None or self.clock() - self.checked >= self.ttl:
+            if self.loaded is None:
+                # Nothing to serve yet, so there's no choice but to wait.
+                self.refresh()
+            else:
+                self.revalidate()
+        return self.value
+
+    def refresh(self, force=False):
+        """
+        Synchronously check the Blackouts, and reload them when changed.
+        Returns ``True`` when the Blackouts have been reloaded.
+        """
+        with self._lock:
+            now = self.clock()
+            started = time.perf_counter()
+            try:
+                signature = self.probe() if self.probe else None
+                if (
+                    not force
+                    and self.loaded is not None
+                    and signature is not None
+                    and signature == self.signature
+                    and now - self.loaded < self.max_age
+                ):
+                    log.debug("Blackouts unchanged, keeping the cached list")
+                    self.checked = now
+                    self.refreshed = time.time()
+                    self.duration = time.perf_counter() - started
+                    return False
+                value = self.loader()
+            except Exception:
+                self.failures += 1
+                # Don't retry on every alert, but wait for the next check.
+                self.checked = now
+                log.warning(
+                    "Unable to retrieve the Blackouts from the DB, using the "
+                    "cached list (%d Blackouts)",
+                    len(self.value),
+                    exc_info=True,
+                )
+                return False
+            self.value = value
+            self.signature = signature
+            self.generation += 1
+            self.loaded = self.checked = now
+            self.refreshed = time.time()
+            self.duration = time.perf_counter() - started
+            return True
+
+    def revalidate(self):
+        """
+        Refresh the Blackouts in a background thread, unless there's a refresh
+        already in progress. Returns the thread started, if any.
+        """
+        with self._thread_lock:
+            if self._thread is not None and self._thread.is_alive():
+                return None
+            app = _current_app()
+
+            def _run():
+                with _app_context(app):
+                    self.refresh()
+
+            self._thread = threading.Thread(
+                target=_run, name="blackout-regex-refresh", daemon=True
+            )
+            self._thread.start()
+            return self._thread
+
+    def start(self, interval):
+        """
+        Start refreshing the Blackouts in the background, every ``interval``
+        seconds, unless already started. From then on, :meth:`get` serves
+        the cached Blackouts without ever checking them.
+        """
+        with self._thread_lock:
+            if self.refresher is None or not self.refresher.is_alive():
+                self.refresher = BlackoutRefresher(self, interval)
+                self.refresher.start()
+            return self.refresher
+
+    def listen(self, source, on_change=None):
+        """
+        Start listening to the Blackouts changes from a notification
+        ``source``, unless already started, see :class:`ChangeListener`.
+        While the ``source`` is connected, :meth:`get` serves the cached
+        Blackouts without checking them, but every ``max_age`` seconds.
+        """
+        with self._thread_lock:
+            if self.listener is None or not self.listener.is_alive():
+                self.listener = ChangeListener(self, source, on_change=on_change)
+                self.listener.start()
+            return self.listener
+
+    def stop(self):
+        """
+        Stop the background refresher, and the listener, if started.
+        """
+        with self._thread_lock:
+            refresher, self.refresher = self.refresher, None
+            listener, self.listener = self.listener, None
+        for thread in (refresher, listener):
+            if thread is not None:
+                thread.stop()
+
+
+class BlackoutRefresher(threading.Thread):
+    """
+    Daemon thread refreshing a :class:`BlackoutCache` every ``interval``
+    seconds, within the context of the Alerta application the thread has
+    been started from. The new Blackouts are swapped in atomically, while the
+    alerts continue to be evaluated against the previous ones. On failures,
+    the previous Blackouts are kept, and the failures are counted by the
+    cache.
+    """
+
+    def __init__(self, cache, interval):
+        super(BlackoutRefresher, self).__init__(
+            name="blackout-regex-refresher", daemon=True
+        )
+        self.cache = cache
+        self.interval = interval
+        self.app = _current_app()
+        self._stopped = threading.Event()
+
+    def run(self):
+        while not self._stopped.is_set():
+            with _app_context(self.app):
+                self.cache.refresh()
+            self._stopped.wait(self.interval)
+
+    def stop(self, timeout=None):
+        self._stopped.set()
+        if self is not threading.current_thread():
+            self.join(timeout)
+
+
+class ChangeListener(threading.Thread):
+    """
+    Daemon thread listening to the Blackouts changes from a notification
+    ``source``, and reloading the :class:`BlackoutCache` as soon as notified,
+    within the context of the Alerta application the thread has been started
+    from. The changes notified within ``debounce`` seconds are coalesced into
+    a single reload. ``on_change`` is called with the time of the (first)
+    notification, and defaults to reloading the cache.
+
+    The Blackouts are reloaded as well once connected, as changes may have
+    been missed in the meantime. When the connection is lost, the cache falls
+    back to polling, until reconnected, after ``retry`` seconds, doubling up
+    to ``max_retry`` seconds.
+
+    A source has the following methods: ``connect()``, ``wait(timeout)``,
+    which returns the list of the changes notified within ``timeout``
+    seconds, if any, and ``close()``. Both ``connect`` and ``wait`` raise an
+    exception when the connection fails.
+    """
+
+    def __init__(
+        self, cache, source, on_change=None, debounce=0.1, retry=1, max_retry=60
+    ):
+        super(ChangeListener, self).__init__(
+            name="blackout-regex-listener", daemon=True
+        )
+        self.cache = cache
+        self.source = source
+        self.on_change = on_change or (lambda since: cache.refresh(force=True))
+        self.debounce = debounce
+        self.retry = retry
+        self.max_retry = max_retry
+        self.connected = False
+        self.notified = 0
+        self.failures = 0
+        self.app = _current_app()
+        self._stopped = threading.Event()
+
+    def _changed(self, since):
+        try:
+            with _app_context(self.app):
+                self.on_change(since)
+        except Exception:
+            log.warning("Unable to reload the Blackouts", exc_info=True)
+
+    def _listen(self):
+        self.source.connect()
+        try:
+            self.connected = True
+            self._changed(time.time())
+            while not self._stopped.is_set():
+                if not self.source.wait(1.0):
+                    continue
+                since = time.time()
+                self.notified += 1
+                while self.source.wait(self.debounce) and (
+                    time.time() - since < 10 * self.debounce
+                ):
+                    pass
+                self._changed(since)
+        finally:
+            self.connected = False
+            self.source.close()
+
+    def run(self):
+        delay = self.retry
+        while not self._stopped.is_set():
+            try:
+                self._listen()
+            except Exception:
+                self.failures += 1
+                log.warning(
+                    "Lost the Blackouts change notifications, polling until "
+                    "reconnected",
+                    exc_info=True,
+                )
+            else:
+                delay = self.retry
+            self._stopped.wait(delay)
+            delay = min(delay * 2, self.max_retry)
+
+    def stop(self, timeout=None):
+        self._stopped.set()
+        if self is not threading.current_thread():
+            self.join(timeout)
+
+
+class PostgresNotifications(object):
+    """
+    Blackouts changes notified by PostgreSQL, through ``LISTEN`` on the
+    ``channel``. The notifications must be sent by a trigger on the
+    ``blackouts`` table, see the README.
+    """
+
+    def __init__(self, dsn, channel="blackouts"):
+        self.dsn = dsn
+        self.channel = channel
+        self.conn = None
+
+    def connect(self):
+        import psycopg2
+        from psycopg2 import sql
+
+        self.conn = psycopg2.connect(self.dsn)
+        self.conn.autocommit = True
+        with self.conn.cursor() as cursor:
+            cursor.execute(sql.SQL("LISTEN {}").format(sql.Identifier(self.channel)))
+
+    def wait(self, timeout):
+        if not select.select([self.conn], [], [], timeout)[0]:
+            return []
+        self.conn.poll()
+        changes = [notify.payload for notify in self.conn.notifies]
+        del self.conn.notifies[:]
+        return changes
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+
+class MongoNotifications(object):
+    """
+    Blackouts changes notified by MongoDB, through a change stream on the
+    ``collection``. Change streams require a replica set.
+    """
+
+    def __init__(self, uri, collection="blackouts"):
+        self.uri = uri
+        self.collection = collection
+        self.client = None
+        self.stream = None
+
+    def connect(self):
+        import pymongo
+
+        self.client = pymongo.MongoClient(self.uri)
+        collection = self.client.get_default_database()[self.collection]
+        self.stream = collection.watch(max_await_time_ms=100)
+
+    def wait(self, timeout):
+        deadline = time.monotonic() + timeout
+        changes = []
+        while True:
+            change = self.stream.try_next()
+            if change is not None:
+                changes.append(str(change.get("documentKey", {}).get("_id")))
+            elif changes or time.monotonic() >= deadline:
+                return changes
+
+    def close(self):
+        if self.stream is not None:
+            self.stream.close()
+            self.stream = None
+        if self.client is not None:
+            self.client.close()
+            self.client = None
+
+
+class SocketNotifications(object):
+    """
+    Blackouts changes notified as datagrams, of any content, on a Unix socket,
+    bound to ``path``. Meant for testing, or for a single process.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.sock = None
+
+    def connect(self):
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self.sock.bind(self.path)
+
+    def wait(self, timeout):
+        changes = []
+        self.sock.settimeout(timeout)
+        while True:
+            try:
+                changes.append(self.sock.recv(4096).decode("utf-8", "replace"))
+            except (socket.timeout, BlockingIOError):
+                return changes
+            # Whatever else has been notified meanwhile.
+            self.sock.settimeout(0)
+
+    def close(self):
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+
+
+def notification_source(url, channel="blackouts"):
+    """
+    Return the notification source for the URL: ``postgres://...``,
+    ``mongodb://...``, or ``unix:///path/to/socket``.
+    """
+    scheme = url.split(":", 1)[0].lower()
+    if scheme in ("postgres", "postgresql"):
+        return PostgresNotifications(url, channel=channel)
+    if scheme in ("mongodb", "mongodb+srv"):
+        return MongoNotifications(url, collection=channel)
+    if scheme == "unix":
+        return SocketNotifications(url[len("unix://") :])
+    raise ValueError("Unsupported notification source: {}".format(url))
+
+
+# The Blackout fields stored in the snapshot, i.e., required to build a Rule.
+SNAPSHOT_FIELDS = (
+    "id",
+    "status",
+    "start_time",
+    "end_time",
+    "service",
+    "tags",
+) + ATTRIBUTES
+SNAPSHOT_VERSION = 1
+
+
+def _to_json(value):
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.isoformat()
+    return str(value)
+
+
+class SnapshotBlackout(object):
+    """
+    Blackout loaded from a :class:`SharedSnapshot`, holding only the fields
+    required to build a :class:`Rule`.
+    """
+
+    def __init__(self, **fields):
+        for field in SNAPSHOT_FIELDS:
+            setattr(self, field, fields.get(field))
+
+
+class SharedSnapshot(object):
+    """
+    Blackouts shared between the worker processes through a file.
+
+    The first line of the file is a JSON header, with the format ``version``,
+    the ``generation`` (incremented every time the Blackouts change) and the
+    ``signature`` returned by the ``probe``, followed by the Blackouts, as a
+    JSON list. The file modification time is the last time the Blackouts have
+    been checked.
+
+    Only one worker at a time, holding the lock on the ``<path>.lock`` file,
+    checks the Blackouts in the DB, when the snapshot is older than ``ttl``
+    seconds, reloads them through ``loader`` when the ``probe`` signature
+    changed (or the Blackouts are older than ``max_age`` seconds), and
+    replaces the file. The other workers only read the header, and load the
+    Blackouts from the file when the generation changes.
+    """
+
+    def __init__(self, path, loader, probe=None, ttl=10, max_age=300, clock=time.time):
+        self.path = path
+        self.loader = loader
+        self.probe = probe
+        self.ttl = ttl
+        self.max_age = max_age
+        self.clock = clock
+
+    def _read(self, body=False):
+        """
+        Return the header and, when ``body`` is requested, the Blackouts.
+        """
+        with open(self.path, "rb") as fd:
+            with mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                header = json.loads(mm.readline())
+                if header.get("version") != SNAPSHOT_VERSION:
+                    raise ValueError(
+                        "Unsupported snapshot version {}".format(header.get("version"))
+                    )
+                if not body:
+                    return header, None
+                return header, json.loads(mm[mm.tell() :])
+
+    def _write(self, header, blackouts):
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".blackout-regex")
         try:
-            # retrieve all blackouts from the DB.
-            # use the alerta blackout model to retrieve the blackouts.
-            # The model standardizes the data returned from mongodb and postgres db.
-            count = Blackout.count()
-            log.debug(f"There are {count} Blackouts currently open")
-            blackouts = Blackout.find_all(page=1, page_size=count)
-            log.debug("Retrieved Blackouts from the DB:")
-            log.debug(blackouts)
+            with os.fdopen(fd, "w") as tmp:
+                json.dump(header, tmp, separators=(",", ":"), default=_to_json)
+                tmp.write("\n")
+                json.dump(
+                    [
+                        {
+                            field: getattr(blackout, field, None)
+                            for field in SNAPSHOT_FIELDS
+                        }
+                        for blackout in blackouts
+                    ],
+                    tmp,
+                    separators=(",", ":"),
+                    default=_to_json,
+                )
+            os.replace(tmp_path, self.path)
         except Exception:
-            log.debug("Unable to retrieve the Blackouts from the DB", exc_info=True)
-            blackouts = []
+            os.unlink(tmp_path)
+            raise
+
+    def sync(self, since=None):
+        """
+        Update the snapshot from the DB, if this worker holds the lock and the
+        snapshot is outdated. When notified of a change ``since`` a given
+        time, the snapshot is reloaded unless created since then. Returns
+        ``True`` when the snapshot has been replaced.
+        """
+        import fcntl
+
+        with open(self.path + ".lock", "a") as lock:
+            # Block only when there's no snapshot at all yet, or to reload it
+            # after a change, otherwise just leave it to the worker already
+            # updating the snapshot.
+            blocking = since is not None or not os.path.exists(self.path)
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+            except BlockingIOError:
+                return False
+            try:
+                return self._sync(since)
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _sync(self, since=None):
+        now = self.clock()
+        header = None
+        try:
+            if since is None and now - os.stat(self.path).st_mtime < self.ttl:
+                return False
+            header, _ = self._read()
+        except (OSError, ValueError):
+            log.debug("Unable to read the snapshot %s", self.path, exc_info=True)
+        if header and since is not None and header.get("created", 0) >= since:
+            # Already reloaded by another worker notified of the same change.
+            return False
+        signature = None
+        if self.probe:
+            # Normalise the signature as it would be read back from the file.
+            signature = json.loads(json.dumps(self.probe(), default=_to_json))
+        if (
+            header
+            and since is None
+            and signature is not None
+            and signature == header.get("signature")
+            and now - header.get("created", 0) < self.max_age
+        ):
+            os.utime(self.path)
+            return False
+        blackouts = self.loader()
+        header = {
+            "version": SNAPSHOT_VERSION,
+            "generation": (header or {}).get("generation", 0) + 1,
+            "created": now,
+            "signature": signature,
+        }
+        self._write(header, blackouts)
+        log.debug("Snapshot %s updated, generation %d", self.path, header["generation"])
+        return True
+
+    def generation(self):
+        """
+        Update the snapshot when required, and return its generation.
+        """
+        self.sync()
+        header, _ = self._read()
+        return header["generation"]
+
+    def load(self):
+        """
+        Return the Blackouts from the snapshot.
+        """
+        _, blackouts = self._read(body=True)
+        return [SnapshotBlackout(**blackout) for blackout in blackouts]
+
+
+class BlackoutRegex(PluginBase):
+    def __init__(self, name=None):
+        super(BlackoutRegex, self).__init__(name=name)
+        self._invalid = set()
+        self._slow = {}
+        self._unsafe = self.get_config(
+            "BLACKOUT_REGEX_UNSAFE_PATTERNS", default="disable"
+        )
+        self._python = self.get_config("BLACKOUT_REGEX_PROBE_PYTHON", default=None)
+        self._prober = None
+        self._budget = (
+            self.get_config("BLACKOUT_REGEX_PATTERN_BUDGET", default=0, type=float)
+            / 1000.0
+        )
+        self._engine = self.get_config("BLACKOUT_REGEX_ENGINE", default="indexed")
+        if self._engine not in MATCHERS:
+            log.error(
+                "Unknown BLACKOUT_REGEX_ENGINE %s, using the indexed engine",
+                self._engine,
+            )
+            self._engine = "indexed"
+        ttl = self.get_config("BLACKOUT_REGEX_CACHE_TTL", default=10, type=int)
+        max_age = self.get_config("BLACKOUT_REGEX_CACHE_MAX_AGE", default=300, type=int)
+        self._snapshot = None
+        snapshot_path = self.get_config("BLACKOUT_REGEX_SNAPSHOT", default=None)
+        if snapshot_path:
+            self._snapshot = SharedSnapshot(
+                snapshot_path,
+                self._load_blackouts,
+                probe=self._probe_blackouts,
+                ttl=ttl,
+                max_age=max_age,
+            )
+        self._cache = BlackoutCache(
+            self._load_rules,
+            probe=(
+                self._snapshot.generation if self._snapshot else self._probe_blackouts
+            ),
+            ttl=ttl,
+            max_age=max_age,
+            value=RuleSet([]),
+        )
+        self._statuses = StatusCache(self._find_blackout, ttl=ttl)
+        self._match_cache = MatchCache(
+            size=self.get_config(
+                "BLACKOUT_REGEX_MATCH_CACHE_SIZE", default=10000, type=int
+            )
+        )
+        self._page_size = self.get_config(
+            "BLACKOUT_REGEX_PAGE_SIZE", default=1000, type=int
+        )
+        self._refresh_interval = self.get_config(
+            "BLACKOUT_REGEX_REFRESH_INTERVAL", default=0, type=int
+        )
+        self._notifications = self.get_config(
+            "BLACKOUT_REGEX_NOTIFICATIONS", default=None
+        )
+        if self._notifications == "database":
+            self._notifications = self.get_config("DATABASE_URL", default=None)
+        self._channel = self.get_config(
+            "BLACKOUT_REGEX_NOTIFICATIONS_CHANNEL", default="blackouts"
+        )
+        self._planner = None
+        adaptive = self.get_config("BLACKOUT_REGEX_ADAPTIVE", default=None)
+        if adaptive:
+            self._planner = Planner(
+                hot=(
+                    self.get_config("BLACKOUT_REGEX_ADAPTIVE_HOT", default=10, type=int)
+                    if adaptive == "hot"
+                    else 0
+                ),
+                interval=self.get_config(
+                    "BLACKOUT_REGEX_ADAPTIVE_INTERVAL", default=60, type=int
+                ),
+                sample=self.get_config(
+                    "BLACKOUT_REGEX_ADAPTIVE_SAMPLE", default=100, type=int
+                ),
+            )
+        self._explain = self.get_config(
+            "BLACKOUT_REGEX_EXPLAIN", default=False, type=bool
+        )
+        self._metrics = None
+        sink = self.get_config("BLACKOUT_REGEX_METRICS", default=None)
+        if sink:
+            try:
+                sink = _load_sink(sink)
+            except Exception:
+                log.error(
+                    "Unable to load the BLACKOUT_REGEX_METRICS sink %s, "
+                    "running without metrics",
+                    sink,
+                    exc_info=True,
+                )
+                sink = None
+        if sink:
+            self._metrics = Metrics(
+                sink=sink,
+                interval=self.get_config(
+                    "BLACKOUT_REGEX_METRICS_INTERVAL", default=60, type=int
+                ),
+                sample=self.get_config(
+                    "BLACKOUT_REGEX_METRICS_SAMPLE", default=100, type=int
+                ),
+            )
+        self._profiler = None
+        sample = self.get_config("BLACKOUT_REGEX_PROFILE", default=0, type=int)
+        if sample > 0:
+            self._profiler = Profiler(
+                self.get_config(
+                    "BLACKOUT_REGEX_PROFILE_PATH",
+                    default=os.path.join(
+                        tempfile.gettempdir(), "blackout-regex-{pid}.collapsed"
+                    ),
+                ),
+                sample=sample,
+                interval=self.get_config(
+                    "BLACKOUT_REGEX_PROFILE_INTERVAL", default=60, type=int
+                ),
+                cprofile=self.get_config(
+                    "BLACKOUT_REGEX_PROFILE_CPROFILE", default=False, type=bool
+                ),
+            )
+        self._audit = None
+        writer = self.get_config("BLACKOUT_REGEX_AUDIT", default=None)
+        if writer:
+            try:
+                writer = _load_writer(writer)
+            except Exception:
+                log.error(
+                    "Unable to load the BLACKOUT_REGEX_AUDIT writer %s, "
+                    "running without audit log",
+                    writer,
+                    exc_info=True,
+                )
+                writer = None
+        if writer:
+            self._audit = AuditLog(
+                writer,
+                size=self.get_config(
+                    "BLACKOUT_REGEX_AUDIT_QUEUE_SIZE", default=10000, type=int
+                ),
+                batch=self.get_config(
+                    "BLACKOUT_REGEX_AUDIT_BATCH_SIZE", default=100, type=int
+                ),
+                interval=self.get_config(
+                    "BLACKOUT_REGEX_AUDIT_INTERVAL", default=1, type=float
+                ),
+            )
+
+    def _load_blackouts(self):
+        """
+        Retrieve from the DB the Blackouts active, or pending, page by page.
+        When ``BLACKOUT_REGEX_INCLUDE_LITERAL`` is disabled, the Blackouts
+        without any regular expression are left to the native blackout plugin.
+        """
+        # use the alerta blackout model to retrieve the blackouts.
+        # The model standardizes the data returned from mongodb and postgres db.
+        query = _blackout_query(status=LOADED_STATUSES, **{"sort-by": LOADED_ORDER})
+        include_literal = self.get_config(
+            "BLACKOUT_REGEX_INCLUDE_LITERAL", default=True, type=bool
+        )
+        blackouts = []
+        seen = set()
+        retrieved = 0
+        page = 1
+        while True:
+            chunk = Blackout.find_all(query=query, page=page, page_size=self._page_size)
+            retrieved += len(chunk)
+            for blackout in chunk:
+                # The pages may overlap, see ``LOADED_ORDER``.
+                if blackout.id in seen:
+                    continue
+                seen.add(blackout.id)
+                # The query may not be supported by the backend.
+                if blackout.status in LOADED_STATUSES and (
+                    include_literal or _has_regex(blackout)
+                ):
+                    blackouts.append(blackout)
+            if len(chunk) < self._page_size:
+                break
+            page += 1
+        log.debug(
+            "Retrieved %d Blackouts from the DB, %d to be evaluated",
+            retrieved,
+            len(blackouts),
+        )
         return blackouts
 
+    def _probe_blackouts(self):
+        """
+        Cheap signature of the Blackouts set: the number of Blackouts active or
+        pending, and the most recently created one. Changes not reflected in
+        the signature (e.g., updating an existing Blackout) are picked up once
+        the cached list reaches ``BLACKOUT_REGEX_CACHE_MAX_AGE``.
+        """
+        count = Blackout.count(query=_blackout_query(status=LOADED_STATUSES))
+        newest = Blackout.find_all(
+            query=_blackout_query(status=LOADED_STATUSES, **{"sort-by": "createTime"}),
+            page=1,
+            page_size=1,
+        )
+        if not newest:
+            return (count, None, None)
+        return (count, newest[0].id, getattr(newest[0], "create_time", None))
+
+    def _load_rules(self):
+        started = time.perf_counter()
+        if self._snapshot:
+            blackouts = self._snapshot.load()
+        else:
+            blackouts = self._load_blackouts()
+        loaded = time.perf_counter()
+        rules = RuleSet(
+            blackouts,
+            reported=self._invalid,
+            engine=self._engine,
+            unsafe=self._unsafe,
+            budget=self._budget,
+            slow=self._slow,
+            previous=self._cache.value,
+        )
+        if self._planner is not None:
+            self._planner.apply(rules)
+        if rules.unprobed:
+            # Even the first load, on the alerts path, doesn't wait for them.
+            self._prober = threading.Thread(
+                target=rules.probe,
+                args=(self._python,),
+                name="blackout-regex-probe",
+                daemon=True,
+            )
+            self._prober.start()
+        patterns = rules.patterns
+        log.debug(
+            "Compiled %d Blackouts, %d unchanged, %d patterns, %d distinct "
+            "(%.1f rules per pattern)",
+            rules.compiled,
+            len(rules) - rules.compiled,
+            patterns.references,
+            len(patterns),
+            patterns.ratio,
+        )
+        if self._metrics is not None:
+            self._metrics.observe("fetch", loaded - started)
+            self._metrics.observe("compile", time.perf_counter() - loaded)
+            self._metrics.inc("compiled", rules.compiled)
+            self._metrics.gauge("patterns", patterns.references)
+            self._metrics.gauge("patterns.distinct", len(patterns))
+        return rules
+
+    def _find_blackout(self, blackout_id):
+        return Blackout.find_by_id(blackout_id)
+
+    def _evaluate(self, alert):
+        """
+        Evaluate the alert. The status of the Blackout an alert has been tagged
+        with is looked up by ID, without loading all the Blackouts.
+        """
+        blackout_id = _tagged_blackout(alert)
+        if blackout_id is None:
+            rules = self._fetch_rules()
+            decision = evaluate(rules, alert, self._match_cache)
+            if self._planner is not None:
+                self._planner.record(rules, alert, decision)
+            return decision
+        try:
+            status = self._statuses.status(blackout_id)
+        except Exception:
+            log.warning(
+                "Unable to look up the Blackout %s, using the cached Blackouts",
+                blackout_id,
+                exc_info=True,
+            )
+            status = self._fetch_rules().status(blackout_id)
+        if status == "active":
+            return Decision(ACTIVE, blackout_id)
+        return Decision(RELEASED, blackout_id)
+
+    def _changed(self, since):
+        """
+        Reload the Blackouts when notified of a change.
+        """
+        self._statuses.clear()
+        if self._snapshot:
+            self._snapshot.sync(since=since)
+            self._cache.refresh()
+        else:
+            self._cache.refresh(force=True)
+
+    def _listen(self):
+        try:
+            source = notification_source(self._notifications, channel=self._channel)
+        except ValueError:
+            log.error(
+                "Invalid BLACKOUT_REGEX_NOTIFICATIONS, polling the Blackouts",
+                exc_info=True,
+            )
+            self._notifications = None
+            return
+        self._cache.listen(source, on_change=self._changed)
+
+    def _fetch_rules(self):
+        # Started lazily, from the worker process and the application context
+        # evaluating the alerts.
+        if self._refresh_interval > 0 and self._cache.refresher is None:
+            self._cache.start(self._refresh_interval)
+        if self._notifications and self._cache.listener is None:
+            self._listen()
+        return self._cache.get()
+
     def _apply_blackout(self, alert):
         """
         The regex blackouts are evaluated in the ``post_receive`` in order to
@@ -51,177 +3477,151 @@ class BlackoutRegex(PluginBase):
             # perhaps something else too?) - for whatever reason.
             return alert
 
+        # Checked once per alert, rather than for every log line.
+        debug = log.isEnabledFor(logging.DEBUG)
+
         if alert.status == "closed":
-            log.debug("Alert %s status is closed, ignoring", alert.id)
+            if debug:
+                log.debug("Alert %s status is closed, ignoring", alert.id)
             return alert
 
-        blackouts = self._fetch_blackouts()
+        metrics = self._metrics
+        if metrics is None:
+            decision = self._evaluate(alert)
+        else:
+            decision = self._evaluate_measured(alert, metrics)
+
+        if self._explain and decision.action in (MATCHED, UNMATCHED):
+            explain_log.info(
+                "%s",
+                json.dumps(
+                    explain(self._fetch_rules(), alert, decision),
+                    sort_keys=True,
+                    default=str,
+                ),
+            )
 
         NOTIFICATION_BLACKOUT = self.get_config(
             "NOTIFICATION_BLACKOUT", default=False, type=bool
         )
 
-        alert_tags = parse_tags(alert.tags)
-
         # When an alert matches a blackout, this plugin adds a special tag
         # ``regex_blackout`` that points to the blackout ID matched.
         # This facilitates the blackout matching, by simply checking if the
         # blackout is still open.
-        if "regex_blackout" in alert_tags:
-            log.debug(
-                "Checking blackout %s which used to match this alert",
-                alert_tags["regex_blackout"],
-            )
-            for blackout in blackouts:
-                if blackout.id == alert_tags["regex_blackout"]:
-                    if blackout.status == "active":
-                        log.debug(
-                            "Blackout %s is still active, setting alert %s "
-                            "status as blackout",
-                            blackout.id,
-                            alert.id,
-                        )
-                        if alert.status != "blackout":
-                            alert.status = "blackout"
-                        return alert
+        audit = self._audit
+
+        if decision.action == ACTIVE:
+            if audit is not None:
+                audit.record(alert, decision.blackout_id, "active")
+            if debug:
+                log.debug(
+                    "Blackout %s is still active, setting alert %s status as "
+                    "blackout",
+                    decision.blackout_id,
+                    alert.id,
+                )
+            if alert.status != "blackout":
+                alert.status = "blackout"
+            return alert
+
+        if decision.action == RELEASED:
             # If the blackout is no longer active, simply return
             # the alert as-is, without changing the status, but
             # removing the regex_blackout tag, so when the alert is
             # fired again, we'll know that it does no longer match
             # an active blackout.
-            log.debug(
-                "Blackout %s does no longer exist, or is not active, removing "
-                "tag and leaving status unchanged",
-                alert_tags["regex_blackout"],
-            )
+            if debug:
+                log.debug(
+                    "Blackout %s does no longer exist, or is not active, removing "
+                    "tag and leaving status unchanged",
+                    decision.blackout_id,
+                )
             alert.tags = [tag for tag in alert.tags if "regex_blackout=" not in tag]
             return alert
 
-        # No previous regex blackout match, let's evaluate.
-        # The idea is that if a blackout has a number of attributes configured,
-        # in order to match, the alert must match all of these attributes.
-        for blackout in blackouts:
-            # The general assumption is that a blackout has at least one of
-            # these attributes set, therefore once we try to match only when an
-            # attribute is configured, and skip to the next blackout when the
-            # matching fails.
-            log.debug("Evaluating blackout")
-            log.debug(blackout)
-            match = False
-            if blackout.environment:
-                if not re.search(blackout.environment, alert.environment):
-                    log.debug(
-                        "%s doesn't match the blackout environment %s",
-                        alert.environment,
-                        blackout.environment,
-                    )
-                    continue
-                match = True
-                log.debug(
-                    "%s matched %s",
-                    blackout.environment,
-                    alert.environment,
-                )
-            if blackout.customer:
-                if not re.search(blackout.customer, alert.customer):
-                    log.debug(
-                        "%s doesn't match the blackout customer %s",
-                        alert.customer,
-                        blackout.customer,
-                    )
-                    continue
-                match = True
-                log.debug(
-                    "%s matched %s",
-                    blackout.customer,
-                    alert.customer,
-                )
-            if blackout.group:
-                if not re.search(blackout.group, alert.group):
-                    log.debug(
-                        "%s doesn't match the blackout group %s",
-                        alert.group,
-                        blackout.group,
-                    )
-                    continue
-                match = True
-                log.debug("%s matched %s", blackout.group, alert.group)
-            if blackout.event:
-                if not re.search(blackout.event, alert.event):
-                    log.debug(
-                        "%s doesn't match the blackout event %s",
-                        alert.event,
-                        blackout.event,
-                    )
-                    continue
-                match = True
-                log.debug("%s matched %s", blackout.event, alert.event)
-            if blackout.resource:
-                if not re.search(blackout.resource, alert.resource):
-                    log.debug(
-                        "%s doesn't match the blackout resource %s",
-                        alert.resource,
-                        blackout.resource,
-                    )
-                    continue
-                match = True
-                log.debug("%s matched %s", blackout.resource, alert.resource)
-            if blackout.service and alert.service:
-                if len(blackout.service) != len(alert.service):
-                    continue
-                if not all(
-                    [
-                        re.search(blackout.service[index], alert.service[index])
-                        for index in range(len(alert.service))
-                    ]
-                ):
+        if decision.action == MATCHED:
+            if not NOTIFICATION_BLACKOUT:
+                if metrics is not None:
+                    metrics.inc("suppressed")
+                if audit is not None:
+                    audit.record(alert, decision.blackout_id, "suppressed")
+                if debug:
                     log.debug(
-                        "%s don't seem to match the blackout service(s) %s",
-                        str(alert.service),
-                        str(blackout.service),
+                        "Suppressed alert during blackout period (id=%s)", alert.id
                     )
-                    continue
-                match = True
-                log.debug("%s matched %s", blackout.service[0], alert.service[0])
-            if blackout.tags and alert.tags:
-                blackout_tags = parse_tags(blackout.tags)
-                if not set(blackout_tags.keys()).issubset(set(alert_tags.keys())):
-                    # The blackout must have at least as many tags as the alert
-                    # in order to match.
-                    continue
-                if not all(
-                    [
-                        re.search(blackout_tags[blackout_tag], alert_tags[blackout_tag])
-                        for blackout_tag in blackout_tags
-                        if blackout_tag in alert_tags
-                    ]
-                ):
-                    log.debug(
-                        "%s don't seem to match the blackout tag(s) %s",
-                        str(alert_tags),
-                        str(blackout_tags),
-                    )
-                    continue
-                match = True
-            if match:
-                if not NOTIFICATION_BLACKOUT:
-                    log.debug(
-                        f"Suppressed alert during blackout period (id={alert.id})"
-                    )
-                    raise BlackoutPeriod("Suppressed alert during blackout period")
+                raise BlackoutPeriod("Suppressed alert during blackout period")
+            if metrics is not None:
+                metrics.inc("tagged")
+            if audit is not None:
+                audit.record(alert, decision.blackout_id, "tagged")
+            if debug:
                 log.debug(
                     "Alert %s seems to match (regex) blackout %s. "
                     "Adding regex_blackout and status",
                     alert.id,
-                    blackout.id,
+                    decision.blackout_id,
                 )
-                alert.tags.extend(["regex_blackout={}".format(blackout.id)])
-                alert.status = "blackout"
-                return alert
+            alert.tags.extend(["regex_blackout={}".format(decision.blackout_id)])
+            alert.status = "blackout"
+            return alert
 
         return alert
 
+    def _evaluate_measured(self, alert, metrics):
+        """
+        Evaluate the alert, recording the metrics.
+        """
+        cache = self._match_cache
+        hits, misses = cache.hits, cache.misses
+        started = time.perf_counter()
+        decision = self._evaluate(alert)
+        metrics.observe("match", time.perf_counter() - started)
+        metrics.inc(decision.action)
+        metrics.inc("cache_hits", cache.hits - hits)
+        metrics.inc("cache_misses", cache.misses - misses)
+        if decision.action in (MATCHED, UNMATCHED) and metrics.sampled():
+            metrics.profile(self._fetch_rules(), alert, parse_tags(alert.tags))
+        metrics.maybe_flush()
+        return decision
+
+    def plan(self):
+        """
+        Return the current evaluation plan, or ``None`` when disabled.
+        """
+        if self._planner is None:
+            return None
+        return self._planner.plan
+
+    def metrics(self):
+        """
+        Return the metrics recorded, or ``None`` when disabled.
+        """
+        if self._metrics is None:
+            return None
+        return self._metrics.snapshot()
+
+    def audit(self):
+        """
+        Return the audit report, see :meth:`AuditLog.report`, or ``None``
+        when disabled.
+        """
+        if self._audit is None:
+            return None
+        return self._audit.report()
+
+    def evaluate_many(self, alerts):
+        """
+        Evaluate a batch of alerts against the Blackouts, returning the list of
+        :class:`Decision`, one for each alert, in the same order. The alerts
+        are neither changed, nor suppressed.
+        """
+        rules = self._fetch_rules()
+        return [evaluate(rules, alert, self._match_cache) for alert in alerts]
+
     def pre_receive(self, alert):
+        if self._profiler is not None:
+            return self._profiler.run(self, alert)
         return self._apply_blackout(alert)
 
     def post_receive(self, alert):
@@ -229,3 +3629,218 @@ class BlackoutRegex(PluginBase):
 
     def status_change(self, alert, status, text):
         return alert, status, text
+
+
+class ReplayAlert(object):
+    """
+    Alert read from a dump, holding only the fields the matching depends on.
+    """
+
+    __slots__ = ("id", "status", "service", "tags") + ATTRIBUTES
+
+    def __init__(self, **fields):
+        for field in self.__slots__:
+            setattr(self, field, fields.get(field))
+        self.status = self.status or "open"
+        self.service = self.service or []
+        self.tags = self.tags or []
+
+
+def _replay_blackout(fields, all_active=False):
+    fields = dict(fields)
+    if all_active:
+        fields.update(status="active", start_time=None, end_time=None)
+    else:
+        # As returned by the Alerta API.
+        fields.setdefault("start_time", fields.get("startTime"))
+        fields.setdefault("end_time", fields.get("endTime"))
+    return SnapshotBlackout(**fields)
+
+
+def read_json(path, chunk_size=65536):
+    """
+    Yield the objects from a JSON file: a list, NDJSON, or a response of the
+    Alerta API (e.g., ``{"alerts": [...]}``), ``-`` being the standard input.
+    The lists, and NDJSON, are read by chunks, and never loaded into memory at
+    once.
+    """
+    decoder = json.JSONDecoder()
+    opened = contextlib.nullcontext(sys.stdin) if path == "-" else open(path)
+    with opened as fd:
+        buffer = ""
+        eof = False
+        while True:
+            buffer = buffer.lstrip(" \t\r\n,[]")
+            try:
+                if not buffer:
+                    raise ValueError("Need more data")
+                value, end = decoder.raw_decode(buffer)
+            except ValueError:
+                if eof:
+                    if buffer:
+                        raise
+                    return
+                # Growing, so a large object isn't decoded again too often.
+                chunk = fd.read(max(chunk_size, len(buffer)))
+                eof = not chunk
+                buffer += chunk
+                continue
+            buffer = buffer[end:]
+            if isinstance(value, dict):
+                for key in ("alerts", "blackouts"):
+                    if isinstance(value.get(key), list):
+                        for item in value[key]:
+                            yield item
+                        break
+                else:
+                    yield value
+            else:
+                yield value
+
+
+_replay_rules = None
+
+
+def _replay_init(blackouts, engine, at):
+    global _replay_rules
+    _replay_rules = (
+        RuleSet(blackouts, engine=engine, clock=(lambda: at) if at else _utcnow),
+        MatchCache(),
+    )
+
+
+def _replay_batch(alerts):
+    rules, cache = _replay_rules
+    return [
+        (alert.get("id"), evaluate(rules, ReplayAlert(**alert), cache))
+        for alert in alerts
+    ]
+
+
+def replay(blackouts, alerts, engine="indexed", processes=0, at=None, batch=1000):
+    """
+    Evaluate the alerts, as dictionaries, against the Blackouts, yielding
+    ``(alert ID, Decision)`` for each alert, in the same order. The Blackouts
+    are evaluated as of ``at``, by default now. The alerts are streamed, in
+    batches, and evaluated in parallel by a pool of ``processes``, when set,
+    while at most twice as many batches as processes are in progress, so the
+    memory used doesn't depend on the number of alerts.
+    """
+    batches = iter(lambda: list(itertools.islice(alerts, batch)), [])
+    if not processes:
+        _replay_init(blackouts, engine, at)
+        for chunk in batches:
+            for result in _replay_batch(chunk):
+                yield result
+        return
+    with multiprocessing.Pool(
+        processes, initializer=_replay_init, initargs=(blackouts, engine, at)
+    ) as pool:
+        pending = collections.deque()
+        for chunk in batches:
+            pending.append(pool.apply_async(_replay_batch, (chunk,)))
+            if len(pending) >= 2 * processes:
+                for result in pending.popleft().get():
+                    yield result
+        while pending:
+            for result in pending.popleft().get():
+                yield result
+
+
+def main(argv=None):
+    """
+    Entry point of the ``blackout-regex`` command: evaluate the alerts against
+    the Blackouts, from JSON, or NDJSON, dumps, offline.
+    """
+    parser = argparse.ArgumentParser(
+        prog="blackout-regex",
+        description="Evaluate alerts against the regex Blackouts, offline.",
+    )
+    parser.add_argument(
+        "--blackouts", required=True, help="JSON, or NDJSON, file of Blackouts."
+    )
+    parser.add_argument(
+        "--alerts",
+        default="-",
+        help="JSON, or NDJSON, file of alerts. Default: the standard input.",
+    )
+    parser.add_argument(
+        "--output",
+        default="-",
+        help="NDJSON file where the decision for each alert is written. "
+        "Default: the standard output.",
+    )
+    parser.add_argument(
+        "--counts",
+        help="JSON file where the number of alerts matched by each Blackout "
+        "is written. Default: the standard error.",
+    )
+    parser.add_argument("--engine", choices=sorted(MATCHERS), default="indexed")
+    parser.add_argument(
+        "--processes",
+        type=int,
+        default=0,
+        help="Evaluate the alerts in parallel, with this many processes.",
+    )
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument(
+        "--at",
+        type=_naive_utc,
+        help="Evaluate the Blackouts time window as of this ISO 8601 time. "
+        "Default: now.",
+    )
+    parser.add_argument(
+        "--all-active",
+        action="store_true",
+        help="Consider all the Blackouts active, regardless of their status.",
+    )
+    args = parser.parse_args(argv)
+    blackouts = [
+        _replay_blackout(blackout, all_active=args.all_active)
+        for blackout in read_json(args.blackouts)
+    ]
+    actions = collections.Counter()
+    hits = collections.Counter({blackout.id: 0 for blackout in blackouts})
+    decisions = replay(
+        blackouts,
+        read_json(args.alerts),
+        engine=args.engine,
+        processes=args.processes,
+        at=args.at,
+        batch=args.batch_size,
+    )
+    opened = (
+        contextlib.nullcontext(sys.stdout)
+        if args.output == "-"
+        else open(args.output, "w")
+    )
+    with opened as fd:
+        for alert_id, decision in decisions:
+            actions[decision.action] += 1
+            if decision.action in (MATCHED, ACTIVE):
+                hits[decision.blackout_id] += 1
+            fd.write(
+                json.dumps(
+                    {
+                        "alert": alert_id,
+                        "action": decision.action,
+                        "blackout": decision.blackout_id,
+                    }
+                )
+                + "\n"
+            )
+    counts = {
+        "alerts": sum(actions.values()),
+        "actions": dict(actions),
+        "blackouts": dict(hits),
+    }
+    if args.counts:
+        with open(args.counts, "w") as fd:
+            json.dump(counts, fd, indent=2, sort_keys=True)
+    else:
+        json.dump(counts, sys.stderr, indent=2, sort_keys=True)
+        sys.stderr.write("\n")
+
+
+if __name__ == "__main__":
+    main()
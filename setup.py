@@ -12,7 +12,7 @@ with codecs.open("README.rst", "r", encoding="utf8") as file:
 
 setup(
     name="alerta-blackout-regex",
-    version="3.1.0",
+    version="3.2.0",
     author="Mircea Ulinic",
     author_email="ping@mirceaulinic.net",
     py_modules=["blackout_regex"],
@@ -22,5 +22,8 @@ setup(
     zip_safe=True,
     url="https://github.com/mirceaulinic/alerta-blackout-regex",
     license="Apache License 2.0",
-    entry_points={"alerta.plugins": ["blackout_regex = blackout_regex:BlackoutRegex"]},
+    entry_points={
+        "alerta.plugins": ["blackout_regex = blackout_regex:BlackoutRegex"],
+        "console_scripts": ["blackout-regex = blackout_regex:main"],
+    },
 )
@@ -1,9 +1,24 @@
 # -*- coding: utf-8 -*-
+import os
+import re
 import sys
+import json
+import time
+import fcntl
+import pstats
+import random
+import shutil
+import socket
 import logging
+import weakref
+import datetime
+import tempfile
+import threading
 import unittest
+import collections
+import multiprocessing
 
-from mock import MagicMock
+from mock import MagicMock, patch
 
 blackout_exceptions = sys.modules["alerta.exceptions"] = MagicMock()
 blackout_exceptions.BlackoutPeriod = MagicMock
@@ -73,7 +88,7 @@ BLACKOUTS = [
         "id": "5",
     },
     {
-        "status": "closed",
+        "status": "active",
         "environment": r"(rgx|env)",
         "customer": None,
         "tags": [],
@@ -82,7 +97,6 @@ BLACKOUTS = [
         "event": "FPCDown",
         "group": None,
         "duration": 3600,
-        "endTime": "1985-03-05T22:45:27.425Z",
         "id": "6",
     },
     {
@@ -131,12 +145,21 @@ class Model:
 
 
 class Blackout(Model):
-    def find_all(page=1, page_size=0):
-        return [Blackout(**blackout) for blackout in BLACKOUTS]
+    def find_all(query=None, page=1, page_size=1000):
+        return [
+            Blackout(**blackout)
+            for blackout in BLACKOUTS[(page - 1) * page_size : page * page_size]
+        ]
 
-    def count():
+    def count(query=None):
         return len(BLACKOUTS)
 
+    def find_by_id(id, customers=None):
+        for blackout in BLACKOUTS:
+            if blackout["id"] == id:
+                return Blackout(**blackout)
+        return None
+
 
 class Alert(Model):
     def tag(self, tags):
@@ -153,15 +176,152 @@ class Alert(Model):
 
 blackout_mock.Blackout = Blackout
 
+CONFIG = {"NOTIFICATION_BLACKOUT": True}
+
+
+class PluginBase:
+    def __init__(self, name=None):
+        self.name = name
+
+    @staticmethod
+    def get_config(key, default=None, type=None, **kwargs):
+        return CONFIG.get(key, default)
+
+
 plugins_mod = sys.modules["alerta.plugins"] = MagicMock()
-plugins_mod.PluginBase = MagicMock
+plugins_mod.PluginBase = PluginBase
 
 
-from blackout_regex import BlackoutRegex  # pylama: ignore=E402
+from blackout_regex import (  # pylama: ignore=E402
+    ACTIVE,
+    IGNORED,
+    MATCHED,
+    RELEASED,
+    UNMATCHED,
+    AlertaSink,
+    AuditLog,
+    BlackoutCache,
+    BlackoutRegex,
+    MATCHERS,
+    IndexedMatcher,
+    MatchCache,
+    Planner,
+    RuleSet,
+    SetMatcher,
+    SharedSnapshot,
+    StatusCache,
+    SocketNotifications,
+    PostgresNotifications,
+    _backtracking,
+    _blackout_query,
+    _classify,
+    _hs_expression,
+    _python,
+    _too_slow,
+    hyperscan,
+    evaluate,
+    main,
+    match_alerts,
+    notification_source,
+    parse_tags,
+    read_json,
+)
 
 log = logging.getLogger(__name__)
 
 
+def with_blackouts(*blackouts):
+    """
+    Replace the Blackouts retrieved from the (mocked) DB.
+    """
+    return patch.object(sys.modules[__name__], "BLACKOUTS", list(blackouts))
+
+
+# The Blackout sort keys of the Alerta query builder.
+BLACKOUT_SORT_KEYS = (
+    "priority",
+    "environment",
+    "service",
+    "resource",
+    "event",
+    "group",
+    "tags",
+    "customer",
+    "startTime",
+    "endTime",
+    "duration",
+    "status",
+    "remaining",
+    "user",
+    "createTime",
+    "text",
+)
+
+
+class MultiDict(dict):
+    """
+    The request arguments, as ``{name: [values]}``.
+    """
+
+    def __init__(self, params):
+        super().__init__(
+            (name, value if isinstance(value, list) else [value])
+            for name, value in params.items()
+        )
+
+
+def query_builder_modules():
+    """
+    Return the modules of the Alerta query builder, rejecting the sort keys
+    Alerta doesn't support, as the Postgres and MongoDB backends do.
+    """
+
+    def from_params(params):
+        for key in params.get("sort-by", []):
+            if key.lstrip("-") not in BLACKOUT_SORT_KEYS:
+                raise ValueError("Sorting by '{}' field not supported.".format(key))
+        return params
+
+    app = MagicMock()
+    app.qb.blackouts.from_params = from_params
+    datastructures = MagicMock()
+    datastructures.MultiDict = MultiDict
+    return {"alerta.app": app, "werkzeug.datastructures": datastructures}
+
+
+def make_blackout(id, **attrs):
+    blackout = {
+        "status": "active",
+        "environment": None,
+        "customer": None,
+        "tags": [],
+        "service": [],
+        "resource": None,
+        "event": None,
+        "group": None,
+        "duration": 3600,
+        "id": id,
+    }
+    blackout.update(attrs)
+    return blackout
+
+
+def make_alert(**attrs):
+    alert = {
+        "id": "alert",
+        "environment": "test",
+        "customer": None,
+        "resource": "test::resource",
+        "event": "test-event",
+        "group": "test",
+        "service": ["test-service"],
+        "tags": [],
+        "status": "open",
+    }
+    alert.update(attrs)
+    return Alert(**alert)
+
+
 class TestEnhance(unittest.TestCase):
     def test_new_alert_no_match(self):
         """
@@ -362,3 +522,1693 @@ class TestEnhance(unittest.TestCase):
         test = test_obj.pre_receive(alert)
         self.assertEqual(test.status, "open")
         self.assertEqual(test.tags, ["site=siteX"])
+
+
+class TestRules(unittest.TestCase):
+    def test_compiled_once(self):
+        """
+        Test the Blackouts are compiled once and reused for the next alerts.
+        """
+        test_obj = BlackoutRegex()
+        test_obj.pre_receive(make_alert())
+        rules = test_obj._fetch_rules()
+        test_obj.pre_receive(make_alert(resource="test1"))
+        self.assertIs(test_obj._fetch_rules(), rules)
+        self.assertEqual(len(rules), len(BLACKOUTS) - 1)
+
+    def test_invalid_regex(self):
+        """
+        Test a Blackout with an invalid regular expression is reported once and
+        ignored, while the other Blackouts are still evaluated.
+        """
+        with with_blackouts(
+            make_blackout("bad", environment="test", resource="test(\\d"),
+            make_blackout("good", environment="test", resource=r"test\d"),
+        ):
+            test_obj = BlackoutRegex()
+            with self.assertLogs("alerta.plugins.blackout_regex", "ERROR") as logs:
+                test = test_obj.pre_receive(make_alert(resource="test1"))
+                test_obj._cache.refresh(force=True)
+        self.assertEqual(len(logs.output), 1)
+        self.assertIn("bad", logs.output[0])
+        self.assertEqual(test_obj._fetch_rules().invalid, ["bad"])
+        self.assertEqual(test.tags, ["regex_blackout=good"])
+
+    def test_missing_attribute(self):
+        """
+        Test an alert without customer doesn't match a Blackout on customer.
+        """
+        with with_blackouts(make_blackout("1", environment="test", customer="^acme")):
+            test = BlackoutRegex().pre_receive(make_alert(customer=None))
+        self.assertEqual(test.status, "open")
+
+    def test_expired_blackout(self):
+        """
+        Test an expired Blackout doesn't match new alerts.
+        """
+        with with_blackouts(
+            make_blackout("1", environment="test", resource=r"test\d", status="expired")
+        ):
+            test = BlackoutRegex().pre_receive(make_alert(resource="test1"))
+        self.assertEqual(test.status, "open")
+
+    def test_pending_blackout(self):
+        """
+        Test a pending Blackout is loaded, but doesn't match new alerts.
+        """
+        with with_blackouts(
+            make_blackout("1", environment="test", resource=r"test\d", status="pending")
+        ):
+            test_obj = BlackoutRegex()
+            test = test_obj.pre_receive(make_alert(resource="test1"))
+        self.assertEqual(test.status, "open")
+        self.assertEqual(test_obj._fetch_rules().get("1").status, "pending")
+
+    def test_literal_blackout(self):
+        """
+        Test the Blackouts without regular expressions are searched for as
+        substrings, unless left to the native blackout plugin.
+        """
+        with with_blackouts(make_blackout("1", environment="test", resource="web")):
+            test = BlackoutRegex().pre_receive(make_alert(resource="web01"))
+            self.assertEqual(test.tags, ["regex_blackout=1"])
+            with patch.dict(CONFIG, {"BLACKOUT_REGEX_INCLUDE_LITERAL": False}):
+                test = BlackoutRegex().pre_receive(make_alert(resource="web01"))
+            self.assertEqual(test.status, "open")
+
+    def test_paging(self):
+        """
+        Test the Blackouts are retrieved page by page.
+        """
+        with patch.dict(CONFIG, {"BLACKOUT_REGEX_PAGE_SIZE": 3}):
+            test_obj = BlackoutRegex()
+        with patch.object(Blackout, "find_all", wraps=Blackout.find_all) as find_all:
+            rules = test_obj._load_rules()
+        self.assertEqual(find_all.call_count, 3)
+        self.assertEqual(sorted(rules.by_id), ["1", "2", "3", "4", "6", "7", "8"])
+
+    def test_paging_order(self):
+        """
+        Test the Blackouts are retrieved by creation time, with a query the
+        Alerta query builder supports, and the overlapping pages are not
+        retrieved twice.
+        """
+        created = {blackout["id"]: index for index, blackout in enumerate(BLACKOUTS)}
+        calls = []
+
+        def find_all(query=None, page=1, page_size=1000):
+            calls.append(query)
+            self.assertIsNotNone(query)
+            blackouts = list(BLACKOUTS)
+            random.Random(len(calls)).shuffle(blackouts)
+            if query["sort-by"] == ["-createTime"]:
+                blackouts.sort(key=lambda blackout: created[blackout["id"]])
+            # The pages overlap, e.g., when a Blackout is created at the same
+            # time as the last one of the previous page.
+            start = max((page - 1) * page_size - 1, 0)
+            return [
+                Blackout(**blackout) for blackout in blackouts[start : page * page_size]
+            ]
+
+        with patch.dict(CONFIG, {"BLACKOUT_REGEX_PAGE_SIZE": 3}):
+            test_obj = BlackoutRegex()
+        with with_blackouts(*BLACKOUTS), patch.dict(
+            sys.modules, query_builder_modules()
+        ), patch.object(Blackout, "find_all", find_all):
+            first = [rule.id for rule in test_obj._load_rules().rules]
+            second = [rule.id for rule in test_obj._load_rules().rules]
+        self.assertEqual(first, ["1", "2", "3", "4", "6", "7", "8"])
+        self.assertEqual(second, first)
+        self.assertEqual(calls[0]["status"], ["active", "pending"])
+
+    def test_unsupported_query(self):
+        """
+        Test a query the Alerta query builder rejects is logged as a warning.
+        """
+        with patch.dict(sys.modules, query_builder_modules()), self.assertLogs(
+            "alerta.plugins.blackout_regex", "WARNING"
+        ):
+            self.assertIsNone(_blackout_query(**{"sort-by": ["createTime", "id"]}))
+
+    def test_incremental(self):
+        """
+        Test only the Blackouts added, or changed, are compiled again when the
+        Blackouts are reloaded.
+        """
+        blackouts = [
+            make_blackout("1", environment="test", resource=r"^test\d"),
+            make_blackout("2", environment="test", resource=r"^edge\d"),
+            make_blackout("3", environment="test", resource=r"^core\d"),
+        ]
+        with with_blackouts(*blackouts):
+            test_obj = BlackoutRegex()
+            rules = test_obj._fetch_rules()
+        self.assertEqual(rules.compiled, 3)
+        blackouts[1] = make_blackout("2", environment="test", resource=r"^agg\d")
+        blackouts.append(make_blackout("4", environment="test", resource=r"^fw\d"))
+        with with_blackouts(*blackouts[1:]):
+            test_obj._cache.refresh(force=True)
+            reloaded = test_obj._fetch_rules()
+            test = test_obj.pre_receive(make_alert(resource="fw1"))
+        self.assertEqual(reloaded.compiled, 2)
+        self.assertEqual(sorted(reloaded.by_id), ["2", "3", "4"])
+        self.assertIs(reloaded.get("3"), rules.get("3"))
+        self.assertIsNot(reloaded.get("2"), rules.get("2"))
+        self.assertEqual(reloaded.get("2").signature(), ("test", r"^agg\d"))
+        self.assertEqual(test.tags, ["regex_blackout=4"])
+
+
+class TestCostGuard(unittest.TestCase):
+    def test_backtracking(self):
+        """
+        Test the patterns prone to catastrophic backtracking are detected.
+        """
+        for pattern in [r"(a+)+$", r"(.*a)+", r"(\d+\s?)+$", r"^(x|y+)*z", r"(a*)*"]:
+            self.assertEqual(
+                _backtracking(re.compile(pattern)), "nested quantifiers", pattern
+            )
+        for pattern in [r"(a|a)*$", r"(a|aa)+$", r"(.|\s)*$", r"(a|b|ab)*$"]:
+            self.assertEqual(
+                _backtracking(re.compile(pattern)), "overlapping alternation", pattern
+            )
+        for pattern in [
+            r"^edge-\d+",
+            r"(\w+\.)+com",
+            r"(ab+)+",
+            r"(a+){2}",
+            ".*",
+            r"(ab|a)*c",
+            r"(foo|bar)+",
+            r"(\d|[a-f])+$",
+            r"(x|\w)+$",
+        ]:
+            self.assertIsNone(_backtracking(re.compile(pattern)), pattern)
+
+    def test_unsafe_disabled(self):
+        """
+        Test a Blackout prone to catastrophic backtracking is reported once
+        and ignored, unless allowed, or compiled with re2.
+        """
+        with with_blackouts(make_blackout("1", environment="test", resource="(t+)+")):
+            test_obj = BlackoutRegex()
+            with self.assertLogs("alerta.plugins.blackout_regex", "ERROR") as logs:
+                test = test_obj.pre_receive(make_alert(resource="ttt"))
+                test_obj._cache.refresh(force=True)
+            self.assertEqual(len(logs.output), 1)
+            self.assertIn("nested quantifiers", logs.output[0])
+            self.assertEqual(test.status, "open")
+            self.assertIn("1", test_obj._fetch_rules().disabled)
+            with patch.dict(CONFIG, {"BLACKOUT_REGEX_UNSAFE_PATTERNS": "allow"}):
+                test_obj = BlackoutRegex()
+            with patch("blackout_regex._PROBED", weakref.WeakKeyDictionary()):
+                # Disabled until probed, without delaying the alert.
+                test = test_obj.pre_receive(make_alert(resource="ttt"))
+                self.assertEqual(test.tags, [])
+                test_obj._prober.join()
+            test = test_obj.pre_receive(make_alert(resource="ttt"))
+            self.assertEqual(test.tags, ["regex_blackout=1"])
+            with patch("blackout_regex.re2", MagicMock(compile=re.compile)), patch(
+                "blackout_regex._PATTERNS", weakref.WeakValueDictionary()
+            ):
+                test = BlackoutRegex().pre_receive(make_alert(resource="ttt"))
+            self.assertEqual(test.tags, ["regex_blackout=1"])
+
+    def test_probe(self):
+        """
+        Test the Blackouts prone to catastrophic backtracking, when allowed,
+        are disabled when too slow to evaluate crafted values, without
+        stalling the worker.
+        """
+        blackouts = [
+            Blackout(**make_blackout("1", resource="(t+)+")),
+            Blackout(**make_blackout("2", resource="(t|t)*$")),
+        ]
+        alert = make_alert(resource="ttt")
+        rules = RuleSet(blackouts, unsafe="allow", budget=0.05)
+        self.assertEqual(rules.disabled, {"1": "not probed yet", "2": "not probed yet"})
+        self.assertIsNone(rules.match(alert, {}))
+        generation = rules.generation
+        started = time.monotonic()
+        with self.assertLogs("alerta.plugins.blackout_regex", "ERROR") as logs:
+            rules.probe()
+        self.assertLess(time.monotonic() - started, 10)
+        self.assertEqual(rules.disabled, {"2": "too slow"})
+        self.assertEqual(len(logs.output), 1)
+        self.assertIn("overlapping alternation", logs.output[0])
+        self.assertNotEqual(rules.generation, generation)
+        self.assertIs(rules.match(alert, {}), rules.get("1"))
+        # Probed once.
+        rules = RuleSet(blackouts, unsafe="allow", budget=0.05)
+        self.assertEqual(rules.disabled, {"2": "too slow"})
+        self.assertEqual(rules.unprobed, [])
+
+    def test_probe_python(self):
+        """
+        Test the probes run Python, even when embedded, e.g., under uWSGI.
+        """
+        with patch("sys.executable", "/usr/local/bin/uwsgi"):
+            python = _python()
+        self.assertIsNotNone(python)
+        self.assertTrue(os.path.basename(python).startswith("python"))
+        pattern = re.compile("(u+)+")
+        with patch("blackout_regex._PROBED", weakref.WeakKeyDictionary()):
+            with self.assertLogs("alerta.plugins.blackout_regex", "WARNING"):
+                self.assertTrue(_too_slow(pattern, 0.05, python="/nonexistent"))
+        with patch("blackout_regex._PROBED", weakref.WeakKeyDictionary()):
+            self.assertFalse(_too_slow(pattern, 0.05, python=python))
+
+    def test_budget(self):
+        """
+        Test a Blackout slower to evaluate than the budget is disabled, until
+        its patterns change.
+        """
+        blackout = make_blackout("1", environment="test", resource=r"^test\d")
+        slow = {}
+        rules = RuleSet([Blackout(**blackout)], budget=1e-9, slow=slow)
+        alert = make_alert(resource="test1")
+        with self.assertLogs("alerta.plugins.blackout_regex", "ERROR"):
+            self.assertIs(rules.match(alert, {}), rules.get("1"))
+        self.assertIsNone(rules.match(alert, {}))
+        self.assertEqual(rules.disabled, {"1": "too slow"})
+        rules = RuleSet([Blackout(**blackout)], slow=slow)
+        self.assertIsNone(rules.match(alert, {}))
+        blackout["resource"] = r"^test"
+        rules = RuleSet([Blackout(**blackout)], slow=slow)
+        self.assertIs(rules.match(alert, {}), rules.get("1"))
+
+
+class TestExplain(unittest.TestCase):
+    def setUp(self):
+        logger = logging.getLogger("alerta.plugins.blackout_regex")
+        self.addCleanup(logger.setLevel, logger.level)
+        logger.setLevel(logging.INFO)
+
+    def test_no_debug(self):
+        """
+        Test nothing is logged at debug level when not enabled.
+        """
+        test_obj = BlackoutRegex()
+        test_obj._fetch_rules()
+        with patch("blackout_regex.log.debug") as debug:
+            test = test_obj.pre_receive(make_alert(resource="test1"))
+            test_obj.pre_receive(make_alert(resource="nomatch"))
+            test_obj.pre_receive(test)
+        self.assertEqual(test.tags, ["regex_blackout=1"])
+        debug.assert_not_called()
+
+    def test_explain(self):
+        """
+        Test a single trace is logged per alert, explaining why each Blackout
+        doesn't match.
+        """
+        with with_blackouts(
+            make_blackout("1", environment="test", resource=r"^edge\d"),
+            make_blackout("2", environment="^prod$", resource="core"),
+            make_blackout("3", environment="test", resource=r"^core\d"),
+            make_blackout("4", environment="test", resource="core"),
+        ), patch.dict(CONFIG, {"BLACKOUT_REGEX_EXPLAIN": True}):
+            test_obj = BlackoutRegex()
+            explain_log = "alerta.plugins.blackout_regex.explain"
+            with self.assertLogs(explain_log, "INFO") as logs:
+                test_obj.pre_receive(make_alert(resource="core1"))
+        self.assertEqual(len(logs.records), 1)
+        trace = json.loads(logs.records[0].getMessage())
+        self.assertEqual(trace["action"], "matched")
+        self.assertEqual(trace["blackout"], "3")
+        self.assertEqual(
+            trace["blackouts"],
+            [
+                {
+                    "blackout": "1",
+                    "matched": False,
+                    "attribute": "resource",
+                    "pattern": r"^edge\d",
+                    "value": "core1",
+                },
+                {
+                    "blackout": "2",
+                    "matched": False,
+                    "attribute": "environment",
+                    "pattern": "^prod$",
+                    "value": "test",
+                },
+                {"blackout": "3", "matched": True},
+            ],
+        )
+
+
+class TestSchedule(unittest.TestCase):
+    def setUp(self):
+        self.now = datetime.datetime(2026, 1, 1, 12, 0)
+        start = self.now + datetime.timedelta(minutes=10)
+        blackouts = [
+            make_blackout(
+                "pending",
+                environment="test",
+                resource=r"test\d",
+                status="pending",
+                start_time=start,
+                end_time=start + datetime.timedelta(hours=1),
+            ),
+            make_blackout(
+                "active",
+                environment="test",
+                resource=r"^core",
+                start_time=self.now - datetime.timedelta(hours=1),
+                end_time=self.now + datetime.timedelta(minutes=5),
+            ),
+        ]
+        self.rules = RuleSet(
+            [Blackout(**blackout) for blackout in blackouts], clock=lambda: self.now
+        )
+
+    def _match(self, resource):
+        rule = self.rules.match(make_alert(resource=resource), {})
+        return rule and rule.id
+
+    def test_activate_expire(self):
+        """
+        Test the Blackouts are activated, and expired, at the boundaries of
+        their time window, without reloading them.
+        """
+        self.assertEqual(self.rules.status("pending"), "pending")
+        self.assertEqual(self.rules.status("active"), "active")
+        self.assertIsNone(self._match("test1"))
+        self.assertEqual(self._match("core1"), "active")
+        generation = self.rules.generation
+        self.now += datetime.timedelta(minutes=5)
+        self.assertEqual(self.rules.status("active"), "expired")
+        self.assertIsNone(self._match("core1"))
+        self.assertNotEqual(self.rules.generation, generation)
+        self.now += datetime.timedelta(minutes=5)
+        self.assertEqual(self._match("test1"), "pending")
+        self.assertEqual(self.rules.status("pending"), "active")
+        self.now += datetime.timedelta(hours=1)
+        self.assertEqual(self.rules.status("pending"), "expired")
+        self.assertIsNone(self._match("test1"))
+        self.assertEqual(self.rules.schedule, [])
+
+    def test_released_on_expiry(self):
+        """
+        Test an alert matching a Blackout is released once the Blackout
+        reaches the end of its time window.
+        """
+        alert = make_alert(tags=["regex_blackout=active"])
+        self.assertEqual(evaluate(self.rules, alert).action, ACTIVE)
+        self.now += datetime.timedelta(minutes=5)
+        self.assertEqual(evaluate(self.rules, alert).action, RELEASED)
+
+    def test_match_cache(self):
+        """
+        Test the cached matching results are discarded when a Blackout is
+        activated.
+        """
+        cache = MatchCache()
+        alert = make_alert(resource="test1")
+        self.assertEqual(evaluate(self.rules, alert, cache).action, UNMATCHED)
+        self.now += datetime.timedelta(minutes=10)
+        self.assertEqual(evaluate(self.rules, alert, cache).action, MATCHED)
+
+    def test_status_cache(self):
+        """
+        Test the status of a Blackout looked up by ID is cached, up to the end
+        of its time window.
+        """
+        blackouts = {
+            "active": Blackout(
+                id="active",
+                status="active",
+                start_time=self.now - datetime.timedelta(hours=1),
+                end_time=self.now + datetime.timedelta(minutes=5),
+            )
+        }
+        lookup = MagicMock(side_effect=blackouts.get)
+        statuses = StatusCache(lookup, ttl=3600, clock=lambda: self.now)
+        self.assertEqual(statuses.status("active"), "active")
+        self.assertEqual(statuses.status("active"), "active")
+        self.assertIsNone(statuses.status("removed"))
+        self.assertEqual(lookup.call_count, 2)
+        self.now += datetime.timedelta(minutes=5)
+        self.assertEqual(statuses.status("active"), "expired")
+        self.assertIsNone(statuses.status("removed"))
+        self.assertEqual(lookup.call_count, 3)
+
+    def test_tagged_lookup(self):
+        """
+        Test the Blackout an alert has been tagged with is looked up by ID,
+        without loading all the Blackouts.
+        """
+        test_obj = BlackoutRegex()
+        with patch.object(Blackout, "find_all") as find_all, patch.object(
+            Blackout, "find_by_id", wraps=Blackout.find_by_id
+        ) as find_by_id:
+            test = test_obj.pre_receive(make_alert(tags=["regex_blackout=1"]))
+            self.assertEqual(test.status, "blackout")
+            test = test_obj.pre_receive(make_alert(tags=["regex_blackout=1"]))
+            self.assertEqual(test.status, "blackout")
+        find_all.assert_not_called()
+        find_by_id.assert_called_once_with("1")
+
+
+class TestEnhanceLinear(TestEnhance):
+    """
+    Run the same tests using the linear matching engine.
+    """
+
+    engine = "linear"
+
+    def setUp(self):
+        config = patch.dict(CONFIG, {"BLACKOUT_REGEX_ENGINE": self.engine})
+        config.start()
+        self.addCleanup(config.stop)
+
+
+class TestEnhanceSet(TestEnhanceLinear):
+    """
+    Run the same tests using the set matching engine.
+    """
+
+    engine = "set"
+
+
+PATTERNS = [
+    "prod",
+    "^prod",
+    "prod$",
+    "^prod$",
+    r"^prod\Z",
+    "^pr",
+    "^preprod",
+    "^pr?od",
+    r"^edge-ams\d+",
+    "(ams|fra)",
+    "(?i)PROD",
+    r"(a)\1",
+    "(?P<site>ams)",
+    ".*",
+    "x*",
+    "^$",
+    r"\w+-\S+$",
+    "[^a-o]r",
+    "é",
+]
+VALUES = [
+    "prod",
+    "prod\n",
+    "preprod",
+    "production",
+    "edge-ams1",
+    "fra",
+    "aa",
+    "",
+    "PROD",
+    "édge-ams1\n",
+]
+
+
+class TestEngines(unittest.TestCase):
+    def test_classify(self):
+        """
+        Test the patterns are classified by their literal part.
+        """
+        self.assertEqual(_classify(re.compile("^prod$")), ("exact", "prod"))
+        self.assertEqual(_classify(re.compile(r"\Aprod\Z")), ("exact", "prod"))
+        self.assertEqual(_classify(re.compile(r"^edge-ams\d+")), ("prefix", "edge-ams"))
+        self.assertEqual(_classify(re.compile(r"^edge\.ams")), ("prefix", "edge.ams"))
+        self.assertEqual(_classify(re.compile("^prod?")), ("prefix", "pro"))
+        self.assertEqual(_classify(re.compile("Production")), ("literal", "Production"))
+        self.assertEqual(_classify(re.compile("(?i)prod")), ("regex", None))
+        self.assertEqual(_classify(re.compile("^prod|test")), ("regex", None))
+        self.assertEqual(_classify(re.compile("prod$")), ("regex", None))
+        self.assertEqual(_classify(re.compile(".*")), ("regex", None))
+        self.assertEqual(_classify(re.compile("router.*")), ("literal", "router"))
+        self.assertEqual(_classify(re.compile("^edge.*")), ("prefix", "edge"))
+
+    def test_indexed_candidates(self):
+        """
+        Test only the Blackouts that could match the alert are evaluated.
+        """
+        blackouts = [
+            Blackout(**make_blackout("1", environment="^prod$", resource="r1")),
+            Blackout(**make_blackout("2", environment="test", resource=r"^edge\d")),
+            Blackout(**make_blackout("3", resource="^core")),
+            Blackout(**make_blackout("4", resource="(edge|core)")),
+        ]
+        matcher = IndexedMatcher(RuleSet(blackouts).rules)
+        self.assertEqual(matcher.indexed, 3)
+        alert = make_alert(environment="test", resource="edge1")
+        self.assertEqual(list(matcher.candidates(alert)), [1, 3])
+        alert = make_alert(environment="prod", resource="core1")
+        self.assertEqual(list(matcher.candidates(alert)), [0, 2, 3])
+
+    def test_tags_candidates(self):
+        """
+        Test the rules are looked up by their tags, and the rules requiring
+        tags the alert doesn't have are not evaluated.
+        """
+        blackouts = [
+            Blackout(**make_blackout("1", environment="prod", tags=["site=ams.*"])),
+            Blackout(**make_blackout("2", environment="prod", tags=["site=fra.*"])),
+            Blackout(**make_blackout("3", resource="(a|b)", tags=["role=router"])),
+            Blackout(**make_blackout("4", resource="(a|b)", tags=["rack=.+"])),
+            Blackout(**make_blackout("5", resource="(a|b)")),
+        ]
+        matcher = IndexedMatcher(RuleSet(blackouts).rules)
+        self.assertEqual(matcher.indexed, 3)
+        alert = make_alert(environment="prod", tags=["site=ams1", "role=router"])
+        self.assertEqual(list(matcher.candidates(alert)), [0, 2, 4])
+        alert = make_alert(environment="prod", tags=["rack=r1"])
+        self.assertEqual(list(matcher.candidates(alert)), [3, 4])
+        # The tags are ignored when the alert has none.
+        alert = make_alert(environment="prod", tags=[])
+        self.assertEqual(list(matcher.candidates(alert)), [0, 1, 2, 3, 4])
+
+    def test_hs_expression(self):
+        """
+        Test the patterns are translated to Hyperscan expressions, unless
+        Hyperscan may evaluate them differently.
+        """
+        self.assertEqual(
+            _hs_expression(re.compile(r"^(core|agg)\.ams[0-9]+$")),
+            rb"^(?:(?:core|agg))\x{2e}ams(?:[0-9]){1,}$",
+        )
+        self.assertEqual(_hs_expression(re.compile(r"^prod\Z")), rb"^prod\z")
+        self.assertTrue(_hs_expression(re.compile(r"^edge\d+")).startswith(b"^edge"))
+        for pattern in ("(?i)prod", r"\bprod", r"(a)\1", "(?=a)", "a++"):
+            self.assertIsNone(_hs_expression(re.compile(pattern)), pattern)
+
+    @unittest.skipIf(hyperscan is None, "Hyperscan is not installed")
+    def test_set_candidates(self):
+        """
+        Test only the Blackouts whose most selective pattern matched are
+        evaluated, and the patterns Hyperscan can't evaluate are left to re.
+        """
+        blackouts = [
+            Blackout(**make_blackout("1", environment="^prod$", resource="r1")),
+            Blackout(**make_blackout("2", environment="test", resource=r"^edge\d")),
+            Blackout(**make_blackout("3", resource="(?i)^core")),
+            Blackout(**make_blackout("4", resource="(edge|core)")),
+            Blackout(**make_blackout("5", environment="test", tags=["site=ams.*"])),
+        ]
+        matcher = SetMatcher(RuleSet(blackouts).rules)
+        self.assertEqual(matcher.scanned, 6)
+        self.assertEqual(matcher.always, [2])
+        alert = make_alert(environment="test", resource="edge1")
+        self.assertEqual(list(matcher.candidates(alert)), [1, 2, 3, 4])
+        alert = make_alert(environment="test", resource="edge1", tags=["site=fra"])
+        self.assertEqual(list(matcher.candidates(alert)), [1, 2, 3])
+        alert = make_alert(environment="prod", resource="Core1", tags=["site=ams"])
+        self.assertEqual(list(matcher.candidates(alert)), [0, 2, 4])
+        self.assertEqual(matcher.match(alert, parse_tags(alert.tags)).id, "3")
+
+    def test_set_fallback(self):
+        """
+        Test the set engine evaluates all the Blackouts, with re, when
+        Hyperscan is not installed.
+        """
+        blackouts = [
+            Blackout(**make_blackout("1", environment="^prod$", resource="r1")),
+            Blackout(**make_blackout("2", environment="test", resource=r"^edge\d")),
+        ]
+        with patch("blackout_regex.hyperscan", None):
+            matcher = SetMatcher(RuleSet(blackouts).rules)
+        self.assertEqual(matcher.scanned, 0)
+        alert = make_alert(environment="test", resource="edge1")
+        self.assertEqual(list(matcher.candidates(alert)), [0, 1])
+        self.assertEqual(matcher.match(alert, {}).id, "2")
+
+    def test_pattern_table(self):
+        """
+        Test the patterns shared between the rules are evaluated once per
+        alert.
+        """
+        blackouts = [
+            Blackout(**make_blackout("1", environment="^prod", resource="^r1$")),
+            Blackout(**make_blackout("2", environment="^prod", resource="^r2$")),
+            Blackout(**make_blackout("3", environment="^prod", tags=["site=ams.*"])),
+            Blackout(**make_blackout("4", resource="^r1$", tags=["site=ams.*"])),
+        ]
+        rules = RuleSet(blackouts, engine="linear")
+        table = rules.patterns
+        self.assertEqual(table.references, 8)
+        self.assertEqual(len(table), 4)
+        self.assertEqual(table.ratio, 2.0)
+        programs = table.programs
+        self.assertEqual(programs[0][0][0][1], programs[2][0][0][1])
+        self.assertEqual(programs[0][0][1][1], programs[3][0][0][1])
+        self.assertEqual(programs[2][2], programs[3][2])
+        searches = collections.Counter()
+
+        class Counting(object):
+            def __init__(self, pattern):
+                self.pattern = pattern.pattern
+                self._pattern = pattern
+
+            def search(self, value):
+                searches[self.pattern] += 1
+                return self._pattern.search(value)
+
+        counting = {}
+        for rule in rules.rules:
+            rule.attributes = tuple(
+                (attr, counting.setdefault(pattern, Counting(pattern)))
+                for attr, pattern in rule.attributes
+            )
+        for engine in ("linear", "indexed", "set"):
+            searches.clear()
+            matcher = MATCHERS[engine](rules.rules)
+            alert = make_alert(environment="prod", resource="r3", tags=["site=fra"])
+            self.assertIsNone(matcher.match(alert, parse_tags(alert.tags)))
+            self.assertTrue(all(count == 1 for count in searches.values()))
+            alert = make_alert(environment="prod", resource="r2")
+            self.assertEqual(matcher.match(alert, parse_tags(alert.tags)).id, "2")
+
+    def test_same_results(self):
+        """
+        Test the indexed and set engines match exactly as the linear
+        engine, on random Blackouts and alerts.
+        """
+        rnd = random.Random(42)
+
+        def _pattern():
+            return rnd.choice(PATTERNS) if rnd.random() < 0.7 else None
+
+        blackouts = []
+        for index in range(100):
+            blackouts.append(
+                Blackout(
+                    **make_blackout(
+                        str(index),
+                        environment=_pattern(),
+                        customer=_pattern(),
+                        resource=_pattern(),
+                        event=_pattern(),
+                        service=[
+                            rnd.choice(PATTERNS) for _ in range(rnd.randint(0, 2))
+                        ],
+                        tags=[
+                            "{}={}".format(key, rnd.choice(PATTERNS))
+                            for key in rnd.sample(["site", "role"], rnd.randint(0, 2))
+                        ],
+                    )
+                )
+            )
+        linear = RuleSet(blackouts, engine="linear")
+        engines = [
+            RuleSet(blackouts, engine="indexed"),
+            RuleSet(blackouts, engine="set"),
+        ]
+        for _ in range(500):
+            alert = make_alert(
+                environment=rnd.choice(VALUES),
+                customer=rnd.choice(VALUES + [None]),
+                resource=rnd.choice(VALUES),
+                event=rnd.choice(VALUES),
+                service=[rnd.choice(VALUES) for _ in range(rnd.randint(0, 2))],
+                tags=[
+                    "{}={}".format(key, rnd.choice(VALUES))
+                    for key in rnd.sample(["site", "role", "os"], rnd.randint(0, 3))
+                ],
+            )
+            alert_tags = parse_tags(alert.tags)
+            expected = linear.match(alert, alert_tags)
+            for rules in engines:
+                result = rules.match(alert, alert_tags)
+                self.assertEqual(
+                    expected and expected.id, result and result.id, alert.__dict__
+                )
+
+
+class TestPlanner(unittest.TestCase):
+    def setUp(self):
+        self.blackouts = [
+            Blackout(**make_blackout("1", environment="test", resource="^a")),
+            Blackout(**make_blackout("2", environment="test", resource="^b")),
+            Blackout(**make_blackout("3", environment="test", resource="^b1")),
+        ]
+        self.rules = RuleSet(self.blackouts, engine="linear")
+
+    def test_replan(self):
+        """
+        Test the attributes rejecting the most alerts are evaluated first, and
+        the Blackouts matching the most alerts are tried first.
+        """
+        planner = Planner(hot=1, interval=60, sample=1)
+        for resource in ("b1", "b2", "c1"):
+            alert = make_alert(resource=resource)
+            planner.record(self.rules, alert, evaluate(self.rules, alert))
+        self.assertEqual(planner.plan["hot"], [])
+        planner.replan(self.rules)
+        plan = planner.plan
+        self.assertEqual(plan["attributes"][0], "resource")
+        self.assertEqual(plan["hot"], ["2"])
+        self.assertEqual(plan["rejection_rates"]["environment"], 0.0)
+        self.assertEqual(
+            [attr for attr, _ in self.rules.get("1").attributes],
+            ["resource", "environment"],
+        )
+        self.assertEqual(
+            [rule.id for rule in self.rules.matcher.rules], ["2", "1", "3"]
+        )
+
+    def test_hot_ties(self):
+        """
+        Test the Blackouts matching as many alerts are ordered by ID.
+        """
+        planner = Planner(hot=2, interval=60, sample=0)
+        self.rules.replan(hot=["3"])
+        for resource in ("b1", "a1"):
+            alert = make_alert(resource=resource)
+            planner.record(self.rules, alert, evaluate(self.rules, alert))
+        planner.replan(self.rules)
+        self.assertEqual(planner.plan["hot"], ["1", "3"])
+
+    def test_hot_first(self):
+        """
+        Test the hot Blackouts are moved first, with either engine.
+        """
+        for engine in ("linear", "indexed"):
+            with self.subTest(engine=engine):
+                rules = RuleSet(self.blackouts, engine=engine)
+                alert = make_alert(resource="b1")
+                generation = rules.generation
+                self.assertEqual(rules.match(alert, {}).id, "2")
+                rules.replan(hot=["3"])
+                self.assertEqual(
+                    [rule.id for rule in rules.matcher.rules], ["3", "1", "2"]
+                )
+                self.assertEqual(rules.match(alert, {}).id, "3")
+                self.assertNotEqual(rules.generation, generation)
+                generation = rules.generation
+                rules.replan(hot=["3"])
+                self.assertEqual(rules.generation, generation)
+                self.assertEqual(rules.match(make_alert(resource="b2"), {}).id, "2")
+                self.assertEqual(rules.match(make_alert(resource="a1"), {}).id, "1")
+                self.assertIsNone(rules.match(make_alert(resource="c1"), {}))
+
+    def test_plugin(self):
+        """
+        Test the plan is applied by the plugin, and exposed.
+        """
+        self.assertIsNone(BlackoutRegex().plan())
+        config = {
+            "BLACKOUT_REGEX_ADAPTIVE": "hot",
+            "BLACKOUT_REGEX_ADAPTIVE_INTERVAL": 0,
+            "BLACKOUT_REGEX_ADAPTIVE_SAMPLE": 1,
+        }
+        with patch.dict(CONFIG, config):
+            test_obj = BlackoutRegex()
+        test = test_obj.pre_receive(make_alert(resource="test1"))
+        self.assertEqual(test.tags, ["regex_blackout=1"])
+        self.assertEqual(test_obj.plan()["hot"], ["1"])
+        test = test_obj.pre_receive(make_alert(resource="test1"))
+        self.assertEqual(test.tags, ["regex_blackout=1"])
+
+
+class TestMatchCache(unittest.TestCase):
+    def setUp(self):
+        self.rules = RuleSet([Blackout(**blackout) for blackout in BLACKOUTS])
+        self.rules.matcher = MagicMock(wraps=self.rules.matcher)
+
+    def test_cached_results(self):
+        """
+        Test the matching results, positive or negative, are reused for the
+        alerts having the same attributes.
+        """
+        cache = MatchCache(size=10)
+        match = make_alert(resource="test1")
+        no_match = make_alert(tags=["site=siteX"])
+        for _ in range(3):
+            self.assertEqual(cache.match(self.rules, match, {}).id, "1")
+            self.assertIsNone(
+                cache.match(self.rules, no_match, parse_tags(no_match.tags))
+            )
+        self.assertEqual(self.rules.matcher.match.call_count, 2)
+        self.assertEqual((cache.hits, cache.misses), (4, 2))
+
+    def test_generation_change(self):
+        """
+        Test the cache is emptied when the Blackouts are reloaded.
+        """
+        cache = MatchCache(size=10)
+        alert = make_alert(resource="test1")
+        cache.match(self.rules, alert, {})
+        rules = RuleSet([])
+        self.assertIsNone(cache.match(rules, alert, {}))
+        self.assertEqual(len(cache), 1)
+        self.assertEqual(cache.misses, 2)
+
+    def test_bounded(self):
+        """
+        Test the least recently used entries are evicted.
+        """
+        cache = MatchCache(size=2)
+        for resource in ("test1", "test2", "test1", "test3"):
+            cache.match(self.rules, make_alert(resource=resource), {})
+        self.assertEqual(len(cache), 2)
+        cache.match(self.rules, make_alert(resource="test1"), {})
+        self.assertEqual(cache.hits, 2)
+
+    def test_disabled(self):
+        """
+        Test the results aren't cached when the size is 0.
+        """
+        cache = MatchCache(size=0)
+        for _ in range(2):
+            cache.match(self.rules, make_alert(resource="test1"), {})
+        self.assertEqual(self.rules.matcher.match.call_count, 2)
+        self.assertEqual(len(cache), 0)
+
+
+class TestBatch(unittest.TestCase):
+    def setUp(self):
+        self.alerts = [
+            make_alert(resource="test1"),
+            make_alert(tags=["site=siteX"]),
+            make_alert(resource="test1"),
+            make_alert(tags=["regex_blackout=4"]),
+            make_alert(tags=["regex_blackout=5"]),
+            make_alert(resource="test1", status="closed"),
+            None,
+        ]
+
+    def test_match_alerts(self):
+        """
+        Test a batch of alerts is evaluated against the Blackouts at once.
+        """
+        blackouts = [Blackout(**blackout) for blackout in BLACKOUTS]
+        decisions = match_alerts(blackouts, self.alerts)
+        self.assertEqual(
+            [decision.action for decision in decisions],
+            [MATCHED, UNMATCHED, MATCHED, ACTIVE, RELEASED, IGNORED, IGNORED],
+        )
+        self.assertEqual(
+            [decision.blackout_id for decision in decisions],
+            ["1", None, "1", "4", "5", None, None],
+        )
+
+    def test_evaluate_many(self):
+        """
+        Test the alerts evaluated in batch are not changed.
+        """
+        test_obj = BlackoutRegex()
+        decisions = test_obj.evaluate_many(self.alerts)
+        self.assertEqual(
+            decisions,
+            match_alerts([Blackout(**blackout) for blackout in BLACKOUTS], self.alerts),
+        )
+        self.assertEqual(self.alerts[0].tags, [])
+        self.assertEqual(self.alerts[0].status, "open")
+        self.assertEqual(self.alerts[4].tags, ["regex_blackout=5"])
+
+
+class TestReplay(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+
+    def _write(self, name, content):
+        path = os.path.join(self.tmp, name)
+        with open(path, "w") as fd:
+            fd.write(content)
+        return path
+
+    def test_read_json(self):
+        """
+        Test the JSON lists, NDJSON, and Alerta API responses are read by
+        chunks.
+        """
+        items = [{"id": str(index), "tags": ["a=b"] * index} for index in range(20)]
+        for content in (
+            json.dumps(items, indent=2),
+            "\n".join(json.dumps(item) for item in items) + "\n",
+            json.dumps({"status": "ok", "alerts": items}),
+        ):
+            path = self._write("items.json", content)
+            self.assertEqual(list(read_json(path, chunk_size=7)), items)
+        path = self._write("items.json", '[{"id": "1"}, {"id": ')
+        with self.assertRaises(ValueError):
+            list(read_json(path, chunk_size=7))
+
+    def _replay(self, *args):
+        blackouts = self._write("blackouts.json", json.dumps({"blackouts": BLACKOUTS}))
+        alerts = [
+            {"id": "a1", "environment": "test", "resource": "test1"},
+            {
+                "id": "a2",
+                "environment": "test",
+                "resource": "other",
+                "service": ["other"],
+                "tags": ["site=other"],
+            },
+            {"id": "a3", "environment": "test", "tags": ["regex_blackout=5"]},
+            {"id": "a4", "environment": "rgx", "resource": "other"},
+        ] * 50
+        alerts = self._write("alerts.json", "\n".join(map(json.dumps, alerts)))
+        output = os.path.join(self.tmp, "decisions.json")
+        counts = os.path.join(self.tmp, "counts.json")
+        main(
+            ["--blackouts", blackouts, "--alerts", alerts]
+            + ["--output", output, "--counts", counts, "--batch-size", "7"]
+            + list(args)
+        )
+        with open(output) as fd:
+            decisions = [json.loads(line) for line in fd]
+        with open(counts) as fd:
+            return decisions, json.load(fd)
+
+    def test_replay(self):
+        """
+        Test the alerts are evaluated offline, and the decisions, and the hits
+        per Blackout, written.
+        """
+        decisions, counts = self._replay()
+        self.assertEqual(len(decisions), 200)
+        self.assertEqual(
+            decisions[:4],
+            [
+                {"alert": "a1", "action": "matched", "blackout": "1"},
+                {"alert": "a2", "action": "unmatched", "blackout": None},
+                {"alert": "a3", "action": "released", "blackout": "5"},
+                {"alert": "a4", "action": "matched", "blackout": "7"},
+            ],
+        )
+        self.assertEqual(counts["alerts"], 200)
+        self.assertEqual(
+            counts["actions"], {"matched": 100, "unmatched": 50, "released": 50}
+        )
+        self.assertEqual(counts["blackouts"]["1"], 50)
+        self.assertEqual(counts["blackouts"]["7"], 50)
+        self.assertEqual(counts["blackouts"]["2"], 0)
+        decisions, counts = self._replay("--all-active")
+        self.assertEqual(decisions[2]["action"], "active")
+        if multiprocessing.get_start_method() == "fork":
+            self.assertEqual(self._replay("--processes", "2"), self._replay())
+
+
+def _sync_snapshot(path, counter):
+    def _loader():
+        with open(counter, "a") as fd:
+            fd.write("x")
+        return [Blackout(**blackout) for blackout in BLACKOUTS]
+
+    SharedSnapshot(path, _loader, probe=lambda: 1).generation()
+
+
+class TestSharedSnapshot(unittest.TestCase):
+    def setUp(self):
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        self.path = os.path.join(tmpdir.name, "blackouts.snapshot")
+        self.signature = 1
+        self.loads = 0
+
+    def _loader(self):
+        self.loads += 1
+        return [Blackout(**blackout) for blackout in BLACKOUTS]
+
+    def _snapshot(self, **kwargs):
+        kwargs.setdefault("ttl", 0)
+        return SharedSnapshot(
+            self.path, self._loader, probe=lambda: self.signature, **kwargs
+        )
+
+    def test_load(self):
+        """
+        Test the Blackouts are written to, and read from, the snapshot.
+        """
+        snapshot = self._snapshot()
+        self.assertEqual(snapshot.generation(), 1)
+        blackouts = snapshot.load()
+        self.assertEqual([blackout.id for blackout in blackouts], list("12345678"))
+        self.assertEqual(blackouts[2].tags, ["site=site.*", "role=router"])
+        self.assertEqual(len(RuleSet(blackouts).rules), len(BLACKOUTS))
+
+    def test_time_window(self):
+        """
+        Test the time window of the Blackouts is preserved in the snapshot.
+        """
+        start = datetime.datetime(2026, 1, 1, 12, 0)
+        end = start + datetime.timedelta(hours=1)
+        blackout = make_blackout("1", resource=".*", start_time=start, end_time=end)
+        with with_blackouts(blackout):
+            snapshot = self._snapshot()
+            snapshot.generation()
+        rule = RuleSet(snapshot.load()).get("1")
+        self.assertEqual((rule.start_time, rule.end_time), (start, end))
+
+    def test_generation(self):
+        """
+        Test the Blackouts are reloaded from the DB only when the signature
+        changes, and the generation is incremented.
+        """
+        snapshot = self._snapshot()
+        snapshot.generation()
+        self.assertEqual(snapshot.generation(), 1)
+        self.signature = 2
+        self.assertEqual(snapshot.generation(), 2)
+        self.assertEqual(self.loads, 2)
+
+    def test_fresh(self):
+        """
+        Test the DB is not checked while the snapshot is fresh.
+        """
+        self._snapshot(ttl=60).generation()
+        self.signature = 2
+        self.assertEqual(self._snapshot(ttl=60).generation(), 1)
+        self.assertEqual(self.loads, 1)
+
+    def test_locked(self):
+        """
+        Test only the worker holding the lock updates the snapshot.
+        """
+        self._snapshot().generation()
+        self.signature = 2
+        with open(self.path + ".lock", "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            self.assertEqual(self._snapshot().generation(), 1)
+        self.assertEqual(self._snapshot().generation(), 2)
+
+    def test_workers(self):
+        """
+        Test multiple worker processes load the Blackouts from the DB only
+        once.
+        """
+        if "fork" not in multiprocessing.get_all_start_methods():
+            self.skipTest("fork is not available")
+        counter = self.path + ".count"
+        ctx = multiprocessing.get_context("fork")
+        workers = [
+            ctx.Process(target=_sync_snapshot, args=(self.path, counter))
+            for _ in range(8)
+        ]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join(10)
+            self.assertEqual(worker.exitcode, 0)
+        with open(counter) as fd:
+            self.assertEqual(fd.read(), "x")
+
+    def test_plugin(self):
+        """
+        Test the plugin evaluates the alerts using the Blackouts from the
+        snapshot.
+        """
+        with patch.dict(CONFIG, {"BLACKOUT_REGEX_SNAPSHOT": self.path}):
+            test_obj = BlackoutRegex()
+        test = test_obj.pre_receive(make_alert(resource="test1"))
+        self.assertEqual(test.tags, ["regex_blackout=1"])
+        self.assertTrue(os.path.exists(self.path))
+
+
+class TestBenchmark(unittest.TestCase):
+    def test_run(self):
+        """
+        Test the benchmark runs all the strategies on the same corpus, and
+        they all match the same alerts.
+        """
+        import benchmark_blackout_regex
+
+        results = benchmark_blackout_regex.run(
+            memory=False, blackouts=50, alerts=200, match_ratio=0.5, seed=1
+        )
+        json.dumps(results)
+        matched = {result["matched"] for result in results["results"]}
+        self.assertEqual(len(matched), 1)
+        self.assertGreater(matched.pop(), 0)
+        self.assertEqual(
+            [result["strategy"] for result in results["results"]],
+            sorted(benchmark_blackout_regex.STRATEGIES),
+        )
+
+    def test_representations(self):
+        """
+        Test the rules take less memory than the Blackout models they are
+        compiled from, together.
+        """
+        import benchmark_blackout_regex
+
+        blackouts, _ = benchmark_blackout_regex.make_corpus(blackouts=200, alerts=0)
+        results = benchmark_blackout_regex.measure_representations(blackouts)
+        self.assertEqual(results["blackouts"], 200)
+        self.assertLess(results["rules_bytes"], results["rules_and_models_bytes"])
+
+
+SNAPSHOTS = []
+
+
+class TestMetrics(unittest.TestCase):
+    def setUp(self):
+        del SNAPSHOTS[:]
+        config = patch.dict(
+            CONFIG,
+            {
+                "BLACKOUT_REGEX_METRICS": "{}:SNAPSHOTS.append".format(__name__),
+                "BLACKOUT_REGEX_METRICS_SAMPLE": 1,
+            },
+        )
+        config.start()
+        self.addCleanup(config.stop)
+
+    def test_disabled(self):
+        """
+        Test no metrics are recorded by default.
+        """
+        with patch.dict(CONFIG, {"BLACKOUT_REGEX_METRICS": None}):
+            test_obj = BlackoutRegex()
+        test_obj.pre_receive(make_alert(resource="test1"))
+        self.assertIsNone(test_obj.metrics())
+
+    def test_counters(self):
+        """
+        Test the decisions, and the matching cache usage, are counted, and the
+        patterns are recorded as gauges, which don't grow on reload.
+        """
+        test_obj = BlackoutRegex()
+        test_obj.pre_receive(make_alert(resource="test1"))
+        test_obj.pre_receive(make_alert(resource="test1"))
+        test_obj.pre_receive(make_alert(tags=["regex_blackout=1"]))
+        test_obj.pre_receive(make_alert(tags=["regex_blackout=5"]))
+        metrics = test_obj.metrics()
+        self.assertEqual(
+            metrics["counters"],
+            {
+                "matched": 2,
+                "tagged": 2,
+                "active": 1,
+                "released": 1,
+                "cache_hits": 1,
+                "cache_misses": 1,
+                "compiled": len(BLACKOUTS) - 1,
+            },
+        )
+        patterns = test_obj._cache.value.patterns
+        gauges = {
+            "patterns": patterns.references,
+            "patterns.distinct": len(patterns),
+        }
+        self.assertEqual(metrics["gauges"], gauges)
+        test_obj._cache.refresh(force=True)
+        self.assertEqual(test_obj.metrics()["gauges"], gauges)
+        for timer in ("fetch", "compile", "match"):
+            self.assertEqual(
+                metrics["timers"][timer]["count"], 1 if timer != "match" else 4
+            )
+        self.assertEqual(sum(metrics["timers"]["match"]["buckets"]), 4)
+
+    def test_profile(self):
+        """
+        Test the time spent per attribute and per pattern is recorded.
+        """
+        test_obj = BlackoutRegex()
+        test_obj.pre_receive(make_alert(resource="test1"))
+        metrics = test_obj.metrics()
+        self.assertIn("match.resource", metrics["timers"])
+        self.assertIn("match.environment", metrics["timers"])
+        slowest = test_obj._metrics.slowest()
+        self.assertIn(("1", "resource", r"test\d"), [key for key, _ in slowest])
+
+    def test_flush(self):
+        """
+        Test the metrics are handed over to the sink once the interval elapsed.
+        """
+        with patch.dict(CONFIG, {"BLACKOUT_REGEX_METRICS_INTERVAL": 0}):
+            test_obj = BlackoutRegex()
+        test_obj.pre_receive(make_alert(resource="test1"))
+        test_obj._metrics._thread.join(5)
+        self.assertEqual(len(SNAPSHOTS), 1)
+        self.assertEqual(SNAPSHOTS[0]["counters"]["tagged"], 1)
+
+    def test_invalid_sink(self):
+        """
+        Test a sink that can't be loaded disables the metrics, but not the
+        plugin.
+        """
+        with patch.dict(CONFIG, {"BLACKOUT_REGEX_METRICS": "no_such_module:sink"}):
+            with self.assertLogs("alerta.plugins.blackout_regex", "ERROR") as logs:
+                test_obj = BlackoutRegex()
+        self.assertIn("BLACKOUT_REGEX_METRICS", logs.output[0])
+        self.assertIsNone(test_obj._metrics)
+        test = test_obj.pre_receive(make_alert(resource="test1"))
+        self.assertEqual(test.tags, ["regex_blackout=1"])
+
+    def test_alerta_sink(self):
+        """
+        Test only the increments of the counters and timers, and the last
+        values of the gauges, are published to the Alerta metrics.
+        """
+        app = MagicMock()
+        models = MagicMock()
+        with patch.dict(
+            sys.modules, {"alerta.app": app, "alerta.models.metrics": models}
+        ):
+            sink = AlertaSink()
+            snapshot = {
+                "counters": {"tagged": 2},
+                "gauges": {"patterns": 5},
+                "timers": {"match": {"count": 4, "total": 0.5}},
+            }
+            sink(snapshot)
+            snapshot["counters"]["tagged"] = 3
+            snapshot["gauges"]["patterns"] = 4
+            sink(snapshot)
+        counts = [call.kwargs["count"] for call in models.Counter.call_args_list]
+        self.assertEqual(counts, [2, 1])
+        values = [call.kwargs["value"] for call in models.Gauge.call_args_list]
+        self.assertEqual(values, [5, 4])
+        self.assertEqual(app.db.set_gauge.call_count, 2)
+        self.assertEqual(models.Timer.call_count, 1)
+        self.assertEqual(models.Timer.call_args.kwargs["total_time"], 500)
+        self.assertEqual(app.db.inc_counter.call_count, 2)
+
+
+def wait_for(predicate, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        if time.monotonic() > deadline:
+            raise AssertionError("Timed out waiting for the condition")
+        time.sleep(0.001)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestBlackoutCache(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.signature = 1
+        self.loads = 0
+
+    def _loader(self):
+        self.loads += 1
+        return ["blackout-{}".format(self.loads)]
+
+    def _probe(self):
+        return self.signature
+
+    def test_fresh_cache(self):
+        """
+        Test the Blackouts are loaded only once while the cache is fresh.
+        """
+        cache = BlackoutCache(self._loader, probe=self._probe, clock=self.clock)
+        self.assertEqual(cache.get(), ["blackout-1"])
+        self.clock.now = 5
+        self.assertEqual(cache.get(), ["blackout-1"])
+        self.assertEqual(self.loads, 1)
+        self.assertEqual(cache.generation, 1)
+
+    def test_unchanged_signature(self):
+        """
+        Test the Blackouts are not reloaded when the probe signature is the
+        same, until the cached list reaches the maximum age.
+        """
+        cache = BlackoutCache(
+            self._loader, probe=self._probe, ttl=10, max_age=100, clock=self.clock
+        )
+        cache.get()
+        self.clock.now = 20
+        self.assertFalse(cache.refresh())
+        self.assertEqual(self.loads, 1)
+        self.clock.now = 120
+        self.assertTrue(cache.refresh())
+        self.assertEqual(self.loads, 2)
+        self.assertEqual(cache.generation, 2)
+
+    def test_changed_signature(self):
+        """
+        Test the Blackouts are reloaded when the probe signature changes.
+        """
+        cache = BlackoutCache(self._loader, probe=self._probe, clock=self.clock)
+        cache.get()
+        self.signature = 2
+        self.assertTrue(cache.refresh())
+        self.assertEqual(cache.get(), ["blackout-2"])
+
+    def test_stale_while_revalidate(self):
+        """
+        Test the stale Blackouts are served while they're being reloaded in
+        the background.
+        """
+        release = threading.Event()
+
+        def _slow_loader():
+            if self.loads:
+                release.wait(5)
+            return self._loader()
+
+        cache = BlackoutCache(_slow_loader, probe=self._probe, clock=self.clock)
+        cache.get()
+        self.signature = 2
+        self.clock.now = 60
+        self.assertEqual(cache.get(), ["blackout-1"])
+        thread = cache._thread
+        self.assertIsNone(cache.revalidate())
+        release.set()
+        thread.join(5)
+        self.assertEqual(cache.get(), ["blackout-2"])
+
+    def test_failing_loader(self):
+        """
+        Test the cached Blackouts are preserved when the DB is unavailable.
+        """
+
+        def _failing_loader():
+            if self.loads:
+                raise RuntimeError("DB unavailable")
+            return self._loader()
+
+        cache = BlackoutCache(_failing_loader, clock=self.clock)
+        cache.get()
+        self.clock.now = 60
+        self.assertFalse(cache.refresh())
+        self.assertEqual(cache.get(), ["blackout-1"])
+        self.assertEqual(cache.failures, 1)
+
+    def test_disabled(self):
+        """
+        Test the Blackouts are reloaded on every call when the TTL is 0.
+        """
+        cache = BlackoutCache(self._loader, probe=self._probe, ttl=0)
+        cache.get()
+        cache.get()
+        self.assertEqual(self.loads, 2)
+
+    def test_refresher(self):
+        """
+        Test the Blackouts are refreshed in the background, keeping the
+        previous Blackouts on failures.
+        """
+
+        def _probe():
+            if self.signature == "fail":
+                raise RuntimeError("DB unavailable")
+            return self.signature
+
+        cache = BlackoutCache(self._loader, probe=_probe, ttl=0)
+        refresher = cache.start(0.01)
+        self.addCleanup(cache.stop)
+        self.assertIs(cache.start(0.01), refresher)
+        wait_for(lambda: cache.loaded is not None)
+        self.assertEqual(cache.get(), ["blackout-1"])
+        self.signature = 2
+        wait_for(lambda: cache.get() == ["blackout-2"])
+        self.assertIsNotNone(cache.refreshed)
+        self.assertIsNotNone(cache.duration)
+        self.signature = "fail"
+        wait_for(lambda: cache.failures > 1)
+        self.assertEqual(cache.get(), ["blackout-2"])
+        cache.stop()
+        self.assertFalse(refresher.is_alive())
+        self.assertEqual(self.loads, 2)
+
+    def test_plugin_refresher(self):
+        """
+        Test the plugin starts the background refresher when configured.
+        """
+        with patch.dict(CONFIG, {"BLACKOUT_REGEX_REFRESH_INTERVAL": 60}):
+            test_obj = BlackoutRegex()
+        self.addCleanup(test_obj._cache.stop)
+        test = test_obj.pre_receive(make_alert(resource="test1"))
+        self.assertEqual(test.tags, ["regex_blackout=1"])
+        self.assertTrue(test_obj._cache.refresher.is_alive())
+
+
+class FailingSource(object):
+    def __init__(self):
+        self.connects = 0
+
+    def connect(self):
+        self.connects += 1
+
+    def wait(self, timeout):
+        raise OSError("Connection lost")
+
+    def close(self):
+        pass
+
+
+class TestNotifications(unittest.TestCase):
+    def setUp(self):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        self.path = os.path.join(tmpdir, "blackouts.sock")
+        self.signature = 1
+        self.probes = 0
+        self.loads = 0
+
+    def _loader(self):
+        self.loads += 1
+        return ["blackout-{}".format(self.loads)]
+
+    def _probe(self):
+        self.probes += 1
+        return self.signature
+
+    def _notify(self, payload=b"1"):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        try:
+            sock.sendto(payload, self.path)
+        finally:
+            sock.close()
+
+    def test_source(self):
+        self.assertIsInstance(
+            notification_source("postgresql://alerta@localhost/monitoring"),
+            PostgresNotifications,
+        )
+        source = notification_source("unix://" + self.path)
+        self.assertIsInstance(source, SocketNotifications)
+        self.assertEqual(source.path, self.path)
+        with self.assertRaises(ValueError):
+            notification_source("http://localhost")
+
+    def test_notified(self):
+        """
+        Test the Blackouts are reloaded as soon as notified, without being
+        checked in the meantime.
+        """
+        cache = BlackoutCache(self._loader, probe=self._probe, ttl=0)
+        listener = cache.listen(SocketNotifications(self.path))
+        self.addCleanup(cache.stop)
+        wait_for(lambda: listener.connected and cache.loaded is not None)
+        self.assertEqual(cache.get(), ["blackout-1"])
+        probes = self.probes
+        self.assertEqual(cache.get(), ["blackout-1"])
+        self.assertEqual(self.probes, probes)
+        # Reloaded even though the signature didn't change.
+        self._notify()
+        self._notify()
+        wait_for(lambda: cache.get() == ["blackout-2"])
+        self.assertEqual(listener.notified, 1)
+        cache.stop()
+        self.assertFalse(listener.is_alive())
+        self.assertFalse(listener.connected)
+
+    def test_fallback(self):
+        """
+        Test the Blackouts are polled while the notifications are lost, and
+        the connection is retried.
+        """
+        source = FailingSource()
+        cache = BlackoutCache(self._loader, probe=self._probe, ttl=0)
+        listener = cache.listen(source)
+        listener.retry = 0.01
+        self.addCleanup(cache.stop)
+        wait_for(lambda: listener.failures > 1)
+        self.assertGreater(source.connects, 1)
+        self.assertFalse(listener.connected)
+        probes = self.probes
+        cache.get()
+        self.assertEqual(self.probes, probes + 1)
+
+    def test_plugin(self):
+        """
+        Test the plugin reloads the Blackouts when notified.
+        """
+        with patch.dict(
+            CONFIG,
+            {
+                "BLACKOUT_REGEX_NOTIFICATIONS": "unix://" + self.path,
+                "BLACKOUT_REGEX_CACHE_TTL": 3600,
+            },
+        ):
+            test_obj = BlackoutRegex()
+        self.addCleanup(test_obj._cache.stop)
+        test = test_obj.pre_receive(make_alert(resource="test1"))
+        self.assertEqual(test.tags, ["regex_blackout=1"])
+        listener = test_obj._cache.listener
+        wait_for(lambda: listener.connected)
+        with with_blackouts(make_blackout("9", resource=r"^other\d$")):
+            self._notify(b"9")
+            wait_for(lambda: "9" in test_obj._cache.get().by_id)
+            test = test_obj.pre_receive(make_alert(resource="other1"))
+        self.assertEqual(test.tags, ["regex_blackout=9"])
+
+    def test_plugin_invalid(self):
+        with patch.dict(CONFIG, {"BLACKOUT_REGEX_NOTIFICATIONS": "http://localhost"}):
+            test_obj = BlackoutRegex()
+        test = test_obj.pre_receive(make_alert(resource="test1"))
+        self.assertEqual(test.tags, ["regex_blackout=1"])
+        self.assertIsNone(test_obj._cache.listener)
+
+
+class TestAudit(unittest.TestCase):
+    def setUp(self):
+        self.batches = []
+
+    def test_batches(self):
+        """
+        Test the decisions are written in batches, and counted per Blackout.
+        """
+        audit = AuditLog(self.batches.append, batch=2, interval=0.01)
+        self.addCleanup(audit.stop)
+        audit.record(make_alert(id="a1"), "1", "tagged")
+        audit.record(make_alert(id="a2"), "1", "tagged")
+        audit.record(make_alert(id="a3"), "2", "active")
+        wait_for(lambda: audit.written == 3)
+        self.assertEqual([len(batch) for batch in self.batches], [2, 1])
+        record = self.batches[0][0]
+        self.assertEqual(record["alert"], "a1")
+        self.assertEqual(record["blackout"], "1")
+        self.assertEqual(record["action"], "tagged")
+        self.assertEqual(record["resource"], "test::resource")
+        self.assertEqual(
+            audit.report(),
+            {
+                "blackouts": {"1": {"tagged": 2}, "2": {"active": 1}},
+                "queued": 0,
+                "written": 3,
+                "dropped": 0,
+                "failures": 0,
+            },
+        )
+
+    def test_dropped(self):
+        """
+        Test the decisions are dropped, but counted, when the queue is full,
+        and the records queued are written once stopped.
+        """
+        audit = AuditLog(self.batches.append, size=2, batch=10, interval=60)
+        self.addCleanup(audit.stop)
+        for index in range(3):
+            audit.record(make_alert(id="a{}".format(index)), "1", "tagged")
+        self.assertEqual(len(audit.queue), 2)
+        audit.stop(5)
+        self.assertEqual([len(batch) for batch in self.batches], [2])
+        report = audit.report()
+        self.assertEqual(report["blackouts"], {"1": {"tagged": 3}})
+        self.assertEqual(report["dropped"], 1)
+        self.assertEqual(report["written"], 2)
+
+    def test_failing_writer(self):
+        def _failing(records):
+            raise OSError("Disk full")
+
+        audit = AuditLog(_failing, size=10, batch=10, interval=60)
+        audit.record(make_alert(), "1", "tagged")
+        audit.stop(5)
+        self.assertEqual(audit.report()["failures"], 1)
+        self.assertEqual(audit.report()["written"], 0)
+
+    def test_plugin(self):
+        """
+        Test the plugin writes the alerts tagged, or under an active Blackout,
+        to the NDJSON file.
+        """
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        path = os.path.join(tmpdir, "audit.ndjson")
+        with patch.dict(CONFIG, {"BLACKOUT_REGEX_AUDIT": path}):
+            test_obj = BlackoutRegex()
+        self.assertIsNone(BlackoutRegex().audit())
+        test_obj.pre_receive(make_alert(resource="test1"))
+        test_obj.pre_receive(make_alert(tags=["regex_blackout=1"]))
+        test_obj.pre_receive(make_alert(tags=["test-tag"]))
+        test_obj._audit.stop(5)
+        with open(path) as fd:
+            records = [json.loads(line) for line in fd]
+        self.assertEqual(
+            [(record["blackout"], record["action"]) for record in records],
+            [("1", "tagged"), ("1", "active")],
+        )
+        self.assertEqual(
+            test_obj.audit()["blackouts"], {"1": {"tagged": 1, "active": 1}}
+        )
+
+    def test_invalid_writer(self):
+        """
+        Test a writer that can't be loaded disables the audit log, but not the
+        plugin.
+        """
+        with patch.dict(CONFIG, {"BLACKOUT_REGEX_AUDIT": "no_such_module:writer"}):
+            with self.assertLogs("alerta.plugins.blackout_regex", "ERROR") as logs:
+                test_obj = BlackoutRegex()
+        self.assertIn("BLACKOUT_REGEX_AUDIT", logs.output[0])
+        self.assertIsNone(test_obj.audit())
+        test = test_obj.pre_receive(make_alert(resource="test1"))
+        self.assertEqual(test.tags, ["regex_blackout=1"])
+
+
+class TestProfiler(unittest.TestCase):
+    def setUp(self):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        self.path = os.path.join(tmpdir, "profile-{pid}.collapsed")
+
+    def _plugin(self, **config):
+        config = dict(
+            {
+                "BLACKOUT_REGEX_PROFILE_PATH": self.path,
+                "BLACKOUT_REGEX_PROFILE_INTERVAL": 0,
+            },
+            **config
+        )
+        with patch.dict(CONFIG, config):
+            return BlackoutRegex()
+
+    def test_disabled(self):
+        test_obj = self._plugin()
+        self.assertIsNone(test_obj._profiler)
+        test = test_obj.pre_receive(make_alert(resource="test1"))
+        self.assertEqual(test.tags, ["regex_blackout=1"])
+
+    def test_sampled(self):
+        """
+        Test one call every sample is profiled, and the time attributed to
+        the Blackouts evaluated.
+        """
+        test_obj = self._plugin(BLACKOUT_REGEX_PROFILE=2)
+        for _ in range(4):
+            test = test_obj.pre_receive(make_alert(resource="test1"))
+            self.assertEqual(test.tags, ["regex_blackout=1"])
+        profiler = test_obj._profiler
+        self.assertEqual(profiler.samples, 2)
+        stacks = set(profiler.stacks)
+        self.assertIn(("pre_receive", "evaluate", "blackout:1"), stacks)
+        self.assertIn(("pre_receive", "_fetch_rules"), stacks)
+        self.assertIn(("pre_receive", "parse_tags"), stacks)
+        self.assertIn(("pre_receive",), stacks)
+        # The Blackouts following the first match are not evaluated.
+        self.assertNotIn(("pre_receive", "evaluate", "blackout:2"), stacks)
+        with open(self.path.format(pid=os.getpid())) as fd:
+            lines = fd.read().splitlines()
+        self.assertEqual(len(lines), len(stacks))
+        stack, micros = lines[-1].rsplit(" ", 1)
+        self.assertEqual(stack, "pre_receive;parse_tags")
+        self.assertGreaterEqual(int(micros), 0)
+
+    def test_cprofile(self):
+        test_obj = self._plugin(
+            BLACKOUT_REGEX_PROFILE=1, BLACKOUT_REGEX_PROFILE_CPROFILE=True
+        )
+        test_obj.pre_receive(make_alert(resource="test1"))
+        stats = pstats.Stats(
+            os.path.splitext(self.path.format(pid=os.getpid()))[0] + ".pstats"
+        )
+        self.assertTrue(any(name == "_apply_blackout" for _, _, name in stats.stats))